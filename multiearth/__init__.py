@@ -1,3 +1,17 @@
 """Download any remote sensing data from any provider using a single config."""
 __version__ = "0.1.0"
 __author__ = "Colorado J Reed"
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import ConfigSchema
+    from .reader import LazyAssets
+
+
+def open(cfg: "ConfigSchema") -> "LazyAssets":
+    """Plan the assets of a config for on-demand reads, see api.open_assets."""
+    # imported here so importing multiearth doesn't import all providers
+    from .api import open_assets
+
+    return open_assets(cfg)
@@ -1,16 +1,31 @@
 """API for downloading assets programmatically. Use cli.py to download assets from command line."""
 
+import asyncio
 import datetime
+import glob
+import json
 import os
+import socket
 import sys
-from typing import Any, List, cast
+import time
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Generator, List, Optional, cast
 
 from loguru import logger
 from omegaconf import OmegaConf
 
-from .config import CollectionSchema, ConfigSchema
+from .assets import ExtractAsset, ExtractAssetCollection, deduplicate_assets
+from .config import CollectionSchema, ConfigSchema, ProviderKey
 from .provider import get_provider
 from .provider.base import BaseProvider
+from .provider.earthdata_catalog import CATALOG_FILE, EarthDataCatalog
+from .provider.stac import STACProvider
+from .reader import LazyAssets
+from .util.blocks import BlockCache
+from .util.filter import unsupported_operators
+from .util.plan import asset_to_record, read_plan, record_to_asset, write_plan
+from .util.watch import WatchState
+from .util.work_queue import open_work_queue, run_queue_workers
 
 
 def extract_assets(cfg: ConfigSchema) -> bool:
@@ -21,16 +36,15 @@ def extract_assets(cfg: ConfigSchema) -> bool:
     Returns:
         True if all assets were extracted successfully, False otherwise
     """
+    _check_shard(cfg)
     # date and time string to identify the run
-    collection_names = [
-        cltn.id for pvdr in cfg.providers for cltn in pvdr.collections if cltn.id
-    ]
-    cfg.run_id = (
-        f"{'-'.join(sorted(collection_names))}_{datetime.datetime.now():%Y-%m-%d-%H:%m}"
-    )
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}"
+    if cfg.system.num_shards > 1:
+        cfg.run_id += _shard_suffix(cfg.system.shard_index, cfg.system.num_shards)
 
     _setup_logger(cfg)
     pvdrs = _initialize_providers(cfg)
+    _plan_assets(pvdrs)
 
     # TODO paralellize this (not sure how the logging would look though)
     all_succeed = True
@@ -39,6 +53,480 @@ def extract_assets(cfg: ConfigSchema) -> bool:
     return all_succeed
 
 
+def plan(cfg: ConfigSchema, plan_file: str) -> int:
+    """Search and plan the extraction once, and write the plan to execute it later.
+
+    The plan holds the assets of all shards, so it can be executed on several
+    machines (see execute_plan). Providers that don't plan their assets in advance
+    (e.g. Metloom) are extracted directly when the plan is executed.
+
+    Args:
+        cfg: a dict config object
+        plan_file: the plan to write, Parquet if it ends with .parquet and
+            gzip-compressed JSON lines otherwise
+    Returns:
+        the number of planned assets
+    """
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}_plan"
+    _setup_logger(cfg)
+    config_yaml = OmegaConf.to_yaml(cfg)
+    pvdrs = _initialize_providers(cfg)
+    _plan_assets(pvdrs)
+
+    records: List[Dict[str, Any]] = []
+    planned = ExtractAssetCollection()
+    for index, pvdr in enumerate(pvdrs):
+        pvdr_assets = pvdr.planned_assets if isinstance(pvdr, STACProvider) else None
+        if pvdr_assets is None:
+            logger.warning(f"{pvdr} is not planned in advance, execute extracts it")
+            continue
+        records.extend(asset_to_record(ast, index, pvdr.id.name) for ast in pvdr_assets)
+        planned += pvdr_assets
+    write_plan(plan_file, records, config_yaml)
+    summary, detailed = planned.summary()
+    logger.info("\n\n" + summary)
+    logger.debug(detailed)
+    logger.info(f"Wrote the plan of {len(records):,} assets to {plan_file}")
+    return len(records)
+
+
+def execute_plan(cfg: ConfigSchema, plan_file: str) -> bool:
+    """Extract the assets of a plan, without searching the providers again.
+
+    Shard the execution (system.num_shards and system.shard_index) to run it on
+    several machines.
+
+    Args:
+        cfg: the config the plan was planned with (see util.plan.read_plan_config),
+            e.g. with different system options
+        plan_file: the plan written by plan
+    Returns:
+        True if all assets were extracted successfully, False otherwise
+    """
+    _check_shard(cfg)
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}_execute"
+    if cfg.system.num_shards > 1:
+        cfg.run_id += _shard_suffix(cfg.system.shard_index, cfg.system.num_shards)
+    _setup_logger(cfg)
+    records, _ = read_plan(plan_file)
+    pvdrs = _initialize_providers(cfg)
+
+    planned = [ExtractAssetCollection() for _ in pvdrs]
+    for record in records:
+        index = int(record["provider_index"])
+        if index >= len(pvdrs) or pvdrs[index].id.name != record["provider"]:
+            raise ValueError(
+                f"The providers of the config don't match those of {plan_file}, "
+                + "execute it with the config it was planned with"
+            )
+        planned[index].add_asset(record_to_asset(record))
+    logger.info(f"Read the plan of {len(records):,} assets from {plan_file}")
+
+    all_succeed = True
+    for pvdr, pvdr_assets in zip(pvdrs, planned):
+        if isinstance(pvdr, STACProvider):
+            pvdr.planned_assets = pvdr_assets
+        else:
+            logger.info(f"{pvdr} is not in the plan, extracting it directly")
+        all_succeed &= pvdr.extract_assets(dry_run=cfg.system.dry_run)
+    return all_succeed
+
+
+def iter_extract(
+    cfg: ConfigSchema, prefetch: int = -1
+) -> Generator[ExtractAsset, None, None]:
+    """Extract the assets and yield each one as soon as it's available locally.
+
+    Assets that are already downloaded are yielded right away, then the downloads
+    as they finish, so a consumer (e.g. a training pipeline) can start before the
+    extraction is done. Providers that can't yield their assets (e.g. Metloom)
+    extract them first, before any assets are yielded.
+
+    Args:
+        cfg: a dict config object
+        prefetch: maximum number of downloads ahead of the consumer, -1 for
+            system.max_concurrent_extractions
+    Returns:
+        an iterator of the extracted assets, see their outfile (and converted_outfile)
+    """
+    _check_shard(cfg)
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}"
+    if cfg.system.num_shards > 1:
+        cfg.run_id += _shard_suffix(cfg.system.shard_index, cfg.system.num_shards)
+
+    _setup_logger(cfg)
+    pvdrs = _initialize_providers(cfg)
+    _plan_assets(pvdrs)
+
+    for pvdr in pvdrs:
+        if not pvdr.supports_iter_assets:
+            logger.warning(
+                f"{pvdr} does not support iterating over assets. "
+                + "Extracting its assets directly."
+            )
+            pvdr.extract_assets(dry_run=cfg.system.dry_run)
+    for pvdr in pvdrs:
+        if pvdr.supports_iter_assets:
+            yield from pvdr.iter_assets(prefetch, dry_run=cfg.system.dry_run)
+
+
+async def aiter_extract(
+    cfg: ConfigSchema, prefetch: int = -1
+) -> AsyncIterator[ExtractAsset]:
+    """Asynchronously yield each extracted asset as soon as it's available locally.
+
+    Same as iter_extract, which runs in the event loop's default executor so the
+    loop is not blocked while waiting for downloads.
+
+    Args:
+        cfg: a dict config object
+        prefetch: maximum number of downloads ahead of the consumer, -1 for
+            system.max_concurrent_extractions
+    Returns:
+        an async iterator of the extracted assets
+    """
+    loop = asyncio.get_running_loop()
+    assets = iter_extract(cfg, prefetch)
+    try:
+        while True:
+            ast: Optional[ExtractAsset] = await loop.run_in_executor(
+                None, next, assets, None
+            )
+            if ast is None:
+                break
+            yield ast
+    finally:
+        await loop.run_in_executor(None, assets.close)
+
+
+def open_assets(cfg: ConfigSchema) -> LazyAssets:
+    """Plan the assets of the config for read-through access, without downloading.
+
+    Reads fetch byte ranges on demand and are cached in memory (up to
+    system.block_cache_memory_mb) and in system.cache_dir (up to
+    system.block_cache_size_gb).
+
+    Args:
+        cfg: a dict config object
+    Returns:
+        the planned assets, see LazyAssets.open
+    """
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}_open"
+    _setup_logger(cfg)
+    pvdrs = _initialize_providers(cfg)
+    stac_pvdrs: List[STACProvider] = []
+    for pvdr in pvdrs:
+        if isinstance(pvdr, STACProvider):
+            # not deduplicated: every asset of the config is read by its own id
+            pvdr.plan_assets()
+            stac_pvdrs.append(pvdr)
+        else:
+            logger.warning(f"{pvdr} does not support reading assets on demand.")
+    cache = BlockCache(
+        cfg.system.cache_dir,
+        cfg.system.block_cache_size_gb,
+        cfg.system.block_cache_memory_mb,
+    )
+    return LazyAssets(stac_pvdrs, cache)
+
+
+def enqueue_assets(cfg: ConfigSchema) -> int:
+    """Plan the extraction and put its downloads into the shared system.work_queue.
+
+    Providers that don't support work queues extract their assets directly.
+
+    Args:
+        cfg: a dict config object
+    Returns:
+        the number of downloads added to the queue
+    """
+    if not cfg.system.work_queue:
+        raise ValueError("system.work_queue must be set to enqueue assets.")
+    _check_shard(cfg)
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}_enqueue"
+    _setup_logger(cfg)
+    queue = open_work_queue(cfg.system.work_queue)
+    pvdrs = _initialize_providers(cfg)
+    _plan_assets(pvdrs)
+
+    num_jobs = 0
+    for pvdr in pvdrs:
+        if pvdr.supports_work_queue:
+            num_jobs += pvdr.enqueue_assets(queue)
+        else:
+            logger.warning(
+                f"{pvdr} does not support work queues. Extracting its assets directly."
+            )
+            pvdr.extract_assets(dry_run=cfg.system.dry_run)
+    logger.info(f"Added {num_jobs:,} downloads to {cfg.system.work_queue}")
+    return num_jobs
+
+
+def work(cfg: ConfigSchema) -> bool:
+    """Run download workers on the shared system.work_queue until it is finished.
+
+    Any number of machines can run workers on the same queue, each with
+    system.max_concurrent_extractions worker processes.
+
+    Args:
+        cfg: a dict config object, only the system config is used
+    Returns:
+        True if all jobs of the queue succeeded, False otherwise
+    """
+    if not cfg.system.work_queue:
+        raise ValueError("system.work_queue must be set to run queue workers.")
+    cfg.run_id = f"worker-{socket.gethostname()}-{os.getpid()}_{_run_timestamp()}"
+    _setup_logger(cfg)
+    num_workers = cfg.system.max_concurrent_extractions
+    if num_workers < 0:
+        num_workers = os.cpu_count() or 1
+    logger.info(f"Starting {num_workers} workers on {cfg.system.work_queue}")
+    run_queue_workers(
+        cfg.system.work_queue,
+        partial(_run_queue_job, OmegaConf.to_yaml(cfg)),
+        num_workers,
+        cfg.system.lease_seconds,
+    )
+
+    queue = open_work_queue(cfg.system.work_queue)
+    counts = queue.counts()
+    logger.info(
+        "Work queue finished: "
+        + ", ".join(f"{num:,} {status}" for status, num in counts.items())
+    )
+    failed = queue.failed_jobs()
+    if len(failed) > 0:
+        fail_file = os.path.join(cfg.system.log_outdir, f"{cfg.run_id}_failed.log")
+        with open(fail_file, "w") as f:
+            for job_id, error in failed:
+                f.write(f"{job_id} <{error}>\n")
+        logger.warning(
+            f"Failed to download {len(failed)} assets: logged failures to {fail_file}"
+        )
+    return len(failed) == 0 and queue.is_finished()
+
+
+def watch(cfg: ConfigSchema, max_polls: int = -1) -> bool:
+    """Poll the collections for new items and extract their assets as they appear.
+
+    Every system.watch_interval_seconds, each collection is searched for the items
+    after its high-water mark (stored in system.cache_dir), so a poll only checks
+    and downloads the new assets. Failed assets are retried by the next poll.
+
+    Args:
+        cfg: a dict config object
+        max_polls: stop after this many polls, -1 to poll until interrupted
+    Returns:
+        True if all polls extracted their assets successfully, False otherwise
+    """
+    _check_shard(cfg)
+    cfg.run_id = f"{_run_prefix(cfg)}_{_run_timestamp()}_watch"
+    if cfg.system.num_shards > 1:
+        cfg.run_id += _shard_suffix(cfg.system.shard_index, cfg.system.num_shards)
+    _setup_logger(cfg)
+    state = WatchState(os.path.join(cfg.system.cache_dir, "watch.db"))
+    pvdrs = []
+    for pvdr in _initialize_providers(cfg):
+        if pvdr.supports_watch:
+            pvdrs.append(pvdr)
+        else:
+            logger.warning(f"{pvdr} does not support watch. Not watching it.")
+
+    all_succeed = True
+    num_polls = 0
+    while len(pvdrs) > 0 and (max_polls < 0 or num_polls < max_polls):
+        if num_polls > 0:
+            time.sleep(cfg.system.watch_interval_seconds)
+        num_polls += 1
+        logger.info(f"Polling for new items (poll {num_polls})")
+        for pvdr in pvdrs:
+            try:
+                all_succeed &= pvdr.poll_assets(state, dry_run=cfg.system.dry_run)
+            except Exception as ex:
+                # e.g. the API is unavailable, the next poll tries again
+                logger.error(f"Failed to poll {pvdr}: {ex}")
+                all_succeed = False
+    return all_succeed
+
+
+def open_catalog(cfg: ConfigSchema, refresh: bool = True) -> EarthDataCatalog:
+    """Open the local index of the collections of all EarthData subproviders.
+
+    The index is stored in system.cache_dir. A refresh crawls the subproviders that
+    weren't crawled in the last system.catalog_max_age_hours concurrently (with
+    system.max_concurrent_extractions requests), and only samples the items of the
+    collections that are new or changed.
+
+    Args:
+        cfg: a dict config object, only the system config is used
+        refresh: update the index before returning it
+    Returns:
+        the index, see EarthDataCatalog.search and EarthDataCatalog.lookup
+    """
+    catalog = EarthDataCatalog(os.path.join(cfg.system.cache_dir, CATALOG_FILE))
+    if refresh:
+        catalog.refresh(
+            max_age_hours=cfg.system.catalog_max_age_hours,
+            max_workers=max(1, cfg.system.max_concurrent_extractions),
+        )
+    return catalog
+
+
+def merge_shards(cfg: ConfigSchema) -> bool:
+    """Merge the manifests and failure logs of a sharded extraction.
+
+    Uses the latest manifest and failure log of each shard in system.log_outdir (the
+    log directory shared by the machines), and writes the merged manifest and failure
+    log to the same directory.
+
+    Args:
+        cfg: the config used for the sharded extraction
+    Returns:
+        True if every shard finished and extracted all of its assets, False otherwise
+    """
+    _check_shard(cfg)
+    num_shards = cfg.system.num_shards
+    prefix = _run_prefix(cfg)
+    log_outdir = cfg.system.log_outdir
+    os.makedirs(log_outdir, exist_ok=True)
+
+    records: Dict[str, Dict[str, Any]] = {}
+    failed_lines: List[str] = []
+    missing_shards = []
+    for shard_index in range(num_shards):
+        pattern = os.path.join(
+            glob.escape(log_outdir),
+            f"{glob.escape(prefix)}_*{_shard_suffix(shard_index, num_shards)}"
+            + "_manifest.jsonl",
+        )
+        manifests = sorted(glob.glob(pattern), key=os.path.getmtime)
+        if len(manifests) == 0:
+            missing_shards.append(shard_index)
+            continue
+        with open(manifests[-1]) as f:
+            for line in f:
+                record = json.loads(line)
+                records[record["id"]] = record
+        fail_file = manifests[-1][: -len("_manifest.jsonl")] + "_failed.log"
+        if os.path.exists(fail_file):
+            with open(fail_file) as f:
+                failed_lines.extend(f.readlines())
+
+    merged_id = f"{prefix}_merged-{num_shards}-shards"
+    manifest_file = os.path.join(log_outdir, f"{merged_id}_manifest.jsonl")
+    with open(manifest_file, "w") as f:
+        for record in records.values():
+            f.write(json.dumps(record) + "\n")
+    fail_file = os.path.join(log_outdir, f"{merged_id}_failed.log")
+    with open(fail_file, "w") as f:
+        f.writelines(failed_lines)
+
+    num_downloaded = sum(1 for r in records.values() if r["status"] == "downloaded")
+    num_failed = sum(1 for r in records.values() if r["status"] == "failed")
+    logger.info(
+        f"Merged {num_shards - len(missing_shards)} of {num_shards} shards: "
+        + f"{num_downloaded:,} of {len(records):,} assets downloaded, "
+        + f"{num_failed:,} failed. Wrote {manifest_file} and {fail_file}"
+    )
+    if len(missing_shards) > 0:
+        logger.warning(
+            f"No manifest found for shards {', '.join(map(str, missing_shards))}"
+        )
+    return len(missing_shards) == 0 and num_downloaded == len(records)
+
+
+def _plan_assets(pvdrs: List[BaseProvider]) -> None:
+    """Plan the assets of all providers and remove the duplicates across them.
+
+    Every shard plans all assets, so each shard removes the same duplicates.
+    """
+    plans = [
+        plan for plan in (pvdr.plan_assets() for pvdr in pvdrs) if plan is not None
+    ]
+    num_duplicates = deduplicate_assets(plans)
+    if num_duplicates > 0:
+        logger.info(
+            f"Found {num_duplicates:,} duplicate assets, "
+            + "which are copied from a single download"
+        )
+
+
+# providers rebuilt by the queue worker of this process, by their job options
+_queue_providers: Dict[str, STACProvider] = {}
+
+
+def _run_queue_job(config_yaml: str, payload: bytes) -> None:
+    """Run a work queue job with the provider it was planned with (see work).
+
+    Args:
+        config_yaml: the worker's config, whose system config the provider uses
+        payload: the JSON job, see STACProvider.enqueue_assets
+    """
+    job = json.loads(payload)
+    key = json.dumps([job["provider"], job["provider_kwargs"]], sort_keys=True)
+    if key not in _queue_providers:
+        cfg: Any = OmegaConf.merge(
+            OmegaConf.structured(ConfigSchema), OmegaConf.create(config_yaml)
+        )
+        pvdr = get_provider(
+            ProviderKey[job["provider"]], cfg, [], **job["provider_kwargs"]
+        )
+        if not isinstance(pvdr, STACProvider):
+            raise ValueError(f"{pvdr} does not support work queues.")
+        _queue_providers[key] = pvdr
+    _queue_providers[key].run_queue_job(job["asset"])
+
+
+def _run_prefix(cfg: ConfigSchema) -> str:
+    """Return the part of the run id that identifies the extracted collections."""
+    collection_names = [
+        cltn.id for pvdr in cfg.providers for cltn in pvdr.collections if cltn.id
+    ]
+    return "-".join(sorted(collection_names))
+
+
+def _run_timestamp() -> str:
+    """Return the part of the run id that identifies when it started."""
+    # no colons, which aren't allowed in Windows paths
+    return f"{datetime.datetime.now():%Y-%m-%d-%H%M%S}"
+
+
+def _shard_suffix(shard_index: int, num_shards: int) -> str:
+    """Return the run id suffix of a shard."""
+    return f"_shard{shard_index}-of-{num_shards}"
+
+
+def _check_shard(cfg: ConfigSchema) -> None:
+    """Check that the shard settings are valid."""
+    if cfg.system.num_shards < 1:
+        raise ValueError(f"system.num_shards must be >= 1, got {cfg.system.num_shards}")
+    if not 0 <= cfg.system.shard_index < cfg.system.num_shards:
+        raise ValueError(
+            f"system.shard_index must be in [0, {cfg.system.num_shards}), "
+            + f"got {cfg.system.shard_index}"
+        )
+
+
+def _check_search_options(collection: CollectionSchema) -> None:
+    """Check that a collection's filter and query can be applied client-side.
+
+    Providers fall back to evaluating them on the returned items, so unsupported
+    operators fail here instead of in the middle of a search.
+    """
+    for name in ("filter", "query"):
+        value = getattr(collection, name)
+        if not value:
+            continue
+        unsupported = unsupported_operators(
+            name, OmegaConf.to_container(OmegaConf.create(value))
+        )
+        if unsupported:
+            raise ValueError(
+                f"Unsupported {name} operators for {collection.id}: "
+                + ", ".join(sorted(unsupported))
+            )
+
+
 def _initialize_providers(cfg: ConfigSchema) -> List[BaseProvider]:
     """Initialize all of the providers with the collections they'll extract."""
     pvdrs: List[BaseProvider] = []
@@ -55,6 +543,7 @@ def _initialize_providers(cfg: ConfigSchema) -> List[BaseProvider]:
             }
             newcfg: Any = OmegaConf.merge(cfg.default_collection, non_empty_cfg)
             newcfg = cast(CollectionSchema, newcfg)
+            _check_search_options(newcfg)
             new_collections.append(newcfg)
             logger.info(
                 f"Extraction details for provider {pvdr_cfg.id} with collection "
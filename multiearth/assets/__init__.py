@@ -1,8 +1,14 @@
 """Models for asset extraction and management."""
 from dataclasses import dataclass, field
-from typing import Any, Dict, Iterator, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-__all__ = ["ExtractAsset", "ExtractAssetCollection"]
+from loguru import logger
+
+from ..util.cache import normalize_href
+from ..util.misc import shard_of
+from ..util.sink import copy_output
+
+__all__ = ["ExtractAsset", "ExtractAssetCollection", "deduplicate_assets"]
 
 
 @dataclass
@@ -27,8 +33,16 @@ class DownloadWrapper:
     asset: Any = field(default=None)
 
     def __call__(self) -> Any:
-        """Call the download function."""
-        return self.download_func(**self.download_kwargs)
+        """Call the download function, then copy the download to any duplicates."""
+        result = self.download_func(**self.download_kwargs)
+        if self.asset is not None:
+            for outfile in self.asset.duplicate_outfiles:
+                copy_output(
+                    self.asset.outfile,
+                    outfile,
+                    self.download_kwargs.get("storage_options"),
+                )
+        return result
 
 
 @dataclass
@@ -44,6 +58,20 @@ class ExtractAsset:
     filesize_mb: int = field(default=-1)
     provider_name: str = field(default="")
     collection_name: str = field(default="")
+    # (minx, miny, maxx, maxy) in EPSG:4326 to subset the asset to, None for all
+    clip_bounds: Optional[Tuple[float, float, float, float]] = field(default=None)
+    # format to convert the downloaded file to (see util.convert), empty for none
+    convert_to: str = field(default="")
+    remove_raw: bool = field(default=False)
+    converted_outfile: str = field(default="")
+    # ISO 8601 datetime of the asset's item
+    datetime: str = field(default="")
+    # datacube (Zarr store) to append the downloaded asset to, empty for none
+    cube_store: str = field(default="")
+    # outfiles of duplicate assets (same href), which get a copy of the download
+    duplicate_outfiles: List[str] = field(default_factory=list)
+    # HTTP validators (ETag, Last-Modified, Content-Length) of the download
+    validators: Dict[str, str] = field(default_factory=dict)
 
     def filesize_unknown(self) -> bool:
         """Return True if the filesize is unknown."""
@@ -103,6 +131,18 @@ class ExtractAssetCollection:
             if asset.filesize_mb > 0 and not asset.downloaded
         )
 
+    def num_duplicates(self) -> int:
+        """Return the number of duplicate assets served by the assets' downloads."""
+        return sum(len(asset.duplicate_outfiles) for asset in self)
+
+    def deduplicated_size(self) -> int:
+        """Return the size (in MB) of the downloads saved by removing duplicates."""
+        return sum(
+            asset.filesize_mb * len(asset.duplicate_outfiles)
+            for asset in self
+            if asset.filesize_mb > 0
+        )
+
     def unique_providers(self) -> List[str]:
         """Return a str list of unique providers in the collection."""
         return list({ast.provider_name for ast in self})
@@ -145,6 +185,11 @@ class ExtractAssetCollection:
             f"\n{'Collection size':<35} {self.total_size():,} MB"
             f"\n{'Size of remaining data to download':<35} {self.total_undownloaded_size():,} MB"
         )
+        if self.num_duplicates() > 0:
+            summary += (
+                f"\n{'Duplicate assets (not downloaded)':<35} {self.num_duplicates():,}"
+                f"\n{'Size saved by removing duplicates':<35} {self.deduplicated_size():,} MB"
+            )
         if self.num_assets_with_unknown_size() > 0:
             summary += (
                 "\nNumber of assets with unknown size:"
@@ -155,8 +200,81 @@ class ExtractAssetCollection:
         summary_details += f"\n{self._sep_str}\n"
         return summary, summary_details
 
+    def shard(self, shard_index: int, num_shards: int) -> "ExtractAssetCollection":
+        """Return the assets whose id hashes to the given shard.
+
+        Every machine computes the same partition, so the shards of a collection can
+        be extracted independently without any coordination.
+
+        Args:
+            shard_index (int): the shard to keep, in [0, num_shards)
+            num_shards (int): the total number of shards
+        """
+        sharded = ExtractAssetCollection()
+        for id, asts in self.assets.items():
+            if shard_of(id, num_shards) == shard_index:
+                sharded.assets[id] = list(asts)
+        return sharded
+
     def add_asset(self, asset: ExtractAsset) -> None:
         """Add an asset to the collection."""
         if asset.id not in self.assets:
             self.assets[asset.id] = []
         self.assets[asset.id].append(asset)
+
+
+def deduplicate_assets(collections: Iterable[ExtractAssetCollection]) -> int:
+    """Remove duplicate assets within and across collections (e.g. of providers).
+
+    Assets with the same canonical href (see normalize_href, which only drops the
+    signature query parameters), subset, conversion and datacube are downloaded
+    once, by the first of them, and copied to the outfiles of the others. Assets
+    that are converted or added to datacubes differently are downloaded separately
+    (linked from the asset cache if it's enabled), since copies are neither
+    converted nor added to datacubes. Hrefs that differ by any other
+    query parameter (e.g. ?id= of API download urls) are distinct assets. Of assets
+    with the same outfile but different hrefs, only the first is kept, so no two
+    downloads write the same path.
+
+    Args:
+        collections (Iterable[ExtractAssetCollection]): collections to deduplicate
+    Returns:
+        int: the number of assets removed
+    """
+    by_href: Dict[Tuple[Any, ...], ExtractAsset] = {}
+    by_outfile: Dict[str, ExtractAsset] = {}
+    num_removed = 0
+    for collection in collections:
+        for id, asts in list(collection.assets.items()):
+            kept: List[ExtractAsset] = []
+            for ast in asts:
+                href_key = (
+                    normalize_href(ast.asset.href),
+                    ast.clip_bounds,
+                    ast.convert_to,
+                    ast.remove_raw,
+                    ast.cube_store,
+                )
+                if ast.outfile in by_outfile:
+                    other = by_outfile[ast.outfile]
+                    if by_href.get(href_key) is not other:
+                        logger.warning(
+                            f"{ast.id} and {other.id} have the same outfile "
+                            + f"{ast.outfile}, only extracting {other.id}"
+                        )
+                    num_removed += 1
+                    continue
+                if href_key in by_href:
+                    primary = by_href[href_key]
+                    primary.duplicate_outfiles.append(ast.outfile)
+                    by_outfile[ast.outfile] = primary
+                    num_removed += 1
+                    continue
+                by_href[href_key] = ast
+                by_outfile[ast.outfile] = ast
+                kept.append(ast)
+            if len(kept) > 0:
+                collection.assets[id] = kept
+            else:
+                del collection.assets[id]
+    return num_removed
@@ -1,29 +1,84 @@
-"""CLI interface to MultiEarth."""
+"""CLI interface to MultiEarth.
+
+Usage: python -m multiearth.cli [command] --config CONFIG [key=value ...]
+
+Commands:
+    extract: extract the assets of the config (default)
+    merge: merge the manifests and failure logs of a sharded extraction
+    enqueue: plan the extraction and put its downloads into system.work_queue
+    work: download the jobs of system.work_queue (the config is optional)
+    watch: poll the collections for new items and extract them as they appear
+    catalog: index the collections of all EarthData subproviders (the config is
+        optional), or search the index with --search
+    plan PLAN_FILE: plan the extraction and write it to PLAN_FILE
+    execute PLAN_FILE: extract the assets of PLAN_FILE without searching (the
+        config is optional, defaulting to the one the plan was planned with)
+"""
 import argparse
-from typing import Any, List, Tuple, cast
+import sys
+from typing import Any, List, Optional, Tuple, cast
 
 import omegaconf
 from loguru import logger
 from omegaconf import OmegaConf
 
-from multiearth.api import extract_assets
+from multiearth.api import (
+    enqueue_assets,
+    execute_plan,
+    extract_assets,
+    merge_shards,
+    open_catalog,
+    plan,
+    watch,
+    work,
+)
 from multiearth.config import ConfigSchema
+from multiearth.util.plan import read_plan_config
+
+COMMANDS = [
+    "extract",
+    "merge",
+    "enqueue",
+    "work",
+    "watch",
+    "catalog",
+    "plan",
+    "execute",
+]
 
 
-def _get_args() -> Tuple[argparse.Namespace, List[str]]:
-    """Return the parsed command line arguments."""
+def _get_args(argv: List[str]) -> Tuple[str, argparse.Namespace, List[str]]:
+    """Return the command and the parsed command line arguments."""
+    command = "extract"
+    if len(argv) > 0 and argv[0] in COMMANDS:
+        command, argv = argv[0], argv[1:]
     parser = argparse.ArgumentParser(
         description="Download any data from any provider with one config"
     )
+    if command in ("plan", "execute"):
+        parser.add_argument("plan_file", type=str, help="Path to the plan file")
     parser.add_argument("--config", type=str, help="Path to config file")
-    return parser.parse_known_args()
+    parser.add_argument(
+        "--search",
+        type=str,
+        default=None,
+        help="catalog: search the indexed collection ids and titles instead",
+    )
+    args, extra_args = parser.parse_known_args(argv)
+    return command, args, extra_args
 
 
-if __name__ == "__main__":
-    args, extra_args = _get_args()
+def _load_config(
+    config_file: Optional[str], extra_args: List[str], config_yaml: str = ""
+) -> ConfigSchema:
+    """Load the config file (or else config_yaml) and merge the command line overrides."""
     schema: ConfigSchema = OmegaConf.structured(ConfigSchema)
-    incfg = OmegaConf.load(args.config)
-    cfg: Any = OmegaConf.merge(schema, incfg)  # start with Any for mypy's sake
+    cfg: Any = schema  # start with Any for mypy's sake
+    if config_file:
+        incfg = OmegaConf.load(config_file)
+        cfg = OmegaConf.merge(schema, incfg)
+    elif config_yaml:
+        cfg = OmegaConf.merge(schema, OmegaConf.create(config_yaml))
 
     if len(extra_args) > 0:
         cli_cfg = OmegaConf.from_cli(extra_args)
@@ -39,10 +94,70 @@ if __name__ == "__main__":
 
             exit(1)
 
-    use_cfg: ConfigSchema = cast(ConfigSchema, cfg)  # for mypy
+    return cast(ConfigSchema, cfg)  # for mypy
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run a MultiEarth command."""
+    command, args, extra_args = _get_args(sys.argv[1:] if argv is None else argv)
+    if not args.config and command not in ("work", "catalog", "execute"):
+        logger.error(f"--config is required for the {command} command")
+        exit(1)
+    config_yaml = ""
+    if command == "execute" and not args.config:
+        config_yaml = read_plan_config(args.plan_file)
+    use_cfg = _load_config(args.config, extra_args, config_yaml)
+
+    if command == "work":
+        success = work(use_cfg)
+        logger.info(
+            "All queued assets successfully extracted!"
+            if success
+            else "Some queued assets were not extracted -- see logs for details."
+        )
+        return
+    if command == "catalog":
+        catalog = open_catalog(use_cfg, refresh=args.search is None)
+        if args.search is None:
+            logger.info(f"Indexed {catalog.num_collections():,} collections")
+            return
+        for entry in catalog.search(args.search):
+            extent = f"{entry.start_datetime or '..'}/{entry.end_datetime or '..'}"
+            print(
+                f"{entry.subprovider_id:<15} {entry.collection_id:<40} {extent}\n"
+                + f"    {entry.title}\n"
+                + f"    assets: {', '.join(entry.asset_keys) or 'unknown'}"
+            )
+        return
+    if command == "watch":
+        watch(use_cfg)
+        return
+    if command == "plan":
+        plan(use_cfg, args.plan_file)
+        return
+    if command == "execute":
+        success = execute_plan(use_cfg, args.plan_file)
+        logger.info(
+            "All planned assets successfully extracted!"
+            if success
+            else "Some planned assets were not extracted -- see logs for details."
+        )
+        return
+    if command == "enqueue":
+        enqueue_assets(use_cfg)
+        return
+    if command == "merge":
+        success = merge_shards(use_cfg)
+        logger.info(
+            "All shards successfully extracted!"
+            if success
+            else "Some shards or assets were not extracted -- see logs for details."
+        )
+        return
+
     logger.info(f"\nUsing config: {OmegaConf.to_yaml(use_cfg)}")
     success = extract_assets(use_cfg)
-    if cfg.system.dry_run:
+    if use_cfg.system.dry_run:
         logger.info("Dry run complete.")
     else:
         logger.info(
@@ -50,3 +165,7 @@ if __name__ == "__main__":
             if success
             else "Some assets were not extracted -- see logs for details."
         )
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,21 @@ class SystemSchema:
     max_download_attempts: int = 3
     remove_existing_if_wrong_size: bool = False
     query_asset_sizes: bool = True
+    aoi_simplify_tolerance: float = 0.0
+    aoi_search_tolerance: float = 0.01
+    cache_dir: str = "~/.cache/multiearth"
+    shard_index: int = 0
+    num_shards: int = 1
+    work_queue: str = ""
+    lease_seconds: float = 300.0
+    storage_options: Dict[str, Any] = field(default_factory=dict)
+    max_concurrent_conversions: int = 2
+    asset_cache_size_gb: float = 0.0
+    refresh: bool = False
+    watch_interval_seconds: float = 300.0
+    block_cache_size_gb: float = 10.0
+    block_cache_memory_mb: float = 512.0
+    catalog_max_age_hours: float = 24.0
 
 
 @dataclass
@@ -37,6 +52,17 @@ class CollectionSchema:
     datetime: Optional[str] = None
     aoi_file: Optional[str] = None
     max_items: int = -1
+    clip_to_aoi: bool = False
+    convert_to: str = ""
+    remove_raw: bool = False
+    build_cube: bool = False
+    min_cover_time_bin: str = ""
+    # STAC API search filters, applied to the items client-side if unsupported
+    filter: Optional[Dict[str, Any]] = None
+    query: Optional[Dict[str, Any]] = None
+    sortby: Optional[List[str]] = None
+    # item property ("datetime" or e.g. "updated") whose high-water mark watch keeps
+    watch_property: str = "datetime"
 
 
 @dataclass
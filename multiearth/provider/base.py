@@ -1,9 +1,12 @@
 """Provides an abstract base class for all providers."""
 
 import abc
-from typing import Any, List
+from typing import Any, Iterator, List, Optional
 
+from ..assets import ExtractAsset, ExtractAssetCollection
 from ..config import CollectionSchema, ConfigSchema, ProviderKey
+from ..util.watch import WatchState
+from ..util.work_queue import WorkQueue
 
 
 class BaseProvider(abc.ABC):
@@ -13,6 +16,10 @@ class BaseProvider(abc.ABC):
     description: str
     cfg: ConfigSchema
     collections: List[CollectionSchema]
+    # optional capabilities, the api checks them before calling the methods
+    supports_iter_assets: bool = False
+    supports_work_queue: bool = False
+    supports_watch: bool = False
 
     def __init__(
         self,
@@ -51,3 +58,59 @@ class BaseProvider(abc.ABC):
         Returns: True if all assets extracted successfully, False otherwise.
         """
         pass
+
+    def plan_assets(self) -> Optional[ExtractAssetCollection]:
+        """Find the assets to extract, before extract_assets or enqueue_assets.
+
+        The planned assets can be deduplicated across providers (see
+        deduplicate_assets) before they are extracted.
+
+        Returns:
+            Optional[ExtractAssetCollection]: the planned assets, None if the provider
+                does not plan its assets in advance
+        """
+        return None
+
+    def enqueue_assets(self, queue: WorkQueue) -> int:
+        """Plan the extraction and put the downloads into a shared work queue.
+
+        Only called if supports_work_queue is True.
+
+        Returns:
+            int: the number of downloads added to the queue
+        """
+        raise NotImplementedError(
+            f"{self} does not support work queues (supports_work_queue)."
+        )
+
+    def iter_assets(
+        self, prefetch: int = -1, dry_run: bool = False
+    ) -> Iterator[ExtractAsset]:
+        """Extract the assets and yield each one as soon as it's available locally.
+
+        Only called if supports_iter_assets is True.
+
+        Args:
+            prefetch (int): maximum number of downloads ahead of the consumer, -1
+                for system.max_concurrent_extractions
+            dry_run (bool): only yield the assets that are already downloaded
+        Returns:
+            Iterator[ExtractAsset]: the extracted assets
+        """
+        raise NotImplementedError(
+            f"{self} does not support iterating over assets (supports_iter_assets)."
+        )
+
+    def poll_assets(self, state: WatchState, dry_run: bool = False) -> bool:
+        """Extract the assets that are new since the last poll, for watch.
+
+        Only called if supports_watch is True.
+
+        Args:
+            state (WatchState): the high-water marks of the watched collections
+            dry_run (bool): only log the new assets, without extracting them or
+                advancing the marks
+        Returns:
+            bool: True if all new assets were extracted successfully
+        """
+        raise NotImplementedError(f"{self} does not support watch (supports_watch).")
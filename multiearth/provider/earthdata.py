@@ -3,11 +3,23 @@
 https://www.earthdata.nasa.gov/
 """
 
-from typing import Any, List
+import os
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
+import pystac
 import requests
+import shapely.geometry
+from loguru import logger
 
+from ..assets import ExtractAsset
 from ..config import CollectionSchema, ConfigSchema, ProviderKey
+from ..util.cog import try_clip_cog
+from ..util.misc import stream_download
+from ..util.s3 import create_s3_client, s3_ranged_download
+from .earthdata_auth import EARTHDATA_S3_CREDENTIALS, EarthDataAuth
+from .earthdata_catalog import CATALOG_FILE, EarthDataCatalog
+from .earthdata_cmr import CMRGranuleSearch
 from .earthdata_providers import EARTHDATA_PROVIDERS
 from .stac import STACProvider
 
@@ -17,6 +29,8 @@ class EarthDataProvider(STACProvider):
 
     _default_client_url: str = ""
     description: str = "EarthData Provider"
+    transfer_modes = ["https", "s3"]
+    search_backends = ["stac", "cmr"]
 
     def __init__(
         self,
@@ -25,15 +39,39 @@ class EarthDataProvider(STACProvider):
         collections: List[CollectionSchema],
         client_url: str = "",
         subprovider_id: str = "",
+        transfer_mode: str = "https",
+        s3_endpoint_url: str = "",
+        s3_credentials_url: str = "",
+        search_backend: str = "stac",
+        cmr_search_slices: int = 8,
         **kwargs: Any,
     ) -> None:
-        """Use one of the EarthData Providers, such as NSIDC."""
+        """Use one of the EarthData Providers, such as NSIDC.
+
+        Args:
+            transfer_mode (str): "https", or "s3" to read assets of cloud-hosted
+                collections directly from S3 (in us-west-2), falling back to HTTPS
+                for assets that can't be read from S3
+            s3_endpoint_url (str): S3-compatible endpoint to use instead of AWS, e.g.
+                a local MinIO server
+            s3_credentials_url (str): endpoint for temporary S3 credentials, defaults
+                to the subprovider's endpoint; with an s3_endpoint_url and no
+                credentials endpoint, the default boto3 credentials are used
+            search_backend (str): "stac" to search with CMR-STAC, or "cmr" to search
+                the CMR granule search API directly, which is faster and has no
+                paging limit for collections with many granules
+            cmr_search_slices (int): number of temporal slices of the datetime range
+                that the cmr search backend searches concurrently
+        """
+        if client_url == "" and subprovider_id == "":
+            subprovider_id = _resolve_subprovider(cfg.system.cache_dir, collections)
         if client_url == "" and subprovider_id == "":
             raise ValueError(
                 "Must specify either client_url or provider_id for EarthDataProvider."
                 f"\nProvider ids: {EARTHDATA_PROVIDERS.keys()}\n"
                 "Specify using, e.g., \nprovider: \n\tname: EARTHDATA\n\tkwargs: "
-                "\n\t\tprovider_id: NSIDC"
+                "\n\t\tprovider_id: NSIDC\n"
+                "or index the collections of all subproviders with the catalog command"
             )
 
         if client_url == "":
@@ -45,17 +83,234 @@ class EarthDataProvider(STACProvider):
                     + f"{', '.join(list(EARTHDATA_PROVIDERS.keys()))}"
                 )
 
+        if transfer_mode not in self.transfer_modes:
+            raise ValueError(
+                f"Unknown transfer_mode {transfer_mode} for EarthDataProvider, "
+                + f"use one of {', '.join(self.transfer_modes)}"
+            )
+        if transfer_mode == "s3" and not s3_credentials_url:
+            s3_credentials_url = EARTHDATA_S3_CREDENTIALS.get(subprovider_id, "")
+        if transfer_mode == "s3" and not (s3_credentials_url or s3_endpoint_url):
+            logger.warning(
+                f"No S3 credentials endpoint known for {subprovider_id}, "
+                + "set s3_credentials_url to use S3, falling back to HTTPS"
+            )
+            transfer_mode = "https"
+        if search_backend not in self.search_backends:
+            raise ValueError(
+                f"Unknown search_backend {search_backend} for EarthDataProvider, "
+                + f"use one of {', '.join(self.search_backends)}"
+            )
+        self.search_backend = search_backend
+        self.cmr_search_slices = cmr_search_slices
+        # the CMR provider id is the last component of the CMR-STAC url
+        self.subprovider_id = subprovider_id or client_url.rstrip("/").split("/")[-1]
+        self.transfer_mode = transfer_mode
+        self.s3_endpoint_url = s3_endpoint_url
+        self.s3_credentials_url = s3_credentials_url
+
+        self.auth = EarthDataAuth(cfg.system.cache_dir)
         super().__init__(id, cfg, collections, client_url)
 
     def check_authorization(self) -> bool:
-        """Check if the provider is authorized."""
-        authd = False
-        # hardcoded api endpoint - should succeed if .netrc file in place
+        """Check if the provider is authorized.
+
+        Obtains (or reuses a cached) EarthData Login token, which requires the
+        credentials to be in place, e.g. in the .netrc file.
+        """
         # TODO check alaska auth and EULA agreement if using alaska subprovider
-        r = requests.get("https://urs.earthdata.nasa.gov/api/users/tokens")
         try:
-            r.raise_for_status()
-            authd = True
-        except requests.HTTPError:
-            pass  # will return false
-        return authd
+            self.auth.get_token()
+        except (requests.RequestException, ValueError) as ex:
+            logger.error(f"Unable to obtain an EarthData token: {ex}")
+            return False
+        return True
+
+    def _region_to_items(
+        self,
+        region: Union[shapely.geometry.Polygon, shapely.geometry.MultiPolygon],
+        datetime: str,
+        collection: str,
+        max_items: Optional[int],
+        **search_options: Any,
+    ) -> Iterator[pystac.Item]:
+        """Search the items with CMR-STAC or the CMR granule search API."""
+        if self.search_backend == "stac":
+            return super()._region_to_items(
+                region, datetime, collection, max_items, **search_options
+            )
+        search = CMRGranuleSearch(
+            self.subprovider_id,
+            self._get_requests_session(),
+            num_slices=self.cmr_search_slices,
+            max_attempts=self.cfg.system.max_download_attempts,
+        )
+        return iter(
+            search.search(
+                region, datetime, collection, -1 if max_items is None else max_items
+            )
+        )
+
+    def _supports_search_option(self, name: str) -> bool:
+        """Return True if the search backend supports a search option."""
+        if self.search_backend == "cmr":
+            return False
+        return super()._supports_search_option(name)
+
+    def _queue_provider_kwargs(self) -> Dict[str, Any]:
+        """Rebuild the resolved subprovider and transfer options in queue workers."""
+        kwargs = super()._queue_provider_kwargs()
+        kwargs.update(
+            subprovider_id=self.subprovider_id,
+            transfer_mode=self.transfer_mode,
+            s3_endpoint_url=self.s3_endpoint_url,
+            s3_credentials_url=self.s3_credentials_url,
+        )
+        return kwargs
+
+    def _get_requests_session(self) -> requests.Session:
+        """Return the authenticated, pooled EarthData session."""
+        return self.auth.session(self.cfg.system.max_concurrent_extractions)
+
+    def _get_download_fn(self) -> Callable[..., None]:
+        """Download with the shared token and a pooled session per worker."""
+        if self.transfer_mode == "s3":
+            return partial(
+                _earthdata_download_fn,
+                auth=self.auth,
+                s3_credentials_url=self.s3_credentials_url,
+                s3_endpoint_url=self.s3_endpoint_url,
+            )
+        return partial(_earthdata_download_fn, auth=self.auth)
+
+
+def _resolve_subprovider(cache_dir: str, collections: List[CollectionSchema]) -> str:
+    """Return the subprovider of the collections from the catalog, empty if unknown."""
+    path = os.path.join(os.path.expanduser(cache_dir), CATALOG_FILE)
+    if not os.path.exists(path):
+        return ""
+    catalog = EarthDataCatalog(path)
+    candidates: Optional[Set[str]] = None
+    for coll in collections:
+        found = {entry.subprovider_id for entry in catalog.lookup(coll.id or "")}
+        candidates = found if candidates is None else candidates & found
+    if not candidates:
+        return ""
+    if len(candidates) > 1:
+        raise ValueError(
+            "The collections are hosted by several subproviders, set subprovider_id "
+            + f"to one of {', '.join(sorted(candidates))}"
+        )
+    subprovider_id = candidates.pop()
+    logger.info(f"Found the collections in the catalog of subprovider {subprovider_id}")
+    return subprovider_id
+
+
+# S3 clients per worker process, and whether S3 is unavailable in this process
+_s3_clients: Dict[Tuple[str, str, str], Any] = {}
+_s3_disabled: Set[Tuple[str, str]] = set()
+
+
+def _earthdata_download_fn(
+    asset_to_download_url: Callable[[pystac.Asset], str],
+    ast: ExtractAsset,
+    auth: EarthDataAuth,
+    s3_credentials_url: str = "",
+    s3_endpoint_url: str = "",
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Asset download function for multiproc download with the shared EarthData token.
+
+    If an S3 credentials or endpoint url is given, assets with an S3 href are read
+    directly from S3, falling back to HTTPS if that fails.
+    """
+    s3_url = _asset_to_s3_url(ast.asset)
+    s3_key = (s3_credentials_url, s3_endpoint_url)
+    # subsets are read with range requests over HTTPS
+    use_s3 = s3_url and any(s3_key) and ast.clip_bounds is None
+    if use_s3 and s3_key not in _s3_disabled:
+        try:
+            client = _get_s3_client(auth, s3_credentials_url, s3_endpoint_url)
+            ast.validators = s3_ranged_download(
+                client, s3_url, ast.outfile, storage_options
+            )
+            return
+        except Exception as ex:
+            # any S3 failure falls back to HTTPS for this asset, and missing boto3 or
+            # denied access (e.g., when running outside us-west-2) disables S3 for
+            # the worker
+            if _is_permanent_s3_error(ex):
+                _s3_disabled.add(s3_key)
+                logger.warning(f"Unable to use S3, falling back to HTTPS: {ex}")
+            else:
+                logger.debug(f"S3 download of {s3_url} failed, using HTTPS: {ex}")
+
+    url = asset_to_download_url(ast.asset)
+    try:
+        session = auth.session()
+        if ast.clip_bounds is not None and try_clip_cog(
+            url,
+            ast.outfile,
+            ast.clip_bounds,
+            headers={"Authorization": str(session.headers["Authorization"])},
+            storage_options=storage_options,
+        ):
+            return
+        ast.validators = stream_download(
+            url, ast.outfile, session=session, storage_options=storage_options
+        )
+    except requests.HTTPError as ex:
+        if ex.response is not None and ex.response.status_code == 401:
+            # the token was revoked or expired early, refresh it for the retry
+            auth.refresh_token()
+        raise
+
+
+def _asset_to_s3_url(asset: pystac.Asset) -> str:
+    """Return the s3:// href of the asset, or an empty string if it has none."""
+    if asset.href.startswith("s3://"):
+        return str(asset.href)
+    alternate = asset.extra_fields.get("alternate", {})
+    href = (
+        alternate.get("s3", {}).get("href", "") if isinstance(alternate, dict) else ""
+    )
+    return str(href) if str(href).startswith("s3://") else ""
+
+
+def _get_s3_client(
+    auth: EarthDataAuth, s3_credentials_url: str, s3_endpoint_url: str
+) -> Any:
+    """Return this process's S3 client for the current temporary credentials."""
+    credentials = None
+    if s3_credentials_url:
+        credentials = auth.s3_credentials(s3_credentials_url)
+    key = (
+        s3_credentials_url,
+        s3_endpoint_url,
+        credentials["accessKeyId"] if credentials else "",
+    )
+    if key not in _s3_clients:
+        # drop the clients with expired credentials for this endpoint
+        for old_key in [k for k in _s3_clients if k[:2] == key[:2]]:
+            del _s3_clients[old_key]
+        _s3_clients[key] = create_s3_client(credentials, endpoint_url=s3_endpoint_url)
+    return _s3_clients[key]
+
+
+def _is_permanent_s3_error(ex: Exception) -> bool:
+    """Return True if S3 will keep failing in this process, e.g., without access.
+
+    Transient failures (e.g., a timeout of the s3credentials endpoint) only fall back
+    to HTTPS for the failed asset.
+    """
+    if isinstance(ex, ImportError):
+        return True
+    if isinstance(ex, requests.HTTPError):
+        # the s3credentials endpoint denied the credentials
+        return ex.response is not None and ex.response.status_code in (401, 403)
+    # botocore ClientError
+    response = getattr(ex, "response", None)
+    if isinstance(response, dict):
+        code = str(response.get("Error", {}).get("Code", ""))
+        return code in ("AccessDenied", "403", "InvalidAccessKeyId")
+    return False
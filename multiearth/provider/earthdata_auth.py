@@ -0,0 +1,219 @@
+"""EarthData Login authentication shared between the EarthData download workers.
+
+A bearer token is obtained once from EarthData Login (URS) using the credentials in
+~/.netrc (or the EARTHDATA_USERNAME and EARTHDATA_PASSWORD environment variables)
+and stored in a token file, so every worker process reuses it until it expires.
+Each process keeps a single pooled session that sends the token to the EarthData
+hosts (and keeps any cookies set by them) for all of its downloads.
+
+Collections hosted in AWS (us-west-2) can also be read directly from S3 with
+temporary credentials from the DAAC's s3credentials endpoint.
+"""
+
+import json
+import netrc
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+__all__ = ["EARTHDATA_S3_CREDENTIALS", "EarthDataAuth", "EarthDataSession"]
+
+URS_HOST = "urs.earthdata.nasa.gov"
+
+# temporary S3 credential endpoints of the cloud-hosted subproviders
+EARTHDATA_S3_CREDENTIALS = {
+    "ASF": "https://sentinel1.asf.alaska.edu/s3credentials",
+    "GES_DISC": "https://data.gesdisc.earthdata.nasa.gov/s3credentials",
+    "GHRC_CLOUD": "https://data.ghrc.earthdata.nasa.gov/s3credentials",
+    "LARC_CLOUD": "https://data.asdc.earthdata.nasa.gov/s3credentials",
+    "LPCLOUD": "https://data.lpdaac.earthdatacloud.nasa.gov/s3credentials",
+    "NSIDC_CPRD": "https://data.nsidc.earthdatacloud.nasa.gov/s3credentials",
+    "ORNL_CLOUD": "https://data.ornldaac.earthdata.nasa.gov/s3credentials",
+    "POCLOUD": "https://archive.podaac.earthdata.nasa.gov/s3credentials",
+}
+
+# EarthData Login (URS) and the DAAC download and s3credentials hosts, which accept
+# its bearer tokens. Subdomains of these hosts match too, other hosts of the same
+# organizations (or S3 presigned urls the DAACs redirect to) don't get the token.
+_EARTHDATA_HOSTS = frozenset(
+    [
+        URS_HOST,
+        "opendap.earthdata.nasa.gov",
+        # on-premises DAACs
+        "e4ftl01.cr.usgs.gov",
+        "n5eil01u.ecs.nsidc.org",
+        "daac.ornl.gov",
+        "gesdisc.eosdis.nasa.gov",
+        "ladsweb.modaps.eosdis.nasa.gov",
+        "sentinel1.asf.alaska.edu",
+        "datapool.asf.alaska.edu",
+    ]
+    # cloud-hosted DAACs
+    + [urlparse(url).netloc for url in EARTHDATA_S3_CREDENTIALS.values()]
+)
+
+# one pooled session per worker process and token file
+_sessions: Dict[str, "EarthDataSession"] = {}
+# temporary S3 credentials and their expiration per worker process and endpoint
+_s3_credentials: Dict[str, Tuple[Dict[str, str], datetime]] = {}
+
+
+class EarthDataSession(requests.Session):
+    """Requests session that keeps the bearer token on redirects between EarthData hosts.
+
+    requests drops the Authorization header whenever a redirect changes the host, but
+    the DAACs redirect between their own hosts and URS, all of which accept the token.
+    Credentials from ~/.netrc for the new host still take precedence, as in requests.
+    """
+
+    def __init__(self, token: str, pool_maxsize: int = 10) -> None:
+        """Set up the session with the bearer token and a connection pool."""
+        super().__init__()
+        self.headers["Authorization"] = f"Bearer {token}"
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def rebuild_auth(
+        self, prepared_request: requests.PreparedRequest, response: requests.Response
+    ) -> None:
+        """Keep the Authorization header if the redirect stays on EarthData hosts."""
+        authorization = prepared_request.headers.get("Authorization")
+        super().rebuild_auth(prepared_request, response)  # type: ignore
+        if authorization is None or "Authorization" in prepared_request.headers:
+            return
+        original = urlparse(str(response.request.url)).hostname
+        redirect = urlparse(str(prepared_request.url)).hostname
+        if _is_earthdata_host(original) and _is_earthdata_host(redirect):
+            prepared_request.headers["Authorization"] = authorization
+
+
+class EarthDataAuth:
+    """Obtain, cache and refresh an EarthData Login bearer token.
+
+    EarthDataAuth only holds file paths, so it can be passed to download worker
+    processes, which then read the token from the shared token file.
+    """
+
+    # refresh tokens that expire within this margin
+    _expiry_margin = timedelta(days=1)
+    # refresh S3 credentials (valid for one hour) that expire within this margin
+    _s3_expiry_margin = timedelta(minutes=5)
+
+    def __init__(self, cache_dir: str) -> None:
+        """Set up the token file location.
+
+        Args:
+            cache_dir (str): directory that stores the token file
+        """
+        self.token_file = os.path.join(
+            os.path.expanduser(cache_dir), "earthdata_token.json"
+        )
+
+    def get_token(self) -> str:
+        """Return a valid bearer token, obtaining a new one if needed."""
+        token = self._read_token()
+        if token is None:
+            token = self.refresh_token()
+        return token
+
+    def refresh_token(self) -> str:
+        """Obtain a token from EarthData Login and store it in the token file."""
+        username, password = _get_credentials()
+        r = requests.post(
+            f"https://{URS_HOST}/api/users/find_or_create_token",
+            auth=(username, password),
+            timeout=30,
+        )
+        r.raise_for_status()
+        res = r.json()
+        token = str(res["access_token"])
+        expiration = datetime.strptime(res["expiration_date"], "%m/%d/%Y")
+
+        os.makedirs(os.path.dirname(self.token_file), exist_ok=True)
+        tmp_file = f"{self.token_file}.{os.getpid()}.tmp"
+        with open(
+            os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+        ) as f:
+            json.dump({"token": token, "expiration": expiration.isoformat()}, f)
+        os.replace(tmp_file, self.token_file)
+        logger.debug(f"Obtained EarthData token, expires {expiration:%Y-%m-%d}")
+        return token
+
+    def session(self, pool_maxsize: int = 10) -> EarthDataSession:
+        """Return this process's authenticated session, creating it if needed."""
+        token = self.get_token()
+        sess = _sessions.get(self.token_file)
+        if sess is None or sess.headers.get("Authorization") != f"Bearer {token}":
+            sess = EarthDataSession(token, pool_maxsize=pool_maxsize)
+            _sessions[self.token_file] = sess
+        return sess
+
+    def s3_credentials(self, credentials_url: str) -> Dict[str, str]:
+        """Return this process's temporary S3 credentials, refreshing them if needed.
+
+        Args:
+            credentials_url (str): the DAAC's s3credentials endpoint
+        Returns:
+            Dict[str, str]: credentials with the keys accessKeyId, secretAccessKey and
+                sessionToken
+        """
+        now = datetime.now(timezone.utc)
+        cached = _s3_credentials.get(credentials_url)
+        if cached is not None and cached[1] - self._s3_expiry_margin > now:
+            return cached[0]
+        r = self.session().get(credentials_url, timeout=30)
+        r.raise_for_status()
+        credentials = {k: str(v) for k, v in r.json().items()}
+        try:
+            # e.g., "2022-11-30 18:37:52+00:00"
+            expiration = datetime.fromisoformat(credentials["expiration"])
+        except (KeyError, ValueError):
+            expiration = now + timedelta(hours=1)
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        _s3_credentials[credentials_url] = (credentials, expiration)
+        return credentials
+
+    def _read_token(self) -> Optional[str]:
+        """Return the cached token if it exists and is not about to expire."""
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            with open(self.token_file) as f:
+                cached = json.load(f)
+            expiration = datetime.fromisoformat(cached["expiration"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if expiration - self._expiry_margin < datetime.now():
+            return None
+        return str(cached["token"])
+
+
+def _get_credentials() -> Tuple[str, str]:
+    """Return the EarthData Login username and password from the env or ~/.netrc."""
+    username = os.environ.get("EARTHDATA_USERNAME", "")
+    password = os.environ.get("EARTHDATA_PASSWORD", "")
+    if username and password:
+        return username, password
+    try:
+        auth = netrc.netrc().authenticators(URS_HOST)
+    except (FileNotFoundError, netrc.NetrcParseError) as ex:
+        raise ValueError(f"Unable to read EarthData credentials from ~/.netrc: {ex}")
+    if auth is None or not auth[0] or not auth[2]:
+        raise ValueError(f"No credentials for {URS_HOST} in ~/.netrc")
+    return str(auth[0]), str(auth[2])
+
+
+def _is_earthdata_host(host: Optional[str]) -> bool:
+    """Return True if the host accepts EarthData Login tokens."""
+    if host is None:
+        return False
+    return any(
+        host == known or host.endswith(f".{known}") for known in _EARTHDATA_HOSTS
+    )
@@ -0,0 +1,277 @@
+"""Local index of the collections of all EarthData (CMR-STAC) subproviders.
+
+The collection listings of all subproviders are crawled concurrently, and the asset
+keys of each collection are taken from its item_assets or from one sampled item.
+Refreshes are incremental: subproviders crawled within a maximum age are skipped,
+and only the collections that are new or changed are sampled again. Finding the
+subprovider and assets of a collection is then an offline lookup.
+"""
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from loguru import logger
+from tqdm.contrib.concurrent import thread_map
+
+from ..util.sqlite import transaction
+from .earthdata_providers import EARTHDATA_PROVIDERS
+
+__all__ = ["CATALOG_FILE", "CatalogEntry", "EarthDataCatalog"]
+
+# file of the index in the multiearth cache directory
+CATALOG_FILE = "earthdata_catalog.db"
+
+
+@dataclass
+class CatalogEntry:
+    """A collection of an EarthData subprovider."""
+
+    subprovider_id: str
+    collection_id: str
+    title: str = ""
+    # (minx, miny, maxx, maxy) in EPSG:4326, empty if unknown
+    bbox: List[float] = field(default_factory=list)
+    # ISO 8601 start and end of the temporal extent, empty if open or unknown
+    start_datetime: str = ""
+    end_datetime: str = ""
+    asset_keys: List[str] = field(default_factory=list)
+
+
+def _collection_entry(subprovider_id: str, coll: Dict[str, Any]) -> CatalogEntry:
+    """Return the catalog entry of a STAC collection."""
+    extent = coll.get("extent", {})
+    bboxes = extent.get("spatial", {}).get("bbox") or [[]]
+    intervals = extent.get("temporal", {}).get("interval") or [[None, None]]
+    start, end = (list(intervals[0]) + [None, None])[:2]
+    return CatalogEntry(
+        subprovider_id=subprovider_id,
+        collection_id=str(coll["id"]),
+        title=str(coll.get("title") or ""),
+        bbox=[float(v) for v in bboxes[0]],
+        start_datetime=start or "",
+        end_datetime=end or "",
+        asset_keys=sorted(coll.get("item_assets") or {}),
+    )
+
+
+def _fingerprint(coll: Dict[str, Any]) -> str:
+    """Return a hash of a STAC collection, which changes when it's updated."""
+    encoded = json.dumps(coll, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _link(obj: Dict[str, Any], rel: str) -> Optional[str]:
+    """Return the href of the first link of a STAC object with a rel, if any."""
+    for link in obj.get("links", []):
+        if link.get("rel") == rel and link.get("href"):
+            return str(link["href"])
+    return None
+
+
+class EarthDataCatalog:
+    """Searchable index of the collections of the EarthData subproviders."""
+
+    def __init__(
+        self,
+        path: str,
+        session: Optional[requests.Session] = None,
+        endpoints: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Open (and create if needed) the index.
+
+        Args:
+            path (str): path to the SQLite file
+            session (requests.Session): session for the crawl requests
+            endpoints (Dict[str, str]): CMR-STAC url of each subprovider, defaults to
+                EARTHDATA_PROVIDERS
+        """
+        self.path = os.path.expanduser(path)
+        self.session = session if session is not None else requests.Session()
+        self.endpoints = endpoints if endpoints is not None else EARTHDATA_PROVIDERS
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with transaction(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS collections ("
+                "subprovider_id TEXT NOT NULL, collection_id TEXT NOT NULL, "
+                "title TEXT NOT NULL, entry TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                "PRIMARY KEY (subprovider_id, collection_id))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS collections_id ON collections "
+                "(collection_id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS endpoints ("
+                "subprovider_id TEXT PRIMARY KEY, crawled_at REAL NOT NULL)"
+            )
+
+    def _get_json(self, url: str, **params: Any) -> Dict[str, Any]:
+        """Request a JSON document."""
+        with self.session.get(url, params=params, timeout=60) as response:
+            response.raise_for_status()
+            doc: Dict[str, Any] = response.json()
+        return doc
+
+    def _list_collections(self, subprovider_id: str) -> List[Dict[str, Any]]:
+        """Return the STAC collections of a subprovider, following the pages."""
+        collections: List[Dict[str, Any]] = []
+        url: Optional[str] = self.endpoints[subprovider_id].rstrip("/") + "/collections"
+        while url is not None:
+            page = self._get_json(url)
+            collections.extend(page.get("collections", []))
+            url = _link(page, "next")
+        return collections
+
+    def _sample_asset_keys(
+        self, subprovider_id: str, coll: Dict[str, Any]
+    ) -> Optional[List[str]]:
+        """Return the asset keys of one item of a collection, None if the request failed."""
+        items_url = _link(coll, "items") or (
+            self.endpoints[subprovider_id].rstrip("/")
+            + f"/collections/{coll['id']}/items"
+        )
+        try:
+            page = self._get_json(items_url, limit=1)
+        except (requests.RequestException, ValueError) as ex:
+            logger.debug(f"Unable to sample an item of {coll['id']}: {ex}")
+            return None
+        features = page.get("features", [])
+        return sorted(features[0].get("assets", {})) if len(features) > 0 else []
+
+    def refresh(self, max_age_hours: float = 24.0, max_workers: int = 10) -> int:
+        """Crawl the subproviders and update the index.
+
+        Args:
+            max_age_hours (float): skip the subproviders crawled more recently, 0 to
+                crawl all of them
+            max_workers (int): number of concurrent requests
+        Returns:
+            int: the number of collections that were added or changed
+        """
+        with transaction(self.path, write=False) as conn:
+            crawled_at = dict(
+                conn.execute("SELECT subprovider_id, crawled_at FROM endpoints")
+            )
+            fingerprints = {
+                (pvdr, coll): fp
+                for pvdr, coll, fp in conn.execute(
+                    "SELECT subprovider_id, collection_id, fingerprint FROM collections"
+                )
+            }
+        min_crawled_at = time.time() - max_age_hours * 3600
+        to_crawl = [
+            pvdr
+            for pvdr in sorted(self.endpoints)
+            if crawled_at.get(pvdr, 0.0) < min_crawled_at or max_age_hours <= 0
+        ]
+        if len(to_crawl) == 0:
+            logger.info(f"All subproviders were crawled in the last {max_age_hours}h")
+            return 0
+
+        def list_collections(pvdr: str) -> Optional[List[Dict[str, Any]]]:
+            try:
+                return self._list_collections(pvdr)
+            except (requests.RequestException, ValueError) as ex:
+                logger.warning(f"Unable to list the collections of {pvdr}: {ex}")
+                return None
+
+        logger.info(f"Listing the collections of {len(to_crawl)} subproviders")
+        listings = thread_map(
+            list_collections, to_crawl, max_workers=max_workers, desc="Subproviders"
+        )
+
+        # sample the items of the new or changed collections without item_assets
+        changed: List[Tuple[str, Dict[str, Any], str]] = []
+        # collections whose sampling failed are indexed without a fingerprint, so
+        # they're sampled again by the next refresh
+        failed = set()
+        for pvdr, collections in zip(to_crawl, listings):
+            for coll in collections or []:
+                fingerprint = _fingerprint(coll)
+                if fingerprints.get((pvdr, str(coll["id"]))) != fingerprint:
+                    changed.append((pvdr, coll, fingerprint))
+        entries = [_collection_entry(pvdr, coll) for pvdr, coll, _ in changed]
+        to_sample = [i for i, entry in enumerate(entries) if not entry.asset_keys]
+        if len(to_sample) > 0:
+            logger.info(f"Sampling the asset keys of {len(to_sample):,} collections")
+            sampled = thread_map(
+                lambda i: self._sample_asset_keys(changed[i][0], changed[i][1]),
+                to_sample,
+                max_workers=max_workers,
+                desc="Collections",
+            )
+            for i, asset_keys in zip(to_sample, sampled):
+                if asset_keys is None:
+                    failed.add(i)
+                else:
+                    entries[i].asset_keys = asset_keys
+
+        now = time.time()
+        with transaction(self.path) as conn:
+            for i, ((pvdr, _, fingerprint), entry) in enumerate(zip(changed, entries)):
+                conn.execute(
+                    "INSERT OR REPLACE INTO collections "
+                    "(subprovider_id, collection_id, title, entry, fingerprint) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        pvdr,
+                        entry.collection_id,
+                        entry.title,
+                        json.dumps(entry.__dict__),
+                        "" if i in failed else fingerprint,
+                    ),
+                )
+            for pvdr, collections in zip(to_crawl, listings):
+                if collections is None:
+                    continue
+                # remove the collections that are no longer listed
+                listed = {str(coll["id"]) for coll in collections}
+                for (other_pvdr, coll_id) in fingerprints:
+                    if other_pvdr == pvdr and coll_id not in listed:
+                        conn.execute(
+                            "DELETE FROM collections "
+                            "WHERE subprovider_id = ? AND collection_id = ?",
+                            (pvdr, coll_id),
+                        )
+                conn.execute(
+                    "INSERT OR REPLACE INTO endpoints (subprovider_id, crawled_at) "
+                    "VALUES (?, ?)",
+                    (pvdr, now),
+                )
+        logger.info(f"Indexed {len(changed):,} new or changed collections")
+        return len(changed)
+
+    def search(self, text: str = "", limit: int = -1) -> List[CatalogEntry]:
+        """Return the collections whose id or title contains the text (ignoring case)."""
+        pattern = f"%{text}%"
+        with transaction(self.path, write=False) as conn:
+            rows = conn.execute(
+                "SELECT entry FROM collections "
+                "WHERE collection_id LIKE ? OR title LIKE ? "
+                "ORDER BY subprovider_id, collection_id LIMIT ?",
+                (pattern, pattern, limit),
+            ).fetchall()
+        return [CatalogEntry(**json.loads(row[0])) for row in rows]
+
+    def lookup(self, collection_id: str) -> List[CatalogEntry]:
+        """Return the entries of a collection id, one per subprovider that has it."""
+        with transaction(self.path, write=False) as conn:
+            rows = conn.execute(
+                "SELECT entry FROM collections WHERE collection_id = ? "
+                "ORDER BY subprovider_id",
+                (collection_id,),
+            ).fetchall()
+        return [CatalogEntry(**json.loads(row[0])) for row in rows]
+
+    def num_collections(self) -> int:
+        """Return the number of indexed collections."""
+        with transaction(self.path, write=False) as conn:
+            row = conn.execute("SELECT COUNT(*) FROM collections").fetchone()
+        return int(row[0])
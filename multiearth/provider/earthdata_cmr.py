@@ -0,0 +1,364 @@
+"""Search EarthData granules with the CMR search API instead of CMR-STAC.
+
+Granules are requested as UMM-G JSON with search-after paging, which has no depth
+limit, and large date ranges are split into temporal slices that are searched
+concurrently. The granules are converted into pystac Items with the same layout as
+CMR-STAC items, so their assets are extracted like any other STAC item.
+
+https://cmr.earthdata.nasa.gov/search/site/docs/search/api.html
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import sleep
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import pandas as pd
+import pystac
+import requests
+import shapely.geometry
+from loguru import logger
+from shapely.geometry.base import BaseGeometry
+from shapely.geometry.polygon import orient
+
+__all__ = ["CMRGranuleSearch", "umm_granule_to_item"]
+
+CMR_GRANULE_SEARCH_URL = "https://cmr.earthdata.nasa.gov/search/granules.umm_json"
+
+# UMM-G size units to bytes
+_SIZE_UNITS = {
+    "B": 1,
+    "KB": 1024,
+    "MB": 1024**2,
+    "GB": 1024**3,
+    "TB": 1024**4,
+    "PB": 1024**5,
+}
+
+
+class CMRGranuleSearch:
+    """Search the granules of one CMR provider, e.g., NSIDC_ECS."""
+
+    # maximum page size allowed by CMR
+    page_size: int = 2000
+
+    def __init__(
+        self,
+        provider_id: str,
+        session: requests.Session,
+        num_slices: int = 8,
+        max_attempts: int = 3,
+        search_url: str = CMR_GRANULE_SEARCH_URL,
+    ) -> None:
+        """Set up the granule search.
+
+        Args:
+            provider_id (str): the CMR provider id (the EarthData subprovider id)
+            session (requests.Session): session used for the search requests
+            num_slices (int): number of temporal slices to search concurrently
+            max_attempts (int): number of attempts for each page request
+            search_url (str): the CMR granule search endpoint
+        """
+        self.provider_id = provider_id
+        self.session = session
+        self.num_slices = max(1, num_slices)
+        self.max_attempts = max(1, max_attempts)
+        self.search_url = search_url
+
+    def search(
+        self, region: Optional[BaseGeometry], dt: str, collection: str, max_items: int
+    ) -> List[pystac.Item]:
+        """Search the granules of a collection that intersect the region and datetime.
+
+        Args:
+            region (BaseGeometry): search region, None to search everywhere
+            dt (str): single date+time or a range ('/' separator), use double
+                dots .. for open date ranges
+            collection (str): collection id, either a CMR short name or a CMR-STAC
+                id such as ASO_50M_SD.v1 (short name and version)
+            max_items (int): maximum number of items to return, -1 for no limit
+        Returns:
+            List[pystac.Item]: the granules as STAC items, without duplicates
+        """
+        params: List[Tuple[str, str]] = [("provider", self.provider_id)]
+        params += _collection_params(collection)
+        params += _region_params(region)
+
+        slices = _temporal_slices(dt, self.num_slices)
+        with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+            results = executor.map(
+                lambda temporal: list(
+                    self._search_slice(params, temporal, collection, max_items)
+                ),
+                slices,
+            )
+            # granules on the slice boundaries are returned by both slices
+            items: Dict[str, pystac.Item] = {}
+            for slice_items in results:
+                for itm in slice_items:
+                    items.setdefault(itm.id, itm)
+
+        found = list(items.values())
+        if max_items >= 0:
+            found = found[:max_items]
+        return found
+
+    def _search_slice(
+        self,
+        params: List[Tuple[str, str]],
+        temporal: str,
+        collection: str,
+        max_items: int,
+    ) -> Iterator[pystac.Item]:
+        """Page through the granules of one temporal slice using search-after."""
+        slice_params = params + [("page_size", str(self.page_size))]
+        if temporal:
+            slice_params.append(("temporal[]", temporal))
+        search_after = ""
+        num_items = 0
+        while True:
+            response = self._get_page(slice_params, search_after)
+            granules = response.json().get("items", [])
+            for granule in granules:
+                yield umm_granule_to_item(granule, collection)
+                num_items += 1
+                if 0 <= max_items <= num_items:
+                    return
+            search_after = response.headers.get("CMR-Search-After", "")
+            if len(granules) < self.page_size or not search_after:
+                return
+
+    def _get_page(
+        self, params: List[Tuple[str, str]], search_after: str
+    ) -> requests.Response:
+        """Request one page of granules, retrying on errors."""
+        headers = {"CMR-Search-After": search_after} if search_after else {}
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                r = self.session.get(
+                    self.search_url, params=params, headers=headers, timeout=120
+                )
+                r.raise_for_status()
+                return r
+            except requests.RequestException as ex:
+                if attempt == self.max_attempts:
+                    raise
+                logger.debug(f"CMR search failed (attempt {attempt}), retrying: {ex}")
+                sleep(2**attempt)
+        raise AssertionError("unreachable")
+
+
+def umm_granule_to_item(granule: Dict[str, Any], collection: str) -> pystac.Item:
+    """Convert a UMM-G granule search result into a STAC item.
+
+    Data files become the assets data, data1, ... (https urls only, with the matching
+    s3:// url as the alternate s3 href), and browse images and extended metadata
+    become the browse and metadata assets.
+
+    Args:
+        granule (Dict[str, Any]): a search result item with "meta" and "umm" keys
+        collection (str): the collection id for the item
+    Returns:
+        pystac.Item: the STAC item
+    """
+    umm = granule["umm"]
+    meta = granule.get("meta", {})
+    item_id = umm.get("GranuleUR", meta.get("native-id", meta.get("concept-id")))
+
+    geometry = _umm_geometry(umm.get("SpatialExtent", {}))
+    start, end = _umm_temporal(umm.get("TemporalExtent", {}))
+    properties: Dict[str, Any] = {}
+    if start is not None and end is not None and start != end:
+        properties["start_datetime"] = start.isoformat()
+        properties["end_datetime"] = end.isoformat()
+    item_datetime = start if start == end else None
+    if start is None:
+        # pystac requires a datetime or a range
+        item_datetime = pd.Timestamp(meta.get("revision-date", 0)).to_pydatetime()
+
+    itm = pystac.Item(
+        id=str(item_id),
+        geometry=shapely.geometry.mapping(geometry) if geometry is not None else None,
+        bbox=list(geometry.bounds) if geometry is not None else None,
+        datetime=item_datetime,
+        properties=properties,
+        collection=collection,
+    )
+
+    file_sizes = _umm_file_sizes(umm.get("DataGranule", {}))
+    urls = umm.get("RelatedUrls", [])
+    s3_urls = {
+        os.path.basename(urlparse(u["URL"]).path): u["URL"]
+        for u in urls
+        if u.get("Type") == "GET DATA VIA DIRECT ACCESS"
+        and str(u.get("URL", "")).startswith("s3://")
+    }
+    num_data = 0
+    for u in urls:
+        href = str(u.get("URL", ""))
+        url_type = u.get("Type")
+        if not href.startswith("http"):
+            continue
+        if url_type == "GET DATA":
+            key = "data" if num_data == 0 else f"data{num_data}"
+            num_data += 1
+            roles = ["data"]
+        elif url_type == "GET RELATED VISUALIZATION" and "browse" not in itm.assets:
+            key, roles = "browse", ["browse"]
+        elif url_type == "EXTENDED METADATA" and "metadata" not in itm.assets:
+            key, roles = "metadata", ["metadata"]
+        else:
+            continue
+
+        name = os.path.basename(urlparse(href).path)
+        extra_fields: Dict[str, Any] = {}
+        size = file_sizes.get(name, _umm_size(u))
+        if size is not None:
+            extra_fields["file:size"] = size
+        if name in s3_urls and roles == ["data"]:
+            extra_fields["alternate"] = {"s3": {"href": s3_urls[name]}}
+        itm.add_asset(
+            key,
+            pystac.Asset(
+                href=href,
+                title=u.get("Description"),
+                media_type=u.get("MimeType"),
+                roles=roles,
+                extra_fields=extra_fields,
+            ),
+        )
+    return itm
+
+
+def _collection_params(collection: str) -> List[Tuple[str, str]]:
+    """Return the CMR parameters for a short name or a CMR-STAC collection id."""
+    short_name, _, version = collection.rpartition(".v")
+    if short_name and version:
+        return [("short_name", short_name), ("version", version)]
+    return [("short_name", collection)]
+
+
+def _region_params(region: Optional[BaseGeometry]) -> List[Tuple[str, str]]:
+    """Return the CMR parameters that search the (multi)polygon region."""
+    if region is None:
+        return []
+    parts = list(region.geoms) if hasattr(region, "geoms") else [region]
+    params = []
+    for part in parts:
+        if not hasattr(part, "exterior"):
+            part = part.convex_hull
+        if not hasattr(part, "exterior"):
+            # a point or a line
+            minx, miny, maxx, maxy = part.bounds
+            params.append(("bounding_box[]", f"{minx},{miny},{maxx},{maxy}"))
+            continue
+        # CMR polygons are counter-clockwise, closed lon/lat rings
+        ring = orient(shapely.geometry.Polygon(part.exterior), sign=1.0).exterior
+        coords = ",".join(f"{x},{y}" for x, y in ring.coords)
+        params.append(("polygon[]", coords))
+    if len(params) > 1:
+        params.append(("options[spatial][or]", "true"))
+    return params
+
+
+def _temporal_slices(dt: str, num_slices: int) -> List[str]:
+    """Split a STAC datetime (range) into CMR temporal ranges of equal length."""
+    if not dt:
+        return [""]
+    components = dt.split("/")
+    start = _parse_datetime(components[0], end_of_day=False)
+    end = _parse_datetime(components[-1], end_of_day=True)
+    if start is None or end is None or num_slices <= 1 or start >= end:
+        return [f"{_format_datetime(start)},{_format_datetime(end)}"]
+    bounds = pd.date_range(start, end, periods=num_slices + 1)
+    return [
+        f"{_format_datetime(s)},{_format_datetime(e)}"
+        for s, e in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _parse_datetime(s: str, end_of_day: bool) -> Optional[pd.Timestamp]:
+    """Parse a datetime, with date-only end dates covering the whole day."""
+    if s in ("", ".."):
+        return None
+    ts = pd.Timestamp(s)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    if end_of_day and len(s) == 10:
+        ts = ts + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return ts
+
+
+def _format_datetime(ts: Optional[pd.Timestamp]) -> str:
+    """Format a datetime for the CMR temporal parameter, empty if open."""
+    if ts is None:
+        return ""
+    return str(ts.tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+
+def _umm_geometry(spatial_extent: Dict[str, Any]) -> Optional[BaseGeometry]:
+    """Return the granule geometry from the UMM-G horizontal spatial domain."""
+    geometry = spatial_extent.get("HorizontalSpatialDomain", {}).get("Geometry", {})
+    shapes: List[BaseGeometry] = []
+    for gpolygon in geometry.get("GPolygons", []):
+        points = gpolygon.get("Boundary", {}).get("Points", [])
+        if len(points) >= 3:
+            shapes.append(
+                shapely.geometry.Polygon(
+                    [(p["Longitude"], p["Latitude"]) for p in points]
+                )
+            )
+    for rect in geometry.get("BoundingRectangles", []):
+        shapes.append(
+            shapely.geometry.box(
+                rect["WestBoundingCoordinate"],
+                rect["SouthBoundingCoordinate"],
+                rect["EastBoundingCoordinate"],
+                rect["NorthBoundingCoordinate"],
+            )
+        )
+    for point in geometry.get("Points", []):
+        shapes.append(shapely.geometry.Point(point["Longitude"], point["Latitude"]))
+    if len(shapes) == 0:
+        return None
+    if len(shapes) == 1:
+        return shapes[0]
+    if all(isinstance(s, shapely.geometry.Polygon) for s in shapes):
+        return shapely.geometry.MultiPolygon(shapes)
+    return shapely.geometry.GeometryCollection(shapes)
+
+
+def _umm_temporal(
+    temporal_extent: Dict[str, Any]
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Return the start and end datetime from the UMM-G temporal extent."""
+    date_range = temporal_extent.get("RangeDateTime", {})
+    start = temporal_extent.get("SingleDateTime", date_range.get("BeginningDateTime"))
+    end = date_range.get("EndingDateTime", start)
+    if start is None:
+        return None, None
+    start_dt: datetime = pd.Timestamp(start).to_pydatetime()
+    end_dt: datetime = pd.Timestamp(end).to_pydatetime()
+    return start_dt, end_dt
+
+
+def _umm_file_sizes(data_granule: Dict[str, Any]) -> Dict[str, int]:
+    """Return the file sizes in bytes by file name from the UMM-G data granule."""
+    sizes = {}
+    for info in data_granule.get("ArchiveAndDistributionInformation", []):
+        size = _umm_size(info)
+        if "Name" in info and size is not None:
+            sizes[info["Name"]] = size
+    return sizes
+
+
+def _umm_size(info: Dict[str, Any]) -> Optional[int]:
+    """Return the size in bytes of a UMM-G file or related url, if known."""
+    if "SizeInBytes" in info:
+        return int(info["SizeInBytes"])
+    if "Size" in info:
+        unit = _SIZE_UNITS.get(str(info.get("SizeUnit", "MB")).upper(), 1024**2)
+        return int(float(info["Size"]) * unit)
+    return None
@@ -35,9 +35,10 @@ OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 import os
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from functools import reduce
-from typing import Any, Dict, List, Type
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 import geopandas as gpd
 import pandas as pd
@@ -56,10 +57,15 @@ from metloom.variables import (
     SnotelVariables,
     VariableBase,
 )
+from tqdm import tqdm
 from tqdm.contrib.concurrent import thread_map
 
 from multiearth.config import CollectionSchema, ConfigSchema, ProviderKey
 from multiearth.provider.base import BaseProvider
+from multiearth.util.aoi import PreparedAOI, load_aoi
+from multiearth.util.datetime import DATE_RANGE_CHUNKS, split_date_range
+from multiearth.util.sink import is_remote
+from multiearth.util.watch import WatchState
 
 
 class SnotelClient(SnotelPointData):  # type: ignore
@@ -74,6 +80,7 @@ class SnotelClient(SnotelPointData):  # type: ignore
         end_date: datetime,
         cfg: ConfigSchema,
         max_items: int = -1,
+        aoi: Optional[PreparedAOI] = None,
         **kwargs: Any,
     ) -> PointData.ITERATOR_CLASS:
         """
@@ -82,6 +89,8 @@ class SnotelClient(SnotelPointData):  # type: ignore
         Args:
             geometry: GeoDataFrame for shapefile from gpd.read_file
             variables: List of SensorDescription
+            aoi: prepared geometry used for the within_geometry filter,
+                prepared from geometry if not given
             snow_courses: boolean for including only snowcourse data or no
                 snowcourse data
             within_geometry: filter the points to within the shapefile
@@ -139,7 +148,9 @@ class SnotelClient(SnotelPointData):  # type: ignore
             ),
         )
         if kwargs["within_geometry"]:
-            filtered_gdf = gdf[gdf.within(projected_geom.iloc[0]["geometry"])]
+            if aoi is None:
+                aoi = PreparedAOI.from_geodataframe(projected_geom)
+            filtered_gdf = gdf[aoi.contains_points(gdf.geometry)]
         else:
             filtered_gdf = gdf
         if start_date is not None:
@@ -175,6 +186,7 @@ class CdecClient(CDECPointData):  # type: ignore
         geometry: gpd.GeoDataFrame,
         variables: List[SensorDescription],
         max_items: int = -1,
+        aoi: Optional[PreparedAOI] = None,
         **kwargs: Any,
     ) -> PointData.ITERATOR_CLASS:
         """
@@ -183,6 +195,8 @@ class CdecClient(CDECPointData):  # type: ignore
         Args:
             geometry: GeoDataFrame for shapefile from gpd.read_file
             variables: List of SensorDescription
+            aoi: prepared geometry used for the within_geometry filter,
+                prepared from geometry if not given
             snow_courses: Boolean for including only snowcourse data or no
             snowcourse data
             within_geometry: filter the points to within the shapefile
@@ -230,7 +244,9 @@ class CdecClient(CDECPointData):  # type: ignore
         )
         # filter to points within shapefile
         if kwargs["within_geometry"]:
-            filtered_gdf = gdf[gdf.within(projected_geom.iloc[0]["geometry"])]
+            if aoi is None:
+                aoi = PreparedAOI.from_geodataframe(projected_geom)
+            filtered_gdf = gdf[aoi.contains_points(gdf.geometry)]
         else:
             filtered_gdf = gdf
         points = []
@@ -253,6 +269,215 @@ class CdecClient(CDECPointData):  # type: ignore
             )
 
 
+class StationDataWriter:
+    """Write station time series to disk as each station's data arrives.
+
+    Each frame is flattened, coerced to a fixed, typed set of columns and written
+    immediately, so memory use is bounded by a single station rather than the whole
+    dataset. Two output formats are supported:
+
+    * ``csv``: a single ``{outdir}/{dataset_id}.csv`` file that is appended to
+    * ``parquet``: GeoParquet files partitioned by station and year, i.e.
+      ``{outdir}/{dataset_id}/station={station}/year={year}/part-0.parquet``
+
+    In incremental mode, existing output is kept: csv rows are appended and parquet
+    partitions are merged with the new rows.
+    """
+
+    formats: List[str] = ["csv", "parquet"]
+
+    def __init__(
+        self,
+        outdir: str,
+        dataset_id: str,
+        variables: List[SensorDescription],
+        output_format: str = "csv",
+        incremental: bool = False,
+    ) -> None:
+        """Set up the writer for one dataset.
+
+        Args:
+            outdir: directory to write the dataset to
+            dataset_id: dataset id, e.g. SNOTEL, used to name the output
+            variables: the variables that will be written, used to fix the column schema
+            output_format: one of StationDataWriter.formats
+            incremental: add to the existing output instead of overwriting it
+        """
+        assert (
+            output_format in self.formats
+        ), f"Unknown output format {output_format}, use one of {self.formats}"
+        if is_remote(outdir):
+            raise ValueError(
+                f"Metloom output must be written to a local directory, not {outdir}"
+            )
+        self.outdir = outdir
+        self.dataset_id = dataset_id
+        self.output_format = output_format
+        self.value_columns = [v.name for v in variables]
+        self.columns = ["datetime", "site", "geometry"]
+        for name in self.value_columns:
+            self.columns += [name, f"{name}_units"]
+        self.columns += ["datasource"]
+        self.incremental = incremental
+        self._csv_started = False
+        if incremental and output_format == "csv" and os.path.exists(self.csv_file):
+            existing_columns = list(pd.read_csv(self.csv_file, nrows=0).columns)
+            if existing_columns != self.columns:
+                raise ValueError(
+                    f"Cannot incrementally update {self.csv_file}: it has columns "
+                    + f"{existing_columns} but expected {self.columns}. "
+                    + "Remove the file or run without incremental mode."
+                )
+            self._csv_started = True
+
+    @property
+    def csv_file(self) -> str:
+        """Return the path of the csv output file."""
+        return os.path.join(self.outdir, f"{self.dataset_id}.csv")
+
+    def station_dir(self, station_id: str) -> str:
+        """Return the parquet partition directory of a station."""
+        safe_id = str(station_id).replace(":", "_").replace(os.sep, "_")
+        return os.path.join(self.outdir, self.dataset_id, f"station={safe_id}")
+
+    def to_typed_frame(self, df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+        """Flatten the (datetime, site) index and coerce the columns to fixed dtypes."""
+        crs = df.crs
+        flat = pd.DataFrame(df.reset_index()).reindex(columns=self.columns)
+        flat["datetime"] = pd.to_datetime(flat["datetime"], utc=True)
+        flat["site"] = flat["site"].astype("string")
+        flat["datasource"] = flat["datasource"].astype("string")
+        for name in self.value_columns:
+            flat[name] = pd.to_numeric(flat[name], errors="coerce").astype("float64")
+            flat[f"{name}_units"] = flat[f"{name}_units"].astype("string")
+        return gpd.GeoDataFrame(flat, geometry="geometry", crs=crs)
+
+    def last_stored_dates(self) -> Dict[str, Dict[str, pd.Timestamp]]:
+        """Return the last datetime with a stored value for each station and variable.
+
+        Returns:
+            Dict[str, Dict[str, pd.Timestamp]]: {station id: {variable name: datetime}}
+        """
+        last_dates: Dict[str, Dict[str, pd.Timestamp]] = {}
+        if self.output_format == "parquet":
+            dataset_dir = os.path.join(self.outdir, self.dataset_id)
+            if not os.path.isdir(dataset_dir):
+                return last_dates
+            for station_dir in os.listdir(dataset_dir):
+                last_dates.update(
+                    self._last_stored_parquet(os.path.join(dataset_dir, station_dir))
+                )
+        elif os.path.exists(self.csv_file):
+            usecols = ["datetime", "site"] + self.value_columns
+            # read in chunks to keep memory bounded for large files
+            for chunk in pd.read_csv(self.csv_file, usecols=usecols, chunksize=100000):
+                chunk["datetime"] = pd.to_datetime(chunk["datetime"], utc=True)
+                self._update_last_dates(last_dates, chunk)
+        return last_dates
+
+    def _last_stored_parquet(
+        self, station_dir: str
+    ) -> Dict[str, Dict[str, pd.Timestamp]]:
+        """Read the year partitions of a station, newest first, until all variables are found."""
+        last_dates: Dict[str, Dict[str, pd.Timestamp]] = {}
+        years = sorted(
+            (d for d in os.listdir(station_dir) if d.startswith("year=")),
+            key=lambda d: int(d.split("=")[1]),
+            reverse=True,
+        )
+        for year_dir in years:
+            part = os.path.join(station_dir, year_dir, "part-0.parquet")
+            if not os.path.exists(part):
+                continue
+            df = pd.read_parquet(
+                part, columns=["datetime", "site"] + self.value_columns
+            )
+            self._update_last_dates(last_dates, df)
+            if all(
+                len(station_dates) == len(self.value_columns)
+                for station_dates in last_dates.values()
+            ):
+                break
+        return last_dates
+
+    def _update_last_dates(
+        self, last_dates: Dict[str, Dict[str, pd.Timestamp]], df: pd.DataFrame
+    ) -> None:
+        """Update last_dates in place with the latest non-null datetimes of df."""
+        for name in self.value_columns:
+            if name not in df.columns:
+                continue
+            latest = df[df[name].notna()].groupby("site")["datetime"].max()
+            for site, dt in latest.items():
+                station_dates = last_dates.setdefault(str(site), {})
+                if name not in station_dates or dt > station_dates[name]:
+                    station_dates[name] = dt
+
+    def write(
+        self,
+        df: Optional[gpd.GeoDataFrame],
+        stored_dates: Optional[Dict[str, pd.Timestamp]] = None,
+    ) -> int:
+        """Write the data of a single station and return the number of rows written.
+
+        Args:
+            df: the station data, indexed on (datetime, site)
+            stored_dates: last stored datetime per variable for the station, values at
+                or before these datetimes are not written again
+        """
+        if df is None or len(df.index) == 0:
+            return 0
+        typed = self.to_typed_frame(df)
+        if stored_dates:
+            typed = self._drop_stored_values(typed, stored_dates)
+            if len(typed.index) == 0:
+                return 0
+        if self.output_format == "parquet":
+            self._write_parquet(typed)
+        else:
+            self._write_csv(typed)
+        return len(typed.index)
+
+    def _drop_stored_values(
+        self, df: gpd.GeoDataFrame, stored_dates: Dict[str, pd.Timestamp]
+    ) -> gpd.GeoDataFrame:
+        """Null out values that are already stored and drop rows left without values."""
+        df = df.copy()
+        for name, last_dt in stored_dates.items():
+            if name in df.columns:
+                stored = df["datetime"] <= last_dt
+                df.loc[stored, name] = None
+                df.loc[stored, f"{name}_units"] = None
+        return df[df[self.value_columns].notna().any(axis=1)]
+
+    def _write_csv(self, df: gpd.GeoDataFrame) -> None:
+        """Append the station rows to the csv file, writing the header once."""
+        os.makedirs(self.outdir, exist_ok=True)
+        df.to_csv(
+            self.csv_file,
+            mode="a" if self._csv_started else "w",
+            header=not self._csv_started,
+            index=False,
+        )
+        self._csv_started = True
+
+    def _write_parquet(self, df: gpd.GeoDataFrame) -> None:
+        """Write one GeoParquet file per year of the station's data."""
+        station_id = df["site"].iloc[0]
+        for year, year_df in df.groupby(df["datetime"].dt.year):
+            partition_dir = os.path.join(self.station_dir(station_id), f"year={year}")
+            os.makedirs(partition_dir, exist_ok=True)
+            part = os.path.join(partition_dir, "part-0.parquet")
+            if self.incremental and os.path.exists(part):
+                # new values take precedence, existing values fill the gaps
+                existing = gpd.read_parquet(part).set_index("datetime")
+                merged = year_df.set_index("datetime").combine_first(existing)
+                year_df = gpd.GeoDataFrame(
+                    merged.reset_index()[self.columns], geometry="geometry", crs=df.crs
+                )
+            year_df.to_parquet(part, index=False)
+
+
 class MetloomProvider(BaseProvider):
     """Metloom Provider."""
 
@@ -297,26 +522,80 @@ class MetloomProvider(BaseProvider):
         },
     }
     _allowed_datasets: List[str] = ["SNOTEL", "CDEC"]
+    _frequencies: Dict[str, pd.Timedelta] = {
+        "daily": pd.Timedelta(days=1),
+        "hourly": pd.Timedelta(hours=1),
+    }
     _locations: Dict[str, PointData.ITERATOR_CLASS] = {}
     _assets: Dict[str, List[str]] = {}
-    _data: Dict[str, gpd.GeoDataFrame] = {}
 
     def __init__(
         self,
         id: ProviderKey,
         cfg: ConfigSchema,
         collections: List[CollectionSchema],
+        output_format: str = "csv",
+        incremental: bool = False,
+        frequency: str = "daily",
+        chunk_by: str = "",
         **kwargs: Any,
     ) -> None:
-        """Initialize Metloom Provider."""
+        """Initialize Metloom Provider.
+
+        Args:
+            output_format: write the time series as a single "csv" file per dataset
+                or as "parquet" files partitioned by station and year
+            incremental: only request data after the last date already stored for
+                each station and variable, and add it to the existing output
+            frequency: extract "daily" or "hourly" data
+            chunk_by: split each station's date range into "year", "water_year" or
+                "month" chunks that are requested concurrently, "" for one request
+        """
+        if output_format not in StationDataWriter.formats:
+            raise ValueError(
+                f"Unknown output_format {output_format} for {self}, "
+                + f"use one of {', '.join(StationDataWriter.formats)}"
+            )
+        if output_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError(
+                    "pyarrow is required for parquet output, "
+                    + "install it with `pip install multiearth[parquet]`"
+                )
+        if frequency not in self._frequencies:
+            raise ValueError(
+                f"Unknown frequency {frequency} for {self}, "
+                + f"use one of {', '.join(self._frequencies)}"
+            )
+        if chunk_by not in DATE_RANGE_CHUNKS:
+            raise ValueError(
+                f"Unknown chunk_by {chunk_by} for {self}, "
+                + f"use one of {', '.join(DATE_RANGE_CHUNKS)}"
+            )
+        self.output_format = output_format
+        self.incremental = incremental
+        # watch only requests the new data in incremental mode
+        self.supports_watch = incremental
+        self.frequency = frequency
+        self.chunk_by = chunk_by
         super().__init__(id, cfg, collections, **kwargs)
 
     def check_authorization(self) -> bool:
         """Check if the provider is authorized."""
         return True
 
+    def poll_assets(self, state: WatchState, dry_run: bool = False) -> bool:
+        """Extract the data since the last stored dates, for watch (incremental mode)."""
+        return self.extract_assets(dry_run=dry_run)
+
     def extract_assets(self, dry_run: bool = False) -> bool:
         """Download a dataset to assigned output_dir."""
+        if self.cfg.system.shard_index > 0:
+            # the stations are written to shared files, so only one shard extracts them
+            logger.info(f"Skipping {self} on shard {self.cfg.system.shard_index}")
+            return True
         return_false = False
         for collection in self.collections:
             if dry_run:
@@ -331,6 +610,9 @@ class MetloomProvider(BaseProvider):
             assert (
                 collection.outdir is not None
             ), "Collection {dataset_id} outdir is not set"
+            assert (
+                collection.aoi_file is not None
+            ), "Collection {dataset_id} aoi_file is not set"
             allowed_assets = self._allowed_assets[dataset_id]
             assert collection.assets is not None
             if "all" in collection.assets:
@@ -347,10 +629,9 @@ class MetloomProvider(BaseProvider):
             start_date_temp, end_date_temp = collection.datetime.split("/")
             start_date = datetime.strptime(start_date_temp, "%Y-%m-%d")
             end_date = datetime.strptime(end_date_temp, "%Y-%m-%d")
-            if collection.aoi_file is not None:
-                region = gpd.read_file(collection.aoi_file)
+            aoi = load_aoi(collection.aoi_file, self.cfg.system.aoi_simplify_tolerance)
             self._locations[dataset_id] = self._region_to_items(
-                region,
+                aoi,
                 start_date,
                 end_date,
                 collection.assets,
@@ -377,34 +658,157 @@ class MetloomProvider(BaseProvider):
 
             if dry_run:
                 continue
-            daily_data = thread_map(
-                lambda data_obj: data_obj.get_daily_data(start_date, end_date, assets),
-                [
-                    self._client(loc, "MyStation")
-                    for loc in self._locations[dataset_id].to_dataframe()["id"]
-                ],
-                max_workers=self.cfg.system.max_concurrent_extractions,
+
+            os.makedirs(collection.outdir, exist_ok=True)
+            writer = StationDataWriter(
+                collection.outdir,
+                dataset_id,
+                assets,
+                self.output_format,
+                incremental=self.incremental,
+            )
+            clients = [
+                self._client(loc, "MyStation")
+                for loc in self._locations[dataset_id].to_dataframe()["id"]
+            ]
+            stored_dates: Dict[str, Dict[str, pd.Timestamp]] = {}
+            station_start_dates = {client.id: start_date for client in clients}
+            if self.incremental:
+                stored_dates = writer.last_stored_dates()
+                station_start_dates = {
+                    client.id: _incremental_start_date(
+                        start_date,
+                        stored_dates.get(str(client.id), {}),
+                        assets,
+                        self._frequencies[self.frequency],
+                    )
+                    for client in clients
+                }
+                clients = [
+                    client
+                    for client in clients
+                    if station_start_dates[client.id] <= end_date
+                ]
+                logger.info(
+                    f"Incremental update: {len(clients)} of {len(station_start_dates)} "
+                    + f"{dataset_id} stations have data to request"
+                )
+            num_rows, all_written = self._fetch_and_write_stations(
+                clients, station_start_dates, end_date, assets, writer, stored_dates
             )
+            return_false |= not all_written
 
             data_time = time.time()
             logger.info(
-                f"Downloading data took {round((data_time - start_time)/60, 4)} minutes"
-            )
-
-            os.makedirs(collection.outdir, exist_ok=True)
-
-            self._data[dataset_id] = gpd.GeoDataFrame(
-                pd.concat(daily_data, ignore_index=False), crs=daily_data[0].crs
+                f"Downloading {num_rows:,} rows for {dataset_id} took "
+                + f"{round((data_time - start_time)/60, 4)} minutes"
             )
-            self._data[dataset_id].to_csv(f"{collection.outdir}/{dataset_id}.csv")
         if return_false:
             return False
         return True
 
+    def _fetch_and_write_stations(
+        self,
+        clients: List[PointData],
+        station_start_dates: Dict[str, datetime],
+        end_date: datetime,
+        variables: List[SensorDescription],
+        writer: StationDataWriter,
+        stored_dates: Dict[str, Dict[str, pd.Timestamp]],
+    ) -> Tuple[int, bool]:
+        """Fetch each station's data in date range chunks and write it as it completes.
+
+        All chunks of all stations are requested concurrently. Once every chunk of a
+        station has arrived, the chunks are stitched in order and written, so only the
+        stations that are in flight are held in memory.
+
+        Returns:
+            Tuple[int, bool]: the number of rows written and True if all stations
+                were extracted successfully
+        """
+        num_rows = 0
+        all_written = True
+        station_chunks = {
+            client.id: split_date_range(
+                station_start_dates[client.id], end_date, self.chunk_by
+            )
+            for client in clients
+        }
+        chunk_data: Dict[str, Dict[int, Optional[gpd.GeoDataFrame]]] = {
+            client.id: {} for client in clients
+        }
+        failed_stations = set()
+        with ThreadPoolExecutor(
+            max_workers=self.cfg.system.max_concurrent_extractions
+        ) as executor:
+            pending: Dict["Future[Optional[gpd.GeoDataFrame]]", Tuple[str, int]] = {}
+            for client in clients:
+                for i, (chunk_start, chunk_end) in enumerate(station_chunks[client.id]):
+                    future = executor.submit(
+                        self._fetch_with_retries,
+                        client,
+                        chunk_start,
+                        chunk_end,
+                        variables,
+                    )
+                    pending[future] = (client.id, i)
+
+            for future in tqdm(as_completed(pending), total=len(pending)):
+                station_id, chunk_ind = pending.pop(future)
+                if station_id in failed_stations:
+                    continue
+                try:
+                    chunk_data[station_id][chunk_ind] = future.result()
+                except Exception as ex:
+                    logger.error(f"Failed to extract station {station_id}: {ex}")
+                    failed_stations.add(station_id)
+                    chunk_data.pop(station_id)
+                    all_written = False
+                    continue
+
+                if len(chunk_data[station_id]) < len(station_chunks[station_id]):
+                    continue
+                chunks = chunk_data.pop(station_id)
+                try:
+                    num_rows += writer.write(
+                        _stitch_chunks([chunks[i] for i in range(len(chunks))]),
+                        stored_dates.get(str(station_id)),
+                    )
+                except Exception as ex:
+                    logger.error(f"Failed to write station {station_id}: {ex}")
+                    all_written = False
+        return num_rows, all_written
+
+    def _fetch_with_retries(
+        self,
+        client: PointData,
+        start_date: datetime,
+        end_date: datetime,
+        variables: List[SensorDescription],
+    ) -> Optional[gpd.GeoDataFrame]:
+        """Fetch the data of one station and date range, retrying on errors."""
+        num_retries = self.cfg.system.max_download_attempts
+        for attempt in range(1, num_retries + 1):
+            try:
+                if self.frequency == "hourly":
+                    return client.get_hourly_data(start_date, end_date, variables)
+                return client.get_daily_data(start_date, end_date, variables)
+            except Exception as ex:
+                if attempt >= num_retries:
+                    raise
+                logger.debug(
+                    f"Will retry ({attempt}/{num_retries} attempts so far): "
+                    + f"\nEncountered error while extracting {client.id} "
+                    + f"from {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}: {ex}"
+                )
+                # back off exponentially, e.g. when the service is rate limiting
+                time.sleep(2**attempt)
+        return None
+
     # method override
     def _region_to_items(
         self,
-        region: gpd.GeoDataFrame,
+        region: PreparedAOI,
         start_date: datetime,
         end_date: datetime,
         collection: List[str],
@@ -419,11 +823,54 @@ class MetloomProvider(BaseProvider):
         variables = [self._allowed_assets[id][variable] for variable in collection]
         self.collections = variables
         regions = self._client.points_from_geometry(
-            region,
+            region.to_geodataframe(),
             variables,
+            aoi=region,
             start_date=start_date,
             end_date=end_date,
             cfg=self.cfg,
             max_items=max_items,
         )
         return regions
+
+
+def _stitch_chunks(
+    chunks: List[Optional[gpd.GeoDataFrame]],
+) -> Optional[gpd.GeoDataFrame]:
+    """Concatenate ordered date range chunks of a station, dropping shared boundaries."""
+    frames = [chunk for chunk in chunks if chunk is not None and len(chunk.index) > 0]
+    if len(frames) == 0:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    stitched = pd.concat(frames)
+    stitched = stitched[~stitched.index.duplicated(keep="first")]
+    return gpd.GeoDataFrame(stitched, crs=frames[0].crs)
+
+
+def _incremental_start_date(
+    start_date: datetime,
+    stored_dates: Dict[str, pd.Timestamp],
+    variables: List[SensorDescription],
+    step: pd.Timedelta,
+) -> datetime:
+    """Return the first date that is missing for any of the variables of a station.
+
+    Variables that a station has never reported are ignored once the station has
+    stored data, otherwise stations without a sensor would always be fully refetched.
+
+    Args:
+        start_date: the start of the configured datetime range
+        stored_dates: last stored datetime per variable name for the station
+        variables: the requested variables
+        step: the time between two measurements, e.g. one day for daily data
+    """
+    stored = [stored_dates[v.name] for v in variables if v.name in stored_dates]
+    if len(stored) == 0:
+        return start_date
+    last_complete = min(stored)
+    next_date = last_complete.tz_convert(None) + step
+    if step >= pd.Timedelta(days=1):
+        next_date = next_date.normalize()
+    next_datetime: datetime = next_date.to_pydatetime()
+    return max(start_date, next_datetime)
@@ -1,20 +1,28 @@
-"""EarthData Provider.
+"""Radiant MLHub Provider.
 
 https://www.radiant.earth
 """
 
-import json
 import os
-from typing import Any, List
+import shutil
+import tarfile
+from datetime import datetime, timezone
+from functools import partial
+from glob import iglob
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import dateutil.parser
+import pystac
+import requests
+import shapely.geometry
 from loguru import logger
-from pystac_client.exceptions import APIError
-from radiant_mlhub import Dataset
+from radiant_mlhub.session import get_session
 
+from ..assets import ExtractAsset
 from ..config import CollectionSchema, ConfigSchema, ProviderKey
 from ..util.datetime import datetime_str_to_value
-from .base import BaseProvider
+from ..util.sink import copy_output
 
 
 def _list_wrapper(f: Any) -> Any:
@@ -41,12 +49,18 @@ dateutil.parser.isoparse = _list_wrapper(dateutil.parser.isoparse)
 # import pystac_client after isoparse overwrite, overwrite flake8 checks
 from pystac_client import Client  # noqa : E402
 
+from .stac import STACProvider, _download_wrapper_fn  # noqa : E402
 
-class RadiantMLHub(BaseProvider):
-    """Download data and extract assets from the Radient ML Hub."""
+
+class RadiantMLHub(STACProvider):
+    """Download data and extract assets from the Radient ML Hub.
+
+    Each collection id is a Radiant MLHub dataset id. The dataset's STAC catalog is
+    fetched once and cached in system.cache_dir, and its items are then filtered
+    locally and extracted through the same download path as the other STAC providers.
+    """
 
     description: str = "Radiant ML Hub (RADIANT)"
-    _client: Client
     _default_client_url: str = "https://api.radiant.earth/mlhub/v1"
 
     def __init__(
@@ -56,66 +70,217 @@ class RadiantMLHub(BaseProvider):
         collections: List[CollectionSchema],
         client_url: str = "",
         api_key: str = "",
+        refresh_catalog: bool = False,
         **kwargs: Any,
     ) -> None:
-        """Set up the STAC client."""
+        """Set up the STAC client.
+
+        Args:
+            api_key: Radiant MLHub api key, uses the MLHUB_API_KEY environment variable
+                if not set
+            refresh_catalog: fetch the dataset catalogs even if they are cached
+        """
         if client_url == "":
             client_url = self._default_client_url
         if api_key == "":
             api_key = os.environ.get("MLHUB_API_KEY", "")
         self.api_key = api_key
-        self._client = Client.open(
-            client_url, ignore_conformance=True, parameters={"key": api_key}
-        )
+        self.client_url = client_url
+        self.refresh_catalog = refresh_catalog
 
-        super().__init__(id, cfg, collections, **kwargs)
+        super().__init__(id, cfg, collections, client_url, **kwargs)
+
+    def _open_client(self, client_url: str) -> Client:
+        """Open the STAC API client with the api key."""
+        return Client.open(
+            client_url, ignore_conformance=True, parameters={"key": self.api_key}
+        )
 
     def check_authorization(self) -> bool:
         """Check if the provider is authorized."""
         try:
-            assert self._client._stac_io, "STAC client is not initialized properly"
-            self._client._stac_io.read_text("https://api.radiant.earth/mlhub/v1/search")
+            r = requests.get(
+                f"{self.client_url}/search", params={"key": self.api_key}, timeout=30
+            )
+            r.raise_for_status()
             return True
-        except APIError:
+        except requests.RequestException:
             return False
 
-    def extract_assets(self, dry_run: bool = False) -> bool:
-        """Download a dataset to assigned output_dir."""
-        all_datasets = [x.id for x in Dataset.list()]
-
-        for collection in self.collections:
-            dataset_id = collection.id
-            assert (
-                dataset_id in all_datasets
-            ), f"Collection {dataset_id} does not exist in Radiant ML Hub"
-            assert (
-                collection.datetime is not None
-            ), "Collection {dataset_id} datetime is not set"
-            assert (
-                collection.outdir is not None
-            ), "Collection {dataset_id} outdir is not set"
-
-            dataset = Dataset.fetch_by_id(dataset_id, api_key=self.api_key)
-            if dataset.estimated_dataset_size is not None:
-                sz_mb = int(dataset.estimated_dataset_size) // 1e6
-                logger.info(f"Total {dataset_id} dataset size: {sz_mb:,} MB")
-
-            if dry_run:
+    def _supports_search_option(self, name: str) -> bool:
+        """Items are read from cached catalogs, so options are applied to them."""
+        return False
+
+    # method override
+    def _region_to_items(
+        self,
+        region: Union[shapely.geometry.Polygon, shapely.geometry.MultiPolygon],
+        datetime: str,
+        collection: str,
+        max_items: Optional[int],
+        **search_options: Any,
+    ) -> Iterator[pystac.Item]:
+        """Return the items of a dataset's cached catalog that match the region and datetime.
+
+        Args:
+            region (Union[shapely.geometry.Polygon, shapely.geometry.MultiPolygon]): the region
+            datetime (str): date range ('/' separator) formatted as %Y-%m-%d
+            collection (str): the Radiant MLHub dataset id
+            max_items (Optional[int]): maximum number of items to return, -1 or None
+                for no limit
+        Returns:
+            Iterator[pystac.Item]: an iterable that contains the pystac items
+        """
+        catalog_dir = self._fetch_catalog(collection)
+        start, end = None, None
+        if datetime:
+            start_dt, end_dt = datetime_str_to_value(datetime)
+            start = start_dt.replace(tzinfo=timezone.utc)
+            end = end_dt.replace(tzinfo=timezone.utc)
+
+        num_items = 0
+        for json_file in iglob(
+            os.path.join(catalog_dir, "**", "*.json"), recursive=True
+        ):
+            if max_items is not None and 0 <= max_items <= num_items:
+                break
+            if os.path.basename(json_file) in ("catalog.json", "collection.json"):
                 continue
+            try:
+                # from_file sets the self href, which relative asset hrefs resolve to
+                itm = pystac.Item.from_file(json_file)
+            except pystac.STACTypeError:
+                # not an item, e.g. a label GeoJSON FeatureCollection
+                continue
+            for asset in itm.assets.values():
+                asset.href = asset.get_absolute_href() or asset.href
+            if itm.collection_id is None:
+                itm.collection_id = collection
+            if region is not None and itm.geometry is not None:
+                if not region.intersects(shapely.geometry.shape(itm.geometry)):
+                    continue
+            if start is not None and end is not None:
+                itm_start, itm_end = _item_datetime_range(itm)
+                if itm_start is not None and itm_end is not None:
+                    if itm_end < start or itm_start > end:
+                        continue
+            num_items += 1
+            yield itm
+
+    def _fetch_catalog(self, dataset_id: str) -> str:
+        """Fetch and unarchive a dataset's STAC catalog, unless it is already cached.
 
-            aoi = None
-            if collection.aoi_file is not None:
-                with open(collection.aoi_file) as f:
-                    aoi_data = json.loads(f.read())
-                    aoi = aoi_data["features"]
-                    assert (
-                        len(aoi) == 1
-                    ), "Radiant MLHub only supports one polygon filter"
-                    aoi = aoi[0]
-            dataset.download(
-                intersects=aoi,
-                datetime=datetime_str_to_value(collection.datetime),
-                output_dir=collection.outdir,
-                api_key=self.api_key,
+        Returns:
+            str: the directory of the unarchived catalog
+        """
+        cache_dir = os.path.join(
+            os.path.expanduser(self.cfg.system.cache_dir), "radiant", dataset_id
+        )
+        catalog_dir = os.path.join(cache_dir, dataset_id)
+        if os.path.exists(os.path.join(catalog_dir, "catalog.json")):
+            if not self.refresh_catalog:
+                logger.debug(f"Using cached catalog for {dataset_id}: {catalog_dir}")
+                return catalog_dir
+            shutil.rmtree(catalog_dir)
+
+        logger.info(f"Fetching the STAC catalog of {dataset_id} from {self}")
+        os.makedirs(cache_dir, exist_ok=True)
+        archive = os.path.join(cache_dir, f"{dataset_id}.tar.gz")
+        session = get_session(api_key=self.api_key if self.api_key else None)
+        # the session raises for error responses, and prefixes relative urls with
+        # its default host instead of client_url
+        try:
+            r = session.get(
+                f"{self.client_url.rstrip('/')}/catalog/{dataset_id}", stream=True
             )
-        return True
+        except requests.HTTPError as ex:
+            if ex.response is not None and ex.response.status_code == 404:
+                raise ValueError(
+                    f"Collection {dataset_id} does not exist in Radiant ML Hub"
+                )
+            raise
+        with r:
+            with open(archive, "wb") as f:
+                shutil.copyfileobj(r.raw, f, length=16 * 1024 * 1024)
+
+        with tarfile.open(archive, "r:gz") as tar:
+            members = [
+                m
+                for m in tar.getmembers()
+                if not (os.path.isabs(m.name) or ".." in m.name.split("/"))
+            ]
+            tar.extractall(path=cache_dir, members=members)
+        os.remove(archive)
+        return catalog_dir
+
+    def _query_asset_size_from_download_url(self, asset: ExtractAsset) -> int:
+        """Return the size of files of the cached catalog, query the others."""
+        if _is_local_file(asset.asset.href):
+            asset.filesize_mb = os.path.getsize(asset.asset.href) // 1024 // 1024
+            return asset.filesize_mb
+        return super()._query_asset_size_from_download_url(asset)
+
+    def _get_download_fn(self) -> Callable[..., None]:
+        """Copy files of the cached catalog, download the others."""
+        return _radiant_download_fn
+
+    def _get_asset_to_download_url_fn(self) -> Callable[[pystac.Asset], str]:
+        """Return the function that maps an asset to its download url.
+
+        Assets hosted by the MLHub API require the api key, like dataset.download did.
+        """
+        return partial(
+            _asset_to_download_url,
+            api_host=urlsplit(self.client_url).netloc,
+            api_key=self.api_key,
+        )
+
+
+def _item_datetime_range(
+    itm: pystac.Item,
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Return the (start, end) datetime of an item, which can be a single datetime."""
+    start = itm.common_metadata.start_datetime or itm.datetime
+    end = itm.common_metadata.end_datetime or itm.datetime
+    return start, end
+
+
+def _is_local_file(href: str) -> bool:
+    """Return True if an href is a file of a cached catalog, not a url."""
+    return urlsplit(href).scheme in ("", "file") and os.path.isfile(href)
+
+
+def _radiant_download_fn(
+    asset_to_download_url: Callable[[pystac.Asset], str],
+    ast: ExtractAsset,
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Asset download function that copies the files included in catalog archives.
+
+    Assets with relative hrefs (e.g. labels next to the item JSON) resolve to files
+    of the unarchived catalog.
+    """
+    if ast.clip_bounds is None and _is_local_file(ast.asset.href):
+        copy_output(ast.asset.href, ast.outfile, storage_options)
+        return
+    _download_wrapper_fn(asset_to_download_url, ast, storage_options)
+
+
+def _asset_to_download_url(
+    asset: pystac.Asset, api_host: str = "", api_key: str = ""
+) -> str:
+    """Return the download url for the given asset.
+
+    Some datasets (e.g. spacenet) reference s3:// hrefs, which are publicly
+    accessible over https. Hrefs on the api host get the api key as `key` parameter.
+    """
+    href = str(asset.href)
+    if href.startswith("s3://"):
+        bucket, _, key = href[len("s3://") :].partition("/")
+        return f"https://{bucket}.s3.amazonaws.com/{key}"
+    parts = urlsplit(href)
+    if api_key and api_host and parts.netloc == api_host:
+        query = [(k, v) for k, v in parse_qsl(parts.query) if k != "key"]
+        query.append(("key", api_key))
+        return urlunsplit(parts._replace(query=urlencode(query)))
+    return href
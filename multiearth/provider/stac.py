@@ -1,24 +1,62 @@
 """A Generic STAC Provider."""
 
+import json
 import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from multiprocessing import JoinableQueue, Queue
 from queue import Empty
 from time import sleep
-from typing import Any, Callable, Iterator, List, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
-import geopandas as gpd
 import pystac
 import requests
 import shapely
 import shapely.geometry
 from loguru import logger
+from omegaconf import OmegaConf
 from pystac_client import Client
 from tqdm import tqdm
 from tqdm.contrib.concurrent import thread_map
 
-from ..assets import DownloadWrapper, ExtractAsset, ExtractAssetCollection
+from ..assets import (
+    DownloadWrapper,
+    ExtractAsset,
+    ExtractAssetCollection,
+    deduplicate_assets,
+)
 from ..config import CollectionSchema, ConfigSchema, ProviderKey
+from ..util.aoi import load_aoi
+from ..util.cache import AssetCache, open_asset_cache
+from ..util.cog import is_cog_asset, try_clip_cog
+from ..util.convert import convert_asset, converted_outfile
+from ..util.cover import select_min_cover
+from ..util.cube import append_to_cube
+from ..util.filter import filter_items
 from ..util.misc import item_href_to_outfile, stream_download
 from ..util.multi import create_download_workers_and_queues
+from ..util.plan import asset_to_record, record_to_asset
+from ..util.sink import copy_output, existing_output_sizes, is_remote, remove_output
+from ..util.validators import ValidatorStore, conditional_headers
+from ..util.watch import WatchState, advance_mark
+from ..util.work_queue import WorkQueue
 from .base import BaseProvider
 
 __all__ = ["STACProvider"]
@@ -28,14 +66,36 @@ class STACProvider(BaseProvider):
     """Provides standard STAC API region_to_items method."""
 
     description: str = "STAC Provider"
+    supports_iter_assets = True
+    supports_work_queue = True
+    supports_watch = True
 
     # max items allowed client
     _max_items: int = 10000
+    # conformance class (suffix) of each search option of the collection config
+    _search_conformance: Dict[str, str] = {
+        "filter": "item-search#filter",
+        "query": "item-search#query",
+        "sortby": "item-search#sort",
+    }
     _default_client_url: str
-    _client: Client
+    _client_url: str
+    _opened_client: Optional[Client] = None
+    _session: Optional[requests.Session] = None
+    _asset_cache: Optional[AssetCache] = None
+    _validator_store: Optional[ValidatorStore] = None
+    # download workers and their (job, finished, failed) queues, kept across downloads
+    _download_queues: Optional[
+        Tuple[
+            "JoinableQueue[DownloadWrapper]",
+            "Queue[DownloadWrapper]",
+            "Queue[Tuple[DownloadWrapper, Exception]]",
+        ]
+    ] = None
     completed_assets: ExtractAssetCollection
     error_assets: ExtractAssetCollection
     all_assets: ExtractAssetCollection
+    planned_assets: Optional[ExtractAssetCollection] = None
 
     def __init__(
         self,
@@ -55,11 +115,30 @@ class STACProvider(BaseProvider):
             if self._default_client_url == "":
                 raise ValueError(f"Client URL not provided for {self}.")
             client_url = self._default_client_url
-        self._client = Client.open(client_url, ignore_conformance=True)
+        self._client_url = client_url
+        self._asset_cache = open_asset_cache(
+            cfg.system.cache_dir, cfg.system.asset_cache_size_gb
+        )
+        # outfiles of existing assets that changed, which are downloaded again
+        self._changed_outfiles: Set[str] = set()
 
         self.completed_assets = ExtractAssetCollection()
         self.error_assets = ExtractAssetCollection()
 
+    @property
+    def _client(self) -> Client:
+        """Return the STAC API client, opened when it's first used.
+
+        Executing a plan doesn't search, so it never opens the client.
+        """
+        if self._opened_client is None:
+            self._opened_client = self._open_client(self._client_url)
+        return self._opened_client
+
+    def _open_client(self, client_url: str) -> Client:
+        """Open the STAC API client - can be overridden, e.g. to add parameters."""
+        return Client.open(client_url, ignore_conformance=True)
+
     # abstractclassmethod
     def check_authorization(self) -> bool:
         """Check if the provider is authorized - meant to be overridden."""
@@ -75,36 +154,343 @@ class STACProvider(BaseProvider):
         # 1. For each collection in the configuration, query the items in the collection
         # 2. For each item in the collection, query the assets in the
         #    item and obtain filesizes if possible
-        # 3. Add all assets to the extraction queue
-        # 4. Download each asset in the extraction queue
-
-        self.all_assets = ExtractAssetCollection()
-        for coll_cfg in self.collections:
-            ea_coll = self._get_extract_assets_collection(coll_cfg)
-            self.all_assets += ea_coll
-
-        self._prepare_assets_for_extraction(self.all_assets)
-        summary, detailed = self.all_assets.summary()
-        logger.info("\n\n" + summary)
-        logger.debug(detailed)
+        # 3. Remove duplicate assets, which are copied from one download instead
+        # 4. Keep the assets of this shard when extracting on multiple machines
+        # 5. Add all assets to the extraction queue
+        # 6. Download each asset in the extraction queue
+        self._plan_assets()
 
         # kick off the download if not a dry run
         success = True
         if not dry_run:
             success = self._download()
+            success = self._build_cubes() and success
         else:
             logger.info("Dry run - not downloading assets.")
+        self._write_manifest()
+        return success
+
+    def iter_assets(
+        self, prefetch: int = -1, dry_run: bool = False
+    ) -> Iterator[ExtractAsset]:
+        """Extract the assets and yield each one as soon as it's available locally.
+
+        Assets that are already downloaded (or in the asset cache) are yielded
+        first, then the downloads as they finish. At most prefetch downloads are
+        ahead of the consumer, i.e. queued, running, converting, or finished but
+        not yet yielded, so the downloads stay just ahead of it. Assets are
+        converted in a process pool (like extract_assets) before they're yielded,
+        so their conversions overlap with the downloads, and datacubes are built
+        once all are yielded.
+
+        Args:
+            prefetch (int): maximum number of downloads ahead of the consumer, -1
+                for system.max_concurrent_extractions
+            dry_run (bool): only yield the assets that are already downloaded
+        Returns:
+            Iterator[ExtractAsset]: the extracted assets, see their outfile (and
+                converted_outfile)
+        """
+        if prefetch < 1:
+            prefetch = max(1, self.cfg.system.max_concurrent_extractions)
+        self._plan_assets()
+        self.completed_assets = ExtractAssetCollection()
+        self.error_assets = ExtractAssetCollection()
+        executor: Optional[ProcessPoolExecutor] = None
+        if any(ast.convert_to for ast in self.all_assets):
+            executor = ProcessPoolExecutor(
+                max_workers=max(1, self.cfg.system.max_concurrent_conversions)
+            )
+        conversions: Dict["Future[str]", ExtractAsset] = {}
+
+        def convert(ast: ExtractAsset) -> bool:
+            """Start converting an asset, False if it doesn't need converting."""
+            if executor is None or not ast.convert_to or ast.converted_outfile:
+                return False
+            future = executor.submit(
+                convert_asset, ast.outfile, ast.convert_to, ast.remove_raw
+            )
+            conversions[future] = ast
+            return True
+
+        def converted(futures: Iterable["Future[str]"]) -> Iterator[ExtractAsset]:
+            """Yield the assets of finished conversions."""
+            for future in futures:
+                ast = conversions.pop(future)
+                self._record_conversion(future, ast)
+                yield ast
+
+        try:
+            if not dry_run:
+                self._remove_changed_assets()
+                self._link_cached_assets()
+                self._copy_to_duplicates()
+            to_download = []
+            for ast in self.all_assets:
+                if not ast.downloaded:
+                    to_download.append(ast)
+                elif not convert(ast):
+                    yield ast
+            if dry_run:
+                logger.info("Dry run - not downloading assets.")
+                yield from converted(as_completed(list(conversions)))
+                return
+
+            job_q, finished_q, fail_q = self._get_download_queues()
+            pending: Dict[str, ExtractAsset] = {}
+            jobs = iter(to_download)
+            failures: List[Tuple[DownloadWrapper, Exception]] = []
+
+            def submit() -> None:
+                while len(pending) + len(conversions) < prefetch:
+                    ast = next(jobs, None)
+                    if ast is None:
+                        return
+                    pending[ast.outfile] = ast
+                    job_q.put(self._get_download_wrapper(ast))
+
+            submit()
+            while len(pending) > 0 or len(conversions) > 0:
+                yield from converted([f for f in conversions if f.done()])
+                submit()
+                if len(pending) == 0:
+                    wait(list(conversions), timeout=1, return_when=FIRST_COMPLETED)
+                    continue
+                try:
+                    dwrap, ex = fail_q.get_nowait()
+                    failures.append((dwrap, ex))
+                    pending.pop(dwrap.asset.outfile, None)
+                    submit()
+                    continue
+                except Empty:
+                    pass
+                try:
+                    # check the conversions often while they run
+                    dwrap = finished_q.get(timeout=0.1 if conversions else 1)
+                except Empty:
+                    continue
+                ast = self._complete_download(dwrap, pending)
+                pending.pop(ast.outfile, None)
+                if not convert(ast):
+                    yield ast
+                submit()
+            self._record_failures(failures)
+            self._build_cubes()
+        finally:
+            if executor is not None:
+                # e.g. the consumer stopped early, don't start the other conversions
+                for future in conversions:
+                    future.cancel()
+                executor.shutdown()
+            self._write_manifest()
+
+    def enqueue_assets(self, queue: WorkQueue) -> int:
+        """Plan the extraction and put the downloads into a shared work queue.
+
+        Jobs are plain JSON records of the asset and of the provider options that
+        rebuild its downloads in the workers (see run_queue_job), so the workers
+        never load code from the queue.
+
+        Returns:
+            int: the number of downloads added to (or requeued in) the queue
+        """
+        self._plan_assets()
+        self._remove_changed_assets()
+        jobs = [
+            (ast.outfile, json.dumps(self._queue_job(ast)).encode())
+            for ast in self.all_assets
+            if not ast.downloaded
+        ]
+        return queue.put(jobs, self.cfg.system.max_download_attempts)
+
+    def _queue_job(self, ast: ExtractAsset) -> Dict[str, Any]:
+        """Return the work queue job of an asset."""
+        return dict(
+            provider=self.id.name,
+            provider_kwargs=self._queue_provider_kwargs(),
+            # the asset isn't indexed in a config's providers
+            asset=asset_to_record(ast, -1, self.id.name),
+        )
+
+    def _queue_provider_kwargs(self) -> Dict[str, Any]:
+        """Return the kwargs that rebuild the provider's downloads in a queue worker.
+
+        They're stored in the queue, so they must not include secrets such as api
+        keys, which the workers read from their own environment.
+        """
+        return dict(client_url=self._client_url)
+
+    def run_queue_job(self, record: Dict[str, Any]) -> None:
+        """Download the asset of a work queue job (see enqueue_assets).
+
+        Args:
+            record (Dict[str, Any]): the job's asset, see util.plan.asset_to_record
+        """
+        self._get_download_wrapper(record_to_asset(record))()
+
+    def plan_assets(self) -> ExtractAssetCollection:
+        """Find the assets of the collections, before deduplication and sharding."""
+        planned = ExtractAssetCollection()
+        for coll_cfg in self.collections:
+            planned += self._get_extract_assets_collection(coll_cfg)
+        self.planned_assets = planned
+        return planned
+
+    def poll_assets(self, state: WatchState, dry_run: bool = False) -> bool:
+        """Extract the assets of the items that are new since the last poll, for watch.
+
+        Each collection is searched from its high-water mark in state on (the
+        latest extracted item datetime, or watch_property), so only the new items
+        are checked and downloaded, by the same download workers at every poll.
+
+        Args:
+            state (WatchState): the high-water marks of the watched collections
+            dry_run (bool): only log the new assets, without extracting them or
+                advancing the marks
+        Returns:
+            bool: True if all new assets were extracted successfully
+        """
+        polled: List[Tuple[str, str, str, Set[str], ExtractAssetCollection]] = []
+        new_assets = ExtractAssetCollection()
+        for coll_cfg in self.collections:
+            key = self._watch_key(coll_cfg)
+            mark, seen = state.get(key)
+            coll_assets = ExtractAssetCollection()
+            for ast in self._get_extract_assets_collection(
+                self._poll_config(coll_cfg, mark)
+            ):
+                # assets at the mark itself were found by the previous poll
+                if ast.id not in seen:
+                    coll_assets.add_asset(ast)
+            polled.append((key, coll_cfg.watch_property, mark, seen, coll_assets))
+            new_assets += coll_assets
+        if len(new_assets) == 0:
+            logger.info(f"No new assets for {self}")
+            return True
+
+        deduplicate_assets([new_assets])
+        self.planned_assets = new_assets
+        self.completed_assets = ExtractAssetCollection()
+        self.error_assets = ExtractAssetCollection()
+        self._plan_assets()
+        success = True
+        if not dry_run:
+            success = self._download()
+            success = self._build_cubes() and success
+        self._write_manifest()
+        if dry_run:
+            return success
+
+        failed = set(self.error_assets.assets.keys())
+        for key, watch_property, mark, seen, coll_assets in polled:
+            times = [
+                (ast.id, _watch_time(ast, watch_property), ast.id in failed)
+                for ast in coll_assets
+            ]
+            new_mark, new_seen = advance_mark(
+                mark,
+                seen,
+                extracted=[(id, t) for id, t, is_failed in times if not is_failed],
+                failed=[(id, t) for id, t, is_failed in times if is_failed],
+            )
+            state.put(key, new_mark, new_seen)
+            if new_mark != mark:
+                logger.info(f"Advanced the {watch_property} of {key} to {new_mark}")
         return success
 
+    def _watch_key(self, cfg: CollectionSchema) -> str:
+        """Return the key of the high-water mark of a watched collection."""
+        key = f"{self.id.value}/{cfg.id}/{cfg.outdir}"
+        if self.cfg.system.num_shards > 1:
+            key += (
+                f"/shard{self.cfg.system.shard_index}-of-{self.cfg.system.num_shards}"
+            )
+        return key
+
+    def _poll_config(self, cfg: CollectionSchema, mark: str) -> CollectionSchema:
+        """Return the collection config that searches for the items from the mark on."""
+        if not mark:
+            # the first poll searches the configured datetime range
+            return cfg
+        poll_cfg: Any = OmegaConf.merge(cfg, {})
+        if cfg.watch_property == "datetime":
+            end = (
+                cfg.datetime.split("/")[1]
+                if cfg.datetime and "/" in cfg.datetime
+                else ""
+            )
+            poll_cfg.datetime = f"{mark}/{end or '..'}"
+        else:
+            query: Any = OmegaConf.to_container(OmegaConf.create(cfg.query or {}))
+            query.setdefault(cfg.watch_property, {})["gte"] = mark
+            poll_cfg.query = query
+        return cast(CollectionSchema, poll_cfg)
+
+    def _plan_assets(self) -> None:
+        """Find the assets of the collections (of this shard) that need downloading.
+
+        Uses the assets planned (and deduplicated across providers) by plan_assets,
+        or plans and deduplicates them if they weren't.
+        """
+        if self.planned_assets is None:
+            deduplicate_assets([self.plan_assets()])
+        assert self.planned_assets is not None
+        self.all_assets = self.planned_assets
+
+        num_shards = self.cfg.system.num_shards
+        if num_shards > 1:
+            num_planned = len(self.all_assets)
+            self.all_assets = self.all_assets.shard(
+                self.cfg.system.shard_index, num_shards
+            )
+            logger.info(
+                f"Shard {self.cfg.system.shard_index} of {num_shards} extracts "
+                + f"{len(self.all_assets):,} of {num_planned:,} assets"
+            )
+
+        self._prepare_assets_for_extraction(self.all_assets)
+        summary, detailed = self.all_assets.summary()
+        logger.info("\n\n" + summary)
+        logger.debug(detailed)
+
+    def _write_manifest(self) -> None:
+        """Append the status of each asset of this run to the run's manifest file."""
+        manifest_file = os.path.join(
+            self.cfg.system.log_outdir, f"{self.cfg.run_id}_manifest.jsonl"
+        )
+        failed = set(self.error_assets.assets.keys())
+        with open(manifest_file, "a") as f:
+            for ast in self.all_assets:
+                if ast.id in failed:
+                    status = "failed"
+                else:
+                    status = "downloaded" if ast.downloaded else "not_downloaded"
+                record = dict(
+                    id=ast.id,
+                    provider=ast.provider_name,
+                    collection=ast.collection_name,
+                    asset_name=ast.asset_name,
+                    outfile=ast.outfile,
+                    filesize_mb=ast.filesize_mb,
+                    status=status,
+                    converted_outfile=ast.converted_outfile,
+                    datetime=ast.datetime,
+                    duplicate_outfiles=ast.duplicate_outfiles,
+                )
+                f.write(json.dumps(record) + "\n")
+
     def _get_extract_assets_collection(
         self, cfg: CollectionSchema
     ) -> ExtractAssetCollection:
         """Get the collection for the extract assets."""
         # read/parse aoi if needed
         aoi = None
+        search_region = None
         if cfg.aoi_file:
             logger.debug(f"loading area of interest file: {cfg.aoi_file}")
-            aoi = gpd.read_file(cfg.aoi_file).unary_union
+            aoi = load_aoi(cfg.aoi_file)
+            # search with a simplified superset of the aoi to keep requests small
+            search_region = aoi.search_geometry(self.cfg.system.aoi_search_tolerance)
 
         # appease mypy
         dt = cfg.datetime if cfg.datetime else ""
@@ -112,27 +498,167 @@ class STACProvider(BaseProvider):
         outdir = cfg.outdir if cfg.outdir else ""
         assets = cfg.assets if cfg.assets else []
 
-        # get the items from the input cfg
-        itm_set = list(self._region_to_items(aoi, dt, id, cfg.max_items))
+        # get the items from the input cfg, filtered by the server where possible
+        search_options = self._search_options(cfg)
+        server_options = {
+            name: value
+            for name, value in search_options.items()
+            if self._supports_search_option(name)
+        }
+        client_options = {
+            name: value
+            for name, value in search_options.items()
+            if name not in server_options
+        }
+        if len(client_options) > 0:
+            logger.info(
+                f"{self} does not support {', '.join(client_options)} for {id}, "
+                + "applying them to the returned items instead"
+            )
+            # page through the whole search, the matching items can be anywhere in it
+            num_scanned = 0
+
+            def count(items: Iterator[pystac.Item]) -> Iterator[pystac.Item]:
+                nonlocal num_scanned
+                for itm in items:
+                    num_scanned += 1
+                    yield itm
+
+            items = self._region_to_items(search_region, dt, id, None, **server_options)
+            itm_set = list(
+                filter_items(count(items), max_items=cfg.max_items, **client_options)
+            )
+            logger.info(
+                f"{len(itm_set)} of {num_scanned} items searched for {id} "
+                + f"match its {', '.join(client_options)}"
+            )
+        else:
+            itm_set = list(
+                self._region_to_items(
+                    search_region, dt, id, cfg.max_items, **server_options
+                )
+            )
+        if aoi is not None and search_region is not aoi.geometry:
+            # remove items that only intersect the simplified search region
+            num_searched = len(itm_set)
+            itm_set = [
+                itm
+                for itm in itm_set
+                if itm.geometry is None
+                or aoi.intersects(shapely.geometry.shape(itm.geometry))
+            ]
+            if len(itm_set) < num_searched:
+                logger.debug(
+                    f"Removed {num_searched - len(itm_set)} items for {id} "
+                    + "that do not intersect the area of interest"
+                )
         logger.info(
             f"{self} returned {len(itm_set)} items for {id} "
             + f"for datetime {cfg.datetime}"
         )
+        if cfg.min_cover_time_bin:
+            if aoi is None:
+                logger.warning(
+                    f"min_cover_time_bin requires an aoi_file, ignoring it for {id}"
+                )
+            else:
+                num_returned = len(itm_set)
+                itm_set = select_min_cover(
+                    itm_set, aoi.geometry, cfg.min_cover_time_bin
+                )
+                logger.info(
+                    f"Selected {len(itm_set)} of {num_returned} items for {id} "
+                    + f"that cover the area of interest per {cfg.min_cover_time_bin}"
+                )
 
         logger.debug(f"Adding item assets from {self} to extraction tasks")
         outdir = os.path.join(outdir, id)
         extract_assets = ExtractAssetCollection()
+        if cfg.clip_to_aoi and aoi is None:
+            logger.warning(f"clip_to_aoi requires an aoi_file, ignoring it for {id}")
+        # grid cell (e.g. tile) of each asset, which gets its own datacube
+        grid_codes: Dict[str, str] = {}
         for itm in itm_set:
-            extract_assets += self._extract_assets_from_item(itm, assets, outdir)
+            itm_assets = self._extract_assets_from_item(itm, assets, outdir)
+            if cfg.clip_to_aoi and aoi is not None:
+                self._set_clip_bounds(itm, itm_assets, aoi.geometry)
+            grid_code = str(itm.properties.get("grid:code") or "")
+            for ast in itm_assets:
+                grid_codes[ast.id] = grid_code
+            extract_assets += itm_assets
+
+        if cfg.convert_to:
+            # validate the format before downloading anything
+            converted_outfile("", cfg.convert_to)
+            if is_remote(outdir):
+                logger.warning(
+                    f"Converting requires a local outdir, not converting {id} assets"
+                )
+            else:
+                for ast in extract_assets:
+                    ast.convert_to = cfg.convert_to
+                    ast.remove_raw = cfg.remove_raw
+
+        if cfg.build_cube:
+            if is_remote(outdir):
+                logger.warning(
+                    f"Datacubes require a local outdir, not building them for {id}"
+                )
+            else:
+                for ast in extract_assets:
+                    grid_code = grid_codes.get(ast.id, "")
+                    name = (
+                        f"{ast.asset_name}_{grid_code}" if grid_code else ast.asset_name
+                    )
+                    ast.cube_store = os.path.join(outdir, f"{name}.zarr")
 
         return extract_assets
 
+    def _set_clip_bounds(
+        self,
+        itm: pystac.Item,
+        extract_assets: ExtractAssetCollection,
+        aoi_geometry: shapely.geometry.base.BaseGeometry,
+    ) -> None:
+        """Subset the COG assets of an item to the part of the item within the AOI.
+
+        The size of a subset is unknown until it's written, so it's not compared with
+        the size of the full asset.
+        """
+        region = aoi_geometry
+        if itm.geometry is not None:
+            overlap = aoi_geometry.intersection(shapely.geometry.shape(itm.geometry))
+            if not overlap.is_empty:
+                region = overlap
+        minx, miny, maxx, maxy = region.bounds
+        for ast in extract_assets:
+            if is_cog_asset(ast.asset):
+                ast.clip_bounds = (minx, miny, maxx, maxy)
+                ast.filesize_mb = -1
+
+    def _search_options(self, cfg: CollectionSchema) -> Dict[str, Any]:
+        """Return the filter, query and sortby of a collection config that are set."""
+        options: Dict[str, Any] = {}
+        for name in self._search_conformance:
+            value = getattr(cfg, name, None)
+            if value:
+                options[name] = OmegaConf.to_container(OmegaConf.create(value))
+        return options
+
+    def _supports_search_option(self, name: str) -> bool:
+        """Return True if the STAC API supports a search option (e.g. filter)."""
+        conforms_to = self._client.extra_fields.get("conformsTo") or []
+        return any(
+            str(uri).endswith(self._search_conformance[name]) for uri in conforms_to
+        )
+
     def _region_to_items(
         self,
         region: Union[shapely.geometry.Polygon, shapely.geometry.MultiPolygon],
         datetime: str,
         collection: str,
-        max_items: int,
+        max_items: Optional[int],
+        **search_options: Any,
     ) -> Iterator[pystac.Item]:
         """Create ItemCollection from a given region between start_date and end_date.
 
@@ -141,21 +667,42 @@ class STACProvider(BaseProvider):
             datetime (str): Single date+time, or a range ('/' separator), formatted to RFC 3339,
                 section 5.6. Use double dots .. for open date ranges.
             collection (str): collection to include in the returned ItemCollection
-            max_items (int): maximum number of items to return, -1 for no limit/provider limit
+            max_items (Optional[int]): maximum number of items to return, -1 for the
+                provider limit, None to page through all the items
+            search_options: filter, query and/or sortby for the search, only passed if
+                _supports_search_option returns True for them
         Returns:
             Iterator[pystac.Item]: an iterable that contains the pystac items
         """
-        if max_items < 0:
+        capped = max_items is not None and max_items < 0
+        if capped:
             max_items = self._max_items
         search = self._client.search(
             datetime=datetime,
             collections=collection,
             intersects=region,
             max_items=max_items,
+            **search_options,
         )
         items: Iterator[pystac.Item] = search.items()
+        if capped:
+            return self._warn_at_cap(items, collection)
         return items
 
+    def _warn_at_cap(
+        self, items: Iterator[pystac.Item], collection: str
+    ) -> Iterator[pystac.Item]:
+        """Yield the items of a search, warning if it stopped at the provider limit."""
+        num_items = 0
+        for itm in items:
+            num_items += 1
+            yield itm
+        if num_items >= self._max_items:
+            logger.warning(
+                f"Search for {collection} stopped at {self} limit of {num_items} "
+                + "items, set max_items to get more"
+            )
+
     def _extract_assets_from_item(
         self, itm: pystac.Item, itm_assets_to_extract: List[str], outdir: str
     ) -> ExtractAssetCollection:
@@ -170,6 +717,7 @@ class STACProvider(BaseProvider):
         assert itm.collection_id is not None, "Item must have a collection ID"
 
         assets = itm.get_assets()
+        itm_datetime = itm.datetime or itm.common_metadata.start_datetime
         if len(itm_assets_to_extract) == 1 and itm_assets_to_extract[0] == "all":
             itm_assets_to_extract = list(assets.keys())
 
@@ -199,6 +747,7 @@ class STACProvider(BaseProvider):
                 filesize_mb=file_size,
                 provider_name=self.description,
                 collection_name=itm.collection_id,
+                datetime=itm_datetime.isoformat() if itm_datetime else "",
             )
             extract_assets.add_asset(ea)
 
@@ -219,7 +768,8 @@ class STACProvider(BaseProvider):
         logger.debug("Checking asset sizes")
         asts_with_unknown_filesize = []
         for ast in extract_assets:
-            if ast.filesize_unknown():
+            # the size of a subset is unknown, not that of the full asset
+            if ast.filesize_unknown() and ast.clip_bounds is None:
                 asts_with_unknown_filesize.append(ast)
 
         if len(asts_with_unknown_filesize) > 0:
@@ -242,20 +792,32 @@ class STACProvider(BaseProvider):
         if assets_with_unknown_filesize > 0:
             logger.info(f"{assets_with_unknown_filesize} assets have unknown file size")
 
+        # assets converted by a previous run, which may have removed the raw file
+        for ast in extract_assets:
+            if ast.convert_to:
+                converted = converted_outfile(ast.outfile, ast.convert_to)
+                if os.path.exists(converted):
+                    ast.downloaded = True
+                    ast.converted_outfile = converted
+
         # Remove possibly corrupt downloads
         removed_ct = 0
+        storage_options = self._storage_options()
+        existing_sizes = existing_output_sizes(
+            (ast.outfile for ast in extract_assets), storage_options
+        )
         for ast in extract_assets:
-            if os.path.exists(ast.outfile):
+            if ast.outfile in existing_sizes and not ast.converted_outfile:
                 # check if the size of the file is as expected, else remove
                 skip = True
-                mb_size = os.path.getsize(ast.outfile) // 1e6
+                mb_size = existing_sizes[ast.outfile] // 1e6
                 if ast.filesize_mb > 0 and max(5, abs(mb_size - ast.filesize_mb)) > 5:
                     if self.cfg.system.remove_existing_if_wrong_size:
                         logger.info(
                             f"Removing {ast.outfile} because it is {mb_size:,}MB"
                             + f" instead of {ast.filesize_mb:,}MB"
                         )
-                        os.remove(ast.outfile)
+                        remove_output(ast.outfile, storage_options)
                         ast.downloaded = False
                         skip = False
                     else:
@@ -274,11 +836,128 @@ class STACProvider(BaseProvider):
                 f"Removed {removed_ct:,} files that may not be fully downloaded or corrupt"
             )
 
+        if self.cfg.system.refresh:
+            self._refresh_assets(extract_assets, existing_sizes)
+
+    def _get_validator_store(self) -> ValidatorStore:
+        """Return the store of the validators of downloaded assets."""
+        if self._validator_store is None:
+            self._validator_store = ValidatorStore(
+                os.path.join(self.cfg.system.cache_dir, "validators.db")
+            )
+        return self._validator_store
+
+    def _refresh_assets(
+        self, extract_assets: ExtractAssetCollection, existing_sizes: Dict[str, int]
+    ) -> None:
+        """Download existing assets again if they changed since they were downloaded.
+
+        Each existing asset with stored validators is checked with a conditional
+        request, which returns 304 without a body if the asset is unchanged, so
+        checking an archive costs one small request per asset.
+        """
+        # subsets and converted assets are derived from the downloads
+        existing = [
+            ast
+            for ast in extract_assets
+            if ast.downloaded
+            and ast.clip_bounds is None
+            and not ast.converted_outfile
+            and ast.outfile in existing_sizes
+        ]
+        stored = self._get_validator_store().get_many(ast.outfile for ast in existing)
+        to_check = []
+        changed_assets = []
+        for ast in existing:
+            validators = stored.get(ast.outfile, {})
+            size = validators.get("Content-Length")
+            if size is not None and int(size) != existing_sizes[ast.outfile]:
+                # changed (or truncated) locally since the download
+                changed_assets.append(ast)
+            elif len(conditional_headers(validators)) > 0:
+                to_check.append((ast, validators))
+        num_unknown = len(existing) - len(to_check)
+        if num_unknown > 0:
+            logger.info(
+                f"{num_unknown:,} existing assets have no stored ETag or Last-Modified, "
+                + "not checking them for changes"
+            )
+        if len(to_check) > 0:
+            logger.info(f"Checking {len(to_check):,} existing assets for changes")
+            changed = thread_map(
+                lambda args: self._asset_changed(*args),
+                to_check,
+                max_workers=self.cfg.system.max_concurrent_extractions,
+            )
+            num_changed = 0
+            for (ast, _), is_changed in zip(to_check, changed):
+                if is_changed:
+                    changed_assets.append(ast)
+                    num_changed += 1
+            logger.info(
+                f"{num_changed:,} of {len(to_check):,} existing assets changed, "
+                + "downloading them again"
+            )
+
+        # removed by _remove_changed_assets when they're downloaded, not by dry runs
+        for ast in changed_assets:
+            ast.downloaded = False
+            self._changed_outfiles.add(ast.outfile)
+
+    def _remove_changed_assets(self) -> None:
+        """Remove the outfiles and cached objects of changed assets before downloading.
+
+        The cached object is stale too (often of the same size), and the outfile may
+        be a hardlink of it, which the download must not rewrite.
+        """
+        storage_options = self._storage_options()
+        for ast in self.all_assets:
+            if ast.downloaded or ast.outfile not in self._changed_outfiles:
+                continue
+            if self._asset_cache is not None:
+                self._asset_cache.remove(ast.asset.href)
+            try:
+                remove_output(ast.outfile, storage_options)
+            except FileNotFoundError:
+                pass
+
+    def _asset_changed(
+        self, asset: ExtractAsset, validators: Dict[str, str], default: bool = False
+    ) -> bool:
+        """Return True if a conditional request shows that the asset changed.
+
+        Args:
+            asset (ExtractAsset): the asset to check
+            validators (Dict[str, str]): the validators of its last download
+            default (bool): returned if the request fails
+        """
+        download_url = self._get_asset_to_download_url_fn()(asset.asset)
+        session = self._get_requests_session()
+        try:
+            with session.get(
+                download_url,
+                headers=conditional_headers(validators),
+                stream=True,
+                timeout=30,
+            ) as response:
+                if response.status_code == 304:
+                    return False
+                if response.status_code == 200:
+                    return True
+                logger.warning(
+                    f"Unable to check {asset.outfile} for changes: "
+                    + f"HTTP {response.status_code}"
+                )
+        except requests.RequestException as ex:
+            logger.warning(f"Unable to check {asset.outfile} for changes: {ex}")
+        return default
+
     def _query_asset_size_from_download_url(self, asset: ExtractAsset) -> int:
         """Query the size of the asset from the download url using an http request."""
         download_url = self._get_asset_to_download_url_fn()(asset.asset)
         asset.filesize_mb = -1
-        with requests.get(download_url, stream=True, timeout=10) as response:
+        session = self._get_requests_session()
+        with session.get(download_url, stream=True, timeout=10) as response:
             try:
                 response.raise_for_status()
             except requests.exceptions.HTTPError as e:
@@ -301,29 +980,237 @@ class STACProvider(BaseProvider):
         """
         return _asset_to_download_url
 
+    def _get_requests_session(self) -> requests.Session:
+        """Return the (pooled) session used for requests from the main process."""
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def _get_download_fn(self) -> Callable[..., None]:
+        """Return the function that downloads a single asset in a download worker.
+
+        The function is called with the `ast`, `asset_to_download_url` and
+        `storage_options` (for fsspec output urls) keyword arguments and must be
+        picklable, e.g. a module level function or a partial.
+        """
+        return _download_wrapper_fn
+
+    def _get_download_wrapper(self, ast: ExtractAsset) -> DownloadWrapper:
+        """Return the (picklable) download job of an asset."""
+        return DownloadWrapper(
+            asset=ast,
+            download_func=self._get_download_fn(),
+            download_kwargs=dict(
+                ast=ast,
+                asset_to_download_url=self._get_asset_to_download_url_fn(),
+                storage_options=self._storage_options(),
+            ),
+        )
+
+    def _storage_options(self) -> Dict[str, Any]:
+        """Return the fsspec options of the output filesystem as a plain dict."""
+        options: Any = OmegaConf.to_container(
+            OmegaConf.create(self.cfg.system.storage_options)
+        )
+        return cast(Dict[str, Any], options)
+
     def _download(self) -> bool:
-        """Download the assets and return true if no errors."""
-        if self.all_assets is None or self.all_assets.num_assets_to_download() == 0:
+        """Download (and convert) the assets and return true if no errors.
+
+        Conversions run in a process pool, starting as soon as each asset has
+        downloaded, so the CPU-bound conversions overlap with the downloads.
+        """
+        if self.all_assets is None:
             return True
+        self._remove_changed_assets()
+        num_cached = self._link_cached_assets()
+        if num_cached > 0:
+            logger.info(f"Linked {num_cached:,} assets from the asset cache")
+        self._copy_to_duplicates()
+        if not any(ast.convert_to for ast in self.all_assets):
+            return self._download_assets()
 
-        logger.info("Starting data download")
+        conversions: Dict["Future[str]", ExtractAsset] = {}
+        with ProcessPoolExecutor(
+            max_workers=max(1, self.cfg.system.max_concurrent_conversions)
+        ) as executor:
 
-        job_q, finished_q, fail_q = create_download_workers_and_queues(
-            self.cfg.system.max_concurrent_extractions,
-            self.cfg.system.max_download_attempts,
-        )
+            def convert(ast: ExtractAsset) -> None:
+                if ast.convert_to and not ast.converted_outfile:
+                    future = executor.submit(
+                        convert_asset, ast.outfile, ast.convert_to, ast.remove_raw
+                    )
+                    conversions[future] = ast
+
+            # assets downloaded by a previous run
+            for ast in self.all_assets:
+                if ast.downloaded:
+                    convert(ast)
+            success = self._download_assets(convert)
+            success = self._wait_for_conversions(conversions) and success
+        return success
 
+    def _build_cubes(self) -> bool:
+        """Append the downloaded assets to their datacubes, return true if no errors."""
+        sources: Dict[str, List[Tuple[str, str]]] = {}
         for ast in self.all_assets:
-            if not ast.downloaded:
-                dwrap = DownloadWrapper(
-                    asset=ast,
-                    download_func=_download_wrapper_fn,
-                    download_kwargs=dict(
-                        ast=ast,
-                        asset_to_download_url=self._get_asset_to_download_url_fn(),
+            if not ast.cube_store or not ast.downloaded:
+                continue
+            if not ast.datetime:
+                logger.debug(f"Not adding {ast.id} to {ast.cube_store}, no datetime")
+                continue
+            path = ast.converted_outfile or ast.outfile
+            sources.setdefault(ast.cube_store, []).append((ast.datetime, path))
+
+        success = True
+        for store, store_sources in sources.items():
+            logger.info(f"Adding up to {len(store_sources):,} assets to {store}")
+            try:
+                num_appended = append_to_cube(store, store_sources)
+            except Exception as ex:
+                logger.error(
+                    f"===\nFailed to build the datacube {store}:\n>>>\n {ex}\n"
+                )
+                success = False
+                continue
+            logger.info(f"Appended {num_appended:,} assets to {store}")
+        return success
+
+    def _wait_for_conversions(
+        self, conversions: Dict["Future[str]", ExtractAsset]
+    ) -> bool:
+        """Record the converted outputs and return true if no conversion failed."""
+        failed: List[str] = []
+        logger.info(f"Converting {len(conversions):,} assets")
+        for future in tqdm(
+            as_completed(conversions), total=len(conversions), desc="Conversions"
+        ):
+            ast = conversions[future]
+            ex = self._record_conversion(future, ast)
+            if ex is not None:
+                failed.append(f"{ast} <{ex}>")
+        if len(failed) > 0:
+            fail_file = os.path.join(
+                self.cfg.system.log_outdir, f"{self.cfg.run_id}_failed_conversions.log"
+            )
+            with open(fail_file, "w") as f:
+                f.writelines(line + "\n" for line in failed)
+            logger.warning(
+                f"Failed to convert {len(failed)} assets: logged failures to {fail_file}"
+            )
+        return len(failed) == 0
+
+    def _record_conversion(
+        self, future: "Future[str]", ast: ExtractAsset
+    ) -> Optional[Exception]:
+        """Record the converted output of a finished conversion, or its error."""
+        try:
+            ast.converted_outfile = future.result()
+        except Exception as ex:
+            logger.error(f"===\nFailed to convert {ast.outfile}:\n>>>\n {ex}\n")
+            return ex
+        return None
+
+    def _is_cacheable(self, ast: ExtractAsset) -> bool:
+        """Return True if the asset can be shared through the asset cache."""
+        # subsets depend on the area of interest, so are not the content of the href
+        return ast.clip_bounds is None and not is_remote(ast.outfile)
+
+    def _copy_to_duplicates(self) -> None:
+        """Copy assets downloaded before this run to the outfiles of their duplicates.
+
+        Assets downloaded in this run are copied by their download jobs.
+        """
+        duplicates = [
+            (ast.outfile, outfile)
+            for ast in self.all_assets
+            if ast.downloaded
+            for outfile in ast.duplicate_outfiles
+        ]
+        if len(duplicates) == 0:
+            return
+        storage_options = self._storage_options()
+        existing = existing_output_sizes(
+            (outfile for _, outfile in duplicates), storage_options
+        )
+        for src, dst in duplicates:
+            if dst in existing:
+                continue
+            try:
+                copy_output(src, dst, storage_options)
+            except OSError as ex:
+                logger.warning(f"Failed to copy {src} to {dst}: {ex}")
+
+    def _link_cached_assets(self) -> int:
+        """Create the outfiles of cached assets and return how many were created."""
+        if self._asset_cache is None:
+            return 0
+        cache: AssetCache = self._asset_cache
+        to_link = [
+            ast
+            for ast in self.all_assets
+            if not ast.downloaded
+            and self._is_cacheable(ast)
+            and ast.outfile not in self._changed_outfiles
+        ]
+
+        def link(ast: ExtractAsset) -> bool:
+            try:
+                return cache.get(
+                    ast.asset.href,
+                    ast.outfile,
+                    ast.filesize_mb,
+                    # an asset that can't be checked is downloaded instead
+                    lambda validators: not self._asset_changed(
+                        ast, validators, default=True
                     ),
                 )
-                job_q.put(dwrap)
+            except OSError as ex:
+                logger.debug(f"Failed to link {ast.outfile} from the cache: {ex}")
+                return False
+
+        # cached objects are validated with one conditional request each
+        linked = thread_map(
+            link,
+            to_link,
+            max_workers=max(1, self.cfg.system.max_concurrent_extractions),
+            disable=len(to_link) == 0,
+            desc="Cache",
+        )
+        num_cached = 0
+        for ast, cached in zip(to_link, linked):
+            if cached:
+                ast.downloaded = True
+                num_cached += 1
+        return num_cached
+
+    def _download_assets(
+        self, on_complete: Optional[Callable[[ExtractAsset], None]] = None
+    ) -> bool:
+        """Download the assets and return true if no errors.
+
+        Args:
+            on_complete (Callable[[ExtractAsset], None]): called with each asset as
+                soon as it has downloaded
+        """
+        if self.all_assets.num_assets_to_download() == 0:
+            return True
+
+        logger.info("Starting data download")
+        job_q, finished_q, fail_q = self._get_download_queues()
+
+        # workers return copies of the assets, so look up the planned ones by outfile
+        pending: Dict[str, ExtractAsset] = {}
+        for ast in self.all_assets:
+            if not ast.downloaded:
+                pending[ast.outfile] = ast
+                job_q.put(self._get_download_wrapper(ast))
+
+        def complete(dwrap: DownloadWrapper) -> ExtractAsset:
+            completed_ast = self._complete_download(dwrap, pending)
+            if on_complete is not None:
+                on_complete(completed_ast)
+            return completed_ast
 
         # show progress bar
         use_num_assets = True
@@ -339,9 +1226,7 @@ class STACProvider(BaseProvider):
             while True:
                 done_querying = False
                 try:
-                    completed_ast = finished_q.get(timeout=5).asset
-                    completed_ast.downloaded = True
-                    self.completed_assets.add_asset(completed_ast)
+                    completed_ast = complete(finished_q.get(timeout=5))
                     pbar.update(1 if use_num_assets else completed_ast.filesize_mb)
                     done_querying = True
                 except Empty:
@@ -351,39 +1236,110 @@ class STACProvider(BaseProvider):
 
                 # TODO figure out how to do this without relying on internals
                 if job_q._unfinished_tasks._semlock._is_zero():  # type: ignore
-                    if use_num_assets:
-                        pbar.update(self.all_assets.num_assets_to_download() - pbar.n)
-                    elif done_querying:
-                        pbar.update(self.all_assets.total_undownloaded_size() - pbar.n)
+                    if use_num_assets or done_querying:
+                        pbar.update(tqdm_target - pbar.n)
                     break
                 sleep(1)
 
         job_q.join()
+        # the loop stops once all jobs are done, collect the remaining downloads
+        while True:
+            try:
+                complete(finished_q.get(timeout=1))
+            except Empty:
+                break
+
+        failures = []
+        while not fail_q.empty():
+            failures.append(fail_q.get())
+        self._record_failures(failures)
+        return len(self.error_assets) == 0
 
-        # Log the failed extractions to a file
+    def _get_download_queues(
+        self,
+    ) -> Tuple[
+        "JoinableQueue[DownloadWrapper]",
+        "Queue[DownloadWrapper]",
+        "Queue[Tuple[DownloadWrapper, Exception]]",
+    ]:
+        """Return the queues of the download workers, starting them if needed."""
+        # the workers are kept for later downloads, e.g. the polls of watch
+        if self._download_queues is None:
+            self._download_queues = create_download_workers_and_queues(
+                self.cfg.system.max_concurrent_extractions,
+                self.cfg.system.max_download_attempts,
+            )
+        return self._download_queues
+
+    def _complete_download(
+        self, dwrap: DownloadWrapper, pending: Dict[str, ExtractAsset]
+    ) -> ExtractAsset:
+        """Record a finished download and return its planned asset.
+
+        Args:
+            dwrap (DownloadWrapper): the finished job, with a copy of the asset
+            pending (Dict[str, ExtractAsset]): the planned assets by outfile
+        """
+        completed_ast: ExtractAsset = pending.get(dwrap.asset.outfile, dwrap.asset)
+        completed_ast.downloaded = True
+        completed_ast.validators = dwrap.asset.validators
+        if len(completed_ast.validators) > 0:
+            self._get_validator_store().put(
+                completed_ast.outfile, completed_ast.validators
+            )
+        self.completed_assets.add_asset(completed_ast)
+        # cache before any conversion, which may remove the raw file
+        if self._asset_cache is not None and self._is_cacheable(completed_ast):
+            try:
+                self._asset_cache.put(
+                    completed_ast.asset.href,
+                    completed_ast.outfile,
+                    completed_ast.validators,
+                )
+            except OSError as ex:
+                logger.debug(f"Failed to cache {completed_ast.outfile}: {ex}")
+        return completed_ast
+
+    def _record_failures(
+        self, failures: List[Tuple[DownloadWrapper, Exception]]
+    ) -> None:
+        """Set the assets that failed to download and log them to a file."""
         error_assets = ExtractAssetCollection()
-        if not fail_q.empty():
+        if len(failures) > 0:
             fail_file = os.path.join(
                 self.cfg.system.log_outdir, f"{self.cfg.run_id}_failed.log"
             )
             with open(fail_file, "w") as f:
-                while not fail_q.empty():
-                    dwrap, ex = fail_q.get()
+                for dwrap, ex in failures:
                     error_assets.add_asset(dwrap.asset)
                     f.write(f"{dwrap.asset} <{ex}>\n")
             logger.warning(
                 f"Failed to download {len(error_assets)} assets: logged failures to {fail_file}"
             )
-        fail_q.close()
-        return len(self.error_assets) == 0
+        self.error_assets = error_assets
 
 
 def _download_wrapper_fn(
-    asset_to_download_url: Callable[[pystac.Asset], str], ast: ExtractAsset
+    asset_to_download_url: Callable[[pystac.Asset], str],
+    ast: ExtractAsset,
+    storage_options: Optional[Dict[str, Any]] = None,
 ) -> None:
     """Asset download wrapper function for multiproc download."""
     url = asset_to_download_url(ast.asset)
-    stream_download(url, ast.outfile)
+    if ast.clip_bounds is not None and try_clip_cog(
+        url, ast.outfile, ast.clip_bounds, storage_options=storage_options
+    ):
+        return
+    ast.validators = stream_download(url, ast.outfile, storage_options=storage_options)
+
+
+def _watch_time(ast: ExtractAsset, watch_property: str) -> str:
+    """Return the ISO 8601 time of an asset's item that watch keeps a mark of."""
+    if watch_property == "datetime":
+        return ast.datetime
+    owner = ast.asset.owner if ast.asset is not None else None
+    value = owner.properties.get(watch_property) if owner is not None else None
+    return str(value) if value else ""
 
 
 def _asset_to_download_url(asset: pystac.Asset) -> str:
@@ -0,0 +1,74 @@
+"""Lazy, read-through access to planned assets without downloading them."""
+import io
+import os
+from typing import Dict, Iterator, List, Tuple, Union
+
+from .assets import ExtractAsset
+from .provider.stac import STACProvider
+from .util.blocks import BlockCache, RangeReader
+from .util.sink import is_remote
+
+__all__ = ["LazyAssets"]
+
+
+class LazyAssets:
+    """The planned assets of providers, opened as files that are read on demand.
+
+    Opening an asset fetches nothing: the byte ranges that are read are fetched
+    with (signed) download urls of the asset's provider and kept in a block cache,
+    so repeated reads hit memory or local disk and unread parts never transfer.
+    Assets that are already downloaded are read from their outfile.
+    """
+
+    def __init__(self, providers: List[STACProvider], cache: BlockCache) -> None:
+        """Collect the planned assets of the providers.
+
+        Args:
+            providers (List[STACProvider]): providers, planned with plan_assets (or
+                planned here if they weren't), without deduplicate_assets, which
+                would drop the duplicate assets
+            cache (BlockCache): cache of the blocks that are read
+        """
+        self.cache = cache
+        self._assets: Dict[str, Tuple[ExtractAsset, STACProvider]] = {}
+        for pvdr in providers:
+            planned = pvdr.planned_assets
+            if planned is None:
+                planned = pvdr.plan_assets()
+            for ast in planned:
+                self._assets.setdefault(ast.id, (ast, pvdr))
+
+    def __len__(self) -> int:
+        """Return the number of assets."""
+        return len(self._assets)
+
+    def __iter__(self) -> Iterator[ExtractAsset]:
+        """Iterate over the assets."""
+        for ast, _ in self._assets.values():
+            yield ast
+
+    def __getitem__(self, id: str) -> ExtractAsset:
+        """Return the asset with an id, e.g. "{item id}_{asset name}"."""
+        return self._assets[id][0]
+
+    def open(self, asset: Union[str, ExtractAsset]) -> io.BufferedReader:
+        """Open an asset (or asset id) as a seekable binary file.
+
+        The file can be passed to readers that accept file objects, e.g.
+        xarray.open_dataset(f, engine="h5netcdf") for NetCDF/HDF5 files.
+        """
+        ast, pvdr = self._assets[asset if isinstance(asset, str) else asset.id]
+        if (
+            ast.clip_bounds is None
+            and not is_remote(ast.outfile)
+            and os.path.exists(ast.outfile)
+        ):
+            return open(ast.outfile, "rb")
+        url_fn = pvdr._get_asset_to_download_url_fn()
+        reader = RangeReader(
+            ast.asset.href,
+            lambda: url_fn(ast.asset),
+            self.cache,
+            session=pvdr._get_requests_session(),
+        )
+        return io.BufferedReader(reader, buffer_size=64 * 1024)
@@ -0,0 +1,194 @@
+"""Area of interest (AOI) utilities.
+
+AOI files are parsed once per run and cached by file contents. The returned
+PreparedAOI provides fast spatial predicates for providers that filter by AOI on the
+client, and a simplified geometry to send to search APIs.
+"""
+import hashlib
+import warnings
+from typing import Dict, List, Tuple
+
+import geopandas as gpd
+import numpy as np
+from shapely.errors import ShapelyDeprecationWarning
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import PreparedGeometry, prep
+from shapely.strtree import STRtree
+
+__all__ = ["PreparedAOI", "load_aoi"]
+
+
+class PreparedAOI:
+    """An area of interest prepared for repeated spatial predicates.
+
+    Points are filtered in three steps: a vectorized bounding box prefilter, an
+    STRtree lookup of the polygons whose extent contains the point (for multi-polygon
+    AOIs), and a prepared-geometry containment check against those polygons.
+
+    For search APIs, search_geometry returns a simplified superset of the AOI that
+    keeps request bodies small; results can then be checked against the exact AOI
+    with intersects.
+    """
+
+    geometry: BaseGeometry
+    bounds: List[float]
+
+    def __init__(self, geometry: BaseGeometry, simplify_tolerance: float = 0.0) -> None:
+        """Prepare the AOI geometry.
+
+        Args:
+            geometry (BaseGeometry): the AOI geometry in EPSG:4326
+            simplify_tolerance (float): simplify the polygons used for containment
+                checks by this tolerance (in degrees), 0 to use the exact geometry
+        """
+        self.geometry = geometry
+        self.bounds = list(geometry.bounds)
+        self._prepared_exact = prep(geometry)
+        self._search_geometries: Dict[Tuple[float, int], BaseGeometry] = {}
+
+        check_geometry = geometry
+        if simplify_tolerance > 0:
+            check_geometry = geometry.simplify(
+                simplify_tolerance, preserve_topology=True
+            )
+        if hasattr(check_geometry, "geoms"):
+            self._parts = [part for part in check_geometry.geoms if not part.is_empty]
+        else:
+            self._parts = [check_geometry]
+        self._prepared: List[PreparedGeometry] = [prep(part) for part in self._parts]
+        self._part_index = {id(part): i for i, part in enumerate(self._parts)}
+        self._tree = None
+        if len(self._parts) > 1:
+            # both shapely<2 and shapely>=2 query results are handled in _candidates
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", ShapelyDeprecationWarning)
+                self._tree = STRtree(self._parts)
+
+    @classmethod
+    def from_geodataframe(
+        cls, gdf: gpd.GeoDataFrame, simplify_tolerance: float = 0.0
+    ) -> "PreparedAOI":
+        """Build a PreparedAOI from the union of all geometries of a GeoDataFrame."""
+        if gdf.crs is not None:
+            gdf = gdf.to_crs(4326)
+        return cls(gdf.unary_union, simplify_tolerance)
+
+    def to_geodataframe(self) -> gpd.GeoDataFrame:
+        """Return the AOI as a single-row GeoDataFrame in EPSG:4326."""
+        return gpd.GeoDataFrame(geometry=[self.geometry], crs=4326)
+
+    def contains(self, geom: BaseGeometry) -> bool:
+        """Return True if the geometry is within the AOI."""
+        minx, miny, maxx, maxy = geom.bounds
+        if (
+            minx < self.bounds[0]
+            or miny < self.bounds[1]
+            or maxx > self.bounds[2]
+            or maxy > self.bounds[3]
+        ):
+            return False
+        return any(self._prepared[i].contains(geom) for i in self._candidates(geom))
+
+    def intersects(self, geom: BaseGeometry) -> bool:
+        """Return True if the geometry intersects the exact AOI."""
+        minx, miny, maxx, maxy = geom.bounds
+        if (
+            maxx < self.bounds[0]
+            or maxy < self.bounds[1]
+            or minx > self.bounds[2]
+            or miny > self.bounds[3]
+        ):
+            return False
+        return bool(self._prepared_exact.intersects(geom))
+
+    def search_geometry(
+        self, tolerance: float, max_vertices: int = 1000
+    ) -> BaseGeometry:
+        """Return a simplified geometry that fully covers the AOI.
+
+        The AOI is simplified by tolerance and then buffered by the same tolerance, so
+        no part of the AOI is lost. If the result still has more than max_vertices
+        vertices, its convex hull is used instead.
+
+        Args:
+            tolerance (float): simplification tolerance in degrees, 0 for the exact AOI
+            max_vertices (int): maximum number of vertices before falling back to the
+                convex hull
+        Returns:
+            BaseGeometry: a geometry that contains the AOI
+        """
+        if tolerance <= 0:
+            return self.geometry
+        key = (tolerance, max_vertices)
+        if key not in self._search_geometries:
+            # mitred joins keep the buffer a superset of the simplified geometry
+            search_geom = self.geometry.simplify(tolerance).buffer(
+                tolerance, join_style=2
+            )
+            if _num_vertices(search_geom) > max_vertices:
+                search_geom = search_geom.convex_hull
+            self._search_geometries[key] = search_geom
+        return self._search_geometries[key]
+
+    def contains_points(self, points: gpd.GeoSeries) -> np.ndarray:
+        """Return a boolean mask of the points that are within the AOI.
+
+        Equivalent to ``points.within(aoi)``, but avoids testing every point against
+        the full-resolution geometry.
+        """
+        mask = np.zeros(len(points), dtype=bool)
+        if len(points) == 0:
+            return mask
+        xs = points.x.to_numpy()
+        ys = points.y.to_numpy()
+        minx, miny, maxx, maxy = self.bounds
+        in_bounds = (xs >= minx) & (xs <= maxx) & (ys >= miny) & (ys <= maxy)
+        for i in np.flatnonzero(in_bounds):
+            pt = points.iloc[i]
+            mask[i] = any(self._prepared[j].contains(pt) for j in self._candidates(pt))
+        return mask
+
+    def _candidates(self, geom: BaseGeometry) -> List[int]:
+        """Return the indices of the AOI polygons whose extent intersects geom."""
+        if self._tree is None:
+            return [0]
+        # shapely<2 returns the geometries, shapely>=2 returns their indices
+        return [
+            int(hit)
+            if isinstance(hit, (int, np.integer))
+            else self._part_index[id(hit)]
+            for hit in self._tree.query(geom)
+        ]
+
+
+_aoi_cache: Dict[Tuple[str, float], PreparedAOI] = {}
+
+
+def load_aoi(aoi_file: str, simplify_tolerance: float = 0.0) -> PreparedAOI:
+    """Read, union and prepare an AOI file, caching the result by file contents.
+
+    Args:
+        aoi_file (str): path to the AOI file (any format readable by geopandas)
+        simplify_tolerance (float): see PreparedAOI
+    Returns:
+        PreparedAOI: the prepared AOI in EPSG:4326
+    """
+    with open(aoi_file, "rb") as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+    key = (file_hash, simplify_tolerance)
+    if key not in _aoi_cache:
+        _aoi_cache[key] = PreparedAOI.from_geodataframe(
+            gpd.read_file(aoi_file), simplify_tolerance
+        )
+    return _aoi_cache[key]
+
+
+def _num_vertices(geom: BaseGeometry) -> int:
+    """Return the number of exterior and interior ring vertices of a (multi)polygon."""
+    if hasattr(geom, "geoms"):
+        return sum(_num_vertices(part) for part in geom.geoms)
+    if hasattr(geom, "exterior"):
+        return len(geom.exterior.coords) + sum(
+            len(ring.coords) for ring in geom.interiors
+        )
+    return len(getattr(geom, "coords", []))
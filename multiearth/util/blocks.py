@@ -0,0 +1,436 @@
+"""Read-through access to remote files by byte range, with an LRU block cache.
+
+Remote files are split into fixed-size blocks that are fetched with HTTP range
+requests when they're first read, and kept in a size-capped in-memory LRU cache
+and a size-capped on-disk LRU cache (shared across processes and runs), so
+repeated reads hit memory or local disk and unread parts are never transferred.
+The size and ETag (or Last-Modified) of each file are recorded from its range
+responses, and its cached blocks are dropped when they change.
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from loguru import logger
+
+from .cache import normalize_href
+from .sqlite import add_column, transaction
+
+__all__ = ["BlockCache", "RangeReader", "block_key"]
+
+# size of the cached blocks, the granularity of range requests
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# number of block reads whose access times are kept before writing them to disk
+_ACCESS_BATCH = 256
+
+
+def block_key(href: str, block_size: int) -> str:
+    """Return the cache key of the blocks of an href (without its query string)."""
+    key = f"{normalize_href(href)}#{block_size}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class BlockCache:
+    """Size-capped LRU cache of file blocks, in memory and on disk.
+
+    The on-disk blocks are stored in {cache_dir}/blocks/objects, indexed by a SQLite
+    database that records their size and last access for LRU eviction, along with
+    the size and validator (ETag or Last-Modified) of each file. Reads only take a
+    shared lock, and their access times are written in batches.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size_gb: float,
+        max_memory_mb: float,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> None:
+        """Open (and create if needed) the cache.
+
+        Args:
+            cache_dir (str): multiearth cache directory
+            max_size_gb (float): maximum total size of the blocks on disk in GB, 0
+                to only cache blocks in memory
+            max_memory_mb (float): maximum total size of the blocks in memory in MB
+            block_size (int): size of the blocks in bytes
+        """
+        self.root = os.path.join(os.path.expanduser(cache_dir), "blocks")
+        self.index_path = os.path.join(self.root, "index.db")
+        self.max_size = int(max_size_gb * 1e9)
+        self.max_memory = int(max_memory_mb * 1e6)
+        self.block_size = block_size
+        self._memory: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._files: Dict[str, Tuple[int, str]] = {}
+        # access times of the disk blocks read since they were last written
+        self._accessed: Dict[Tuple[str, int], float] = {}
+        self._lock = threading.Lock()
+        if self.max_size > 0:
+            os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+            with transaction(self.index_path) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS blocks ("
+                    "key TEXT NOT NULL, idx INTEGER NOT NULL, size INTEGER NOT NULL, "
+                    "last_access REAL NOT NULL, PRIMARY KEY (key, idx))"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS blocks_access ON blocks (last_access)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS files ("
+                    "key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                    "validator TEXT NOT NULL DEFAULT '')"
+                )
+                # caches created before the validators were stored
+                add_column(conn, "files", "validator", "TEXT NOT NULL DEFAULT ''")
+
+    def _block_path(self, key: str, idx: int) -> str:
+        """Return the path of a block on disk."""
+        return os.path.join(self.root, "objects", key[:2], f"{key}.{idx}")
+
+    def get_file(self, key: str) -> Tuple[int, str]:
+        """Return the size and validator of a file, (-1, "") if unknown."""
+        if key in self._files:
+            return self._files[key]
+        if self.max_size <= 0:
+            return -1, ""
+        with transaction(self.index_path, write=False) as conn:
+            row = conn.execute(
+                "SELECT size, validator FROM files WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return -1, ""
+        self._files[key] = (int(row[0]), str(row[1]))
+        return self._files[key]
+
+    def get_size(self, key: str) -> int:
+        """Return the size of a file, -1 if unknown."""
+        return self.get_file(key)[0]
+
+    def put_file(self, key: str, size: int, validator: str = "") -> bool:
+        """Record the size and validator of a file, dropping its blocks if it changed.
+
+        Args:
+            key (str): key of the file
+            size (int): size of the file in bytes
+            validator (str): ETag (or Last-Modified) of the file, empty if unknown
+        Returns:
+            bool: True if the file changed, i.e. its size or validator differ from
+                the recorded ones
+        """
+        old_size, old_validator = self.get_file(key)
+        changed = (old_size >= 0 and size != old_size) or bool(
+            validator and old_validator and validator != old_validator
+        )
+        if changed:
+            self._drop_blocks(key)
+        new = (size, validator or ("" if changed else old_validator))
+        if new == (old_size, old_validator):
+            return False
+        self._files[key] = new
+        if self.max_size > 0:
+            with transaction(self.index_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO files (key, size, validator) "
+                    "VALUES (?, ?, ?)",
+                    (key, *new),
+                )
+        return changed
+
+    def _drop_blocks(self, key: str) -> None:
+        """Remove the cached blocks of a file, e.g. when it changed."""
+        with self._lock:
+            for mem_key in [k for k in self._memory if k[0] == key]:
+                self._memory_size -= len(self._memory.pop(mem_key))
+            for acc_key in [k for k in self._accessed if k[0] == key]:
+                del self._accessed[acc_key]
+        if self.max_size <= 0:
+            return
+        with transaction(self.index_path) as conn:
+            rows = conn.execute("SELECT idx FROM blocks WHERE key = ?", (key,))
+            for (idx,) in rows.fetchall():
+                path = self._block_path(key, idx)
+                if os.path.exists(path):
+                    os.remove(path)
+            conn.execute("DELETE FROM blocks WHERE key = ?", (key,))
+
+    def get(self, key: str, idx: int) -> Optional[bytes]:
+        """Return a cached block, None if it's not cached."""
+        with self._lock:
+            data = self._memory.get((key, idx))
+            if data is not None:
+                self._memory.move_to_end((key, idx))
+                return data
+        if self.max_size <= 0:
+            return None
+        with transaction(self.index_path, write=False) as conn:
+            row = conn.execute(
+                "SELECT size FROM blocks WHERE key = ? AND idx = ?", (key, idx)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._block_path(key, idx), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        if len(data) != int(row[0]):
+            # evicted (or being replaced) since the query
+            return None
+        with self._lock:
+            self._accessed[(key, idx)] = time.time()
+            flush = len(self._accessed) >= _ACCESS_BATCH
+        if flush:
+            with transaction(self.index_path) as conn:
+                self._write_accesses(conn)
+        self._put_memory(key, idx, data)
+        return data
+
+    def _write_accesses(self, conn: sqlite3.Connection) -> None:
+        """Write the access times of the blocks read since the last write."""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        conn.executemany(
+            "UPDATE blocks SET last_access = MAX(last_access, ?) "
+            "WHERE key = ? AND idx = ?",
+            ((t, key, idx) for (key, idx), t in accessed.items()),
+        )
+
+    def put(self, key: str, idx: int, data: bytes) -> None:
+        """Cache a block, evicting the least recently used blocks over the caps."""
+        self._put_memory(key, idx, data)
+        if self.max_size <= 0 or len(data) > self.max_size:
+            return
+        path = self._block_path(key, idx)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+        with transaction(self.index_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO blocks (key, idx, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, idx, len(data), time.time()),
+            )
+            self._write_accesses(conn)
+            self._evict(conn)
+
+    def _put_memory(self, key: str, idx: int, data: bytes) -> None:
+        """Keep a block in memory, evicting the least recently used blocks."""
+        if len(data) > self.max_memory:
+            return
+        with self._lock:
+            old = self._memory.pop((key, idx), None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[(key, idx)] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.max_memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Remove the least recently used blocks until the disk cache is under its cap."""
+        total = int(
+            conn.execute("SELECT COALESCE(SUM(size), 0) FROM blocks").fetchone()[0]
+        )
+        if total <= self.max_size:
+            return
+        rows = conn.execute(
+            "SELECT key, idx, size FROM blocks ORDER BY last_access"
+        ).fetchall()
+        for key, idx, size in rows:
+            if total <= self.max_size:
+                break
+            conn.execute("DELETE FROM blocks WHERE key = ? AND idx = ?", (key, idx))
+            path = self._block_path(key, idx)
+            if os.path.exists(path):
+                os.remove(path)
+            total -= int(size)
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable, read-only file over a remote file, read by cached blocks.
+
+    Blocks that aren't cached are fetched with HTTP range requests, one request per
+    run of consecutive missing blocks. The url is requested again from get_url if
+    the server denies access, e.g. when a signed url expires. If a response shows
+    that the file changed, its cached blocks are dropped and the read is repeated,
+    so a read never mixes blocks of two versions of the file.
+    """
+
+    def __init__(
+        self,
+        href: str,
+        get_url: Callable[[], str],
+        cache: BlockCache,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        """Open a remote file, without fetching anything yet.
+
+        Args:
+            href (str): href of the file, which identifies its cached blocks
+            get_url (Callable[[], str]): returns a (signed) url to download the file
+            cache (BlockCache): cache of the blocks
+            session (requests.Session): session for the requests, e.g. with auth
+        """
+        super().__init__()
+        self.href = href
+        self._get_url = get_url
+        self._url: Optional[str] = None
+        self._cache = cache
+        self._session = session if session is not None else requests.Session()
+        self._key = block_key(href, cache.block_size)
+        self._pos = 0
+        # set when a response shows that the file changed
+        self._changed = False
+
+    def readable(self) -> bool:
+        """Return True, the file is readable."""
+        return True
+
+    def seekable(self) -> bool:
+        """Return True, the file is seekable."""
+        return True
+
+    def tell(self) -> int:
+        """Return the current position."""
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move to a position, relative to the start, current position or end."""
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return self._pos
+
+    @property
+    def size(self) -> int:
+        """Return the size of the file, fetching its first block if unknown."""
+        size = self._cache.get_size(self._key)
+        if size < 0:
+            self._fetch(0, 0)
+            size = self._cache.get_size(self._key)
+        return size
+
+    def readinto(self, buffer: Any) -> int:
+        """Read up to len(buffer) bytes at the current position into buffer."""
+        view = memoryview(buffer).cast("B")
+        data = self.read_range(self._pos, len(view))
+        view[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Return up to length bytes at offset, without moving the position."""
+        data = b""
+        # once more if the file changed while reading, with its new blocks
+        for _ in range(2):
+            self._changed = False
+            data = self._read_blocks(offset, length)
+            if not self._changed:
+                break
+        return data
+
+    def _read_blocks(self, offset: int, length: int) -> bytes:
+        """Return up to length bytes at offset from cached or fetched blocks."""
+        end = min(offset + length, self.size)
+        if end <= offset:
+            return b""
+        block_size = self._cache.block_size
+        first, last = offset // block_size, (end - 1) // block_size
+        blocks: Dict[int, bytes] = {}
+        missing: List[int] = []
+        for idx in range(first, last + 1):
+            data = self._cache.get(self._key, idx)
+            if data is None:
+                missing.append(idx)
+            else:
+                blocks[idx] = data
+        # one request per run of consecutive missing blocks
+        runs: List[List[int]] = []
+        for idx in missing:
+            if len(runs) > 0 and runs[-1][-1] == idx - 1:
+                runs[-1].append(idx)
+            else:
+                runs.append([idx])
+        for run in runs:
+            blocks.update(self._fetch(run[0], run[-1]))
+
+        # the file may be shorter than its recorded size (e.g. a 416 response), so
+        # the read is short from the first missing block
+        parts: List[bytes] = []
+        for idx in range(first, last + 1):
+            if idx not in blocks:
+                break
+            parts.append(blocks[idx])
+        data = b"".join(parts)
+        start = offset - first * block_size
+        return data[start : start + end - offset]
+
+    def _fetch(self, first: int, last: int) -> Dict[int, bytes]:
+        """Fetch and cache the blocks from first to last (inclusive)."""
+        block_size = self._cache.block_size
+        start, end = first * block_size, (last + 1) * block_size - 1
+        response = self._request(start, end)
+        with response:
+            content_range = response.headers.get("Content-Range", "")
+            total = content_range.rsplit("/", 1)[-1]
+            validator = str(
+                response.headers.get("ETag")
+                or response.headers.get("Last-Modified")
+                or ""
+            )
+            if total.isdigit() and self._cache.put_file(
+                self._key, int(total), validator
+            ):
+                logger.debug(f"{self.href} changed, dropped its cached blocks")
+                self._changed = True
+            if response.status_code == 416:
+                # the range starts past the end of the file
+                return {}
+            if response.status_code != 206:
+                raise IOError(
+                    f"{self.href} does not support range requests "
+                    + f"(HTTP {response.status_code}), download it instead"
+                )
+            content = response.content
+        blocks: Dict[int, bytes] = {}
+        for i, idx in enumerate(range(first, last + 1)):
+            data = content[i * block_size : (i + 1) * block_size]
+            if len(data) == 0:
+                break
+            self._cache.put(self._key, idx, data)
+            blocks[idx] = data
+        return blocks
+
+    def _request(self, start: int, end: int) -> requests.Response:
+        """Request a byte range, signing the url again if access is denied."""
+        headers = {"Range": f"bytes={start}-{end}"}
+        if self._url is None:
+            self._url = self._get_url()
+        response = self._session.get(self._url, headers=headers, timeout=60)
+        if response.status_code in (401, 403):
+            logger.debug(f"Access to {self.href} denied, signing its url again")
+            response.close()
+            self._url = self._get_url()
+            response = self._session.get(self._url, headers=headers, timeout=60)
+        if response.status_code != 416:
+            response.raise_for_status()
+        return response
@@ -0,0 +1,241 @@
+"""Content-addressed cache of downloaded assets, shared across runs and outdirs.
+
+Cached objects are keyed by their normalized href, i.e. without the query parameters
+of signatures (e.g. Planetary Computer SAS tokens), and are validated with the ETag or
+Last-Modified of their download (or by size if the server sent neither).
+Outfiles are created as hardlinks (or reflinks, or copies across filesystems) of the
+cached objects, so an asset already downloaded for another config costs no network.
+The cache is capped in size and evicts the least recently used objects first.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from loguru import logger
+
+from .sqlite import add_column, transaction
+from .validators import conditional_headers
+
+__all__ = ["AssetCache", "link_or_copy", "normalize_href", "open_asset_cache"]
+
+# ioctl that clones (reflinks) a file on copy-on-write filesystems, e.g. btrfs, xfs
+_FICLONE = 0x40049409
+
+
+# query parameters of Azure SAS signatures (e.g. of Planetary Computer assets), which
+# change every time the same href is signed
+SIGNATURE_PARAMS = {
+    "st",
+    "se",
+    "sp",
+    "sv",
+    "sr",
+    "sig",
+    "skoid",
+    "sktid",
+    "skt",
+    "ske",
+    "sks",
+    "skv",
+}
+
+
+def normalize_href(href: str) -> str:
+    """Return the href without its signature query parameters and fragment."""
+    parsed = urlsplit(href)
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if k not in SIGNATURE_PARAMS
+    ]
+    return urlunsplit(parsed._replace(query=urlencode(query), fragment=""))
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Create dst as a hardlink of src, else a reflink, else a copy.
+
+    dst is replaced in one step, so it's never left partial.
+    """
+    dirname = os.path.dirname(dst)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_file = f"{dst}.{os.getpid()}.part"
+    try:
+        os.link(src, tmp_file)
+    except OSError:
+        with open(src, "rb") as fsrc, open(tmp_file, "wb") as fdst:
+            try:
+                import fcntl
+
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            except (ImportError, OSError):
+                # fcntl is not available on Windows
+                shutil.copyfileobj(fsrc, fdst, length=16 * 1024 * 1024)
+    os.replace(tmp_file, dst)
+
+
+class AssetCache:
+    """Size-capped, content-addressed cache of downloaded assets.
+
+    The objects are stored in {cache_dir}/assets/objects, indexed by a SQLite
+    database that records their size and validators, and their last access for LRU
+    eviction.
+    """
+
+    def __init__(self, cache_dir: str, max_size_gb: float) -> None:
+        """Open (and create if needed) the cache.
+
+        Args:
+            cache_dir (str): multiearth cache directory
+            max_size_gb (float): maximum total size of the cached objects in GB
+        """
+        self.root = os.path.join(os.path.expanduser(cache_dir), "assets")
+        self.max_size = int(max_size_gb * 1e9)
+        self.index_path = os.path.join(self.root, "index.db")
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        with transaction(self.index_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "key TEXT PRIMARY KEY, href TEXT NOT NULL, size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL, validators TEXT NOT NULL DEFAULT '{}')"
+            )
+            # caches created before the validators were stored
+            add_column(conn, "objects", "validators", "TEXT NOT NULL DEFAULT '{}'")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS objects_access ON objects (last_access)"
+            )
+
+    def _object_path(self, key: str) -> str:
+        """Return the path of a cached object."""
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    @staticmethod
+    def _key(href: str) -> str:
+        """Return the cache key of an href."""
+        return hashlib.sha256(normalize_href(href).encode("utf-8")).hexdigest()
+
+    def get(
+        self,
+        href: str,
+        outfile: str,
+        filesize_mb: int = -1,
+        is_current: Optional[Callable[[Dict[str, str]], bool]] = None,
+    ) -> bool:
+        """Create outfile from the cached object of an href, if it's still current.
+
+        Objects cached with an ETag or Last-Modified are validated with is_current,
+        and the others by size, so they're not used if the size is unknown.
+
+        Args:
+            href (str): href of the asset
+            outfile (str): local path to create
+            filesize_mb (int): expected size of the asset in MB, -1 if unknown
+            is_current (Callable[[Dict[str, str]], bool]): returns True if the remote
+                asset still has the validators of the cached object, e.g. with a
+                conditional request
+        Returns:
+            bool: True if outfile was created from the cache
+        """
+        key = self._key(href)
+        path = self._object_path(key)
+        with transaction(self.index_path) as conn:
+            row = conn.execute(
+                "SELECT size, validators FROM objects WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False
+            size = int(row[0])
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+                return False
+        validators: Dict[str, str] = json.loads(row[1])
+        if len(conditional_headers(validators)) > 0 and is_current is not None:
+            # checked outside of the transaction, which would block the other workers
+            if not is_current(validators):
+                logger.debug(f"Cached {href} changed remotely, evicting it")
+                self.remove(href)
+                return False
+        elif filesize_mb <= 0:
+            logger.debug(f"Not using cached {href}, it has no validators or size")
+            return False
+        elif abs(size // 1e6 - filesize_mb) > 5:
+            # same tolerance as for existing outfiles
+            logger.debug(f"Cached {href} is {size:,} bytes, not {filesize_mb}MB")
+            return False
+        with transaction(self.index_path) as conn:
+            conn.execute(
+                "UPDATE objects SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        link_or_copy(path, outfile)
+        return True
+
+    def put(
+        self, href: str, outfile: str, validators: Optional[Dict[str, str]] = None
+    ) -> None:
+        """Add a downloaded outfile to the cache and evict objects over the cap.
+
+        Args:
+            href (str): href of the asset
+            outfile (str): local path of the downloaded asset
+            validators (Dict[str, str]): response headers of the download, whose
+                ETag and Last-Modified validate the cached object
+        """
+        key = self._key(href)
+        path = self._object_path(key)
+        size = os.path.getsize(outfile)
+        if size > self.max_size:
+            return
+        stored = {
+            name: value
+            for name, value in (validators or {}).items()
+            if name in ("ETag", "Last-Modified") and value
+        }
+        link_or_copy(outfile, path)
+        with transaction(self.index_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO objects "
+                "(key, href, size, last_access, validators) VALUES (?, ?, ?, ?, ?)",
+                (key, normalize_href(href), size, time.time(), json.dumps(stored)),
+            )
+            self._evict(conn)
+
+    def remove(self, href: str) -> None:
+        """Evict the cached object of an href, if there is one."""
+        key = self._key(href)
+        with transaction(self.index_path) as conn:
+            conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+            path = self._object_path(key)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Remove the least recently used objects until the cache is under its cap."""
+        total = int(
+            conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        )
+        if total <= self.max_size:
+            return
+        rows = conn.execute(
+            "SELECT key, size FROM objects ORDER BY last_access"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+            path = self._object_path(key)
+            if os.path.exists(path):
+                os.remove(path)
+            total -= int(size)
+            logger.debug(f"Evicted {key} ({size:,} bytes) from the asset cache")
+
+
+def open_asset_cache(cache_dir: str, max_size_gb: float) -> Optional[AssetCache]:
+    """Open the asset cache, None if it's disabled (max_size_gb <= 0)."""
+    if max_size_gb <= 0:
+        return None
+    return AssetCache(cache_dir, max_size_gb)
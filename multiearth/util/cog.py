@@ -0,0 +1,157 @@
+"""Partial reads of Cloud-Optimized GeoTIFF (COG) assets.
+
+GDAL reads COGs over HTTP with range requests for the header and the internal tiles
+that intersect the requested window only, so clipping a COG to an area of interest
+transfers bytes in proportion to the area instead of the file size.
+
+rasterio is an optional dependency, install it with `pip install multiearth[cog]`.
+"""
+import os
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import pystac
+from loguru import logger
+
+from .sink import is_remote, open_output
+
+__all__ = ["NotSubsettableError", "clip_cog", "is_cog_asset", "try_clip_cog"]
+
+# GDAL options for efficient range reads of COGs over HTTP
+_GDAL_HTTP_OPTIONS = dict(
+    GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+    GDAL_HTTP_MERGE_CONSECUTIVE_RANGES="YES",
+    GDAL_HTTP_MULTIRANGE="YES",
+    GDAL_HTTP_MAX_RETRY=3,
+    VSI_CACHE=True,
+)
+
+
+class NotSubsettableError(Exception):
+    """The asset can't be subset, so it should be downloaded in full."""
+
+
+def is_cog_asset(asset: pystac.Asset) -> bool:
+    """Return True if the asset is a (Cloud-Optimized) GeoTIFF."""
+    media_type = str(asset.media_type or "").lower()
+    if "profile=cloud-optimized" in media_type:
+        return True
+    path = urlparse(asset.href).path.lower()
+    return media_type.startswith("image/tiff") and path.endswith((".tif", ".tiff"))
+
+
+def clip_cog(
+    url: str,
+    outfile: str,
+    bounds: Tuple[float, float, float, float],
+    headers: Optional[Dict[str, str]] = None,
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Write the part of a COG within the bounds to a tiled GeoTIFF.
+
+    Only the internal tiles that intersect the bounds are read. Overviews for the
+    clipped GeoTIFF are computed from the clipped data, without further reads.
+
+    Args:
+        url (str): url of the COG
+        outfile (str): output path or fsspec url
+        bounds (Tuple[float, float, float, float]): (minx, miny, maxx, maxy) in
+            EPSG:4326
+        headers (Dict[str, str]): HTTP headers for the requests, e.g. Authorization
+        storage_options (Dict[str, Any]): options for the fsspec filesystem of outfile
+    Raises:
+        NotSubsettableError: if the COG is not tiled, or the bounds cover all of it
+    """
+    try:
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.errors import RasterioIOError, WindowError
+        from rasterio.io import MemoryFile
+        from rasterio.warp import transform_bounds
+        from rasterio.windows import Window, from_bounds
+    except ImportError:
+        raise ImportError(
+            "rasterio is required to subset COG assets, "
+            + "install it with `pip install multiearth[cog]`"
+        )
+
+    gdal_options: Dict[str, Any] = dict(_GDAL_HTTP_OPTIONS)
+    if headers:
+        gdal_options["GDAL_HTTP_HEADERS"] = "\r\n".join(
+            f"{k}: {v}" for k, v in headers.items()
+        )
+    with rasterio.Env(**gdal_options):
+        try:
+            src = rasterio.open(url)
+        except RasterioIOError as ex:
+            raise NotSubsettableError(f"{url} can't be read as a GeoTIFF: {ex}")
+        with src:
+            if not src.profile.get("tiled", False):
+                raise NotSubsettableError(f"{url} is not tiled")
+            src_bounds = transform_bounds("EPSG:4326", src.crs, *bounds, densify_pts=21)
+            full = Window(0, 0, src.width, src.height)
+            window = (
+                from_bounds(*src_bounds, transform=src.transform)
+                .round_offsets(op="floor")
+                .round_lengths(op="ceil")
+            )
+            try:
+                window = window.intersection(full)
+            except WindowError:
+                raise NotSubsettableError(f"{url} does not intersect {bounds}")
+            if window.width >= src.width and window.height >= src.height:
+                raise NotSubsettableError(f"{bounds} covers all of {url}")
+
+            data = src.read(window=window)
+            profile = src.profile.copy()
+            profile.update(
+                driver="GTiff",
+                width=int(window.width),
+                height=int(window.height),
+                transform=src.window_transform(window),
+                tiled=True,
+                blockxsize=256,
+                blockysize=256,
+                compress=profile.get("compress") or "deflate",
+            )
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data)
+            factors = [
+                f for f in (2, 4, 8, 16) if min(dst.width, dst.height) // f >= 256
+            ]
+            if len(factors) > 0:
+                dst.build_overviews(factors, Resampling.average)
+        clipped = memfile.read()
+
+    if is_remote(outfile):
+        with open_output(outfile, storage_options) as f:
+            f.write(clipped)
+        return
+    # replace the output in one step, so an existing file is never left partial
+    tmp_file = f"{outfile}.{os.getpid()}.part"
+    with open_output(tmp_file) as f:
+        f.write(clipped)
+    os.replace(tmp_file, outfile)
+
+
+def try_clip_cog(
+    url: str,
+    outfile: str,
+    bounds: Tuple[float, float, float, float],
+    headers: Optional[Dict[str, str]] = None,
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Clip a COG with clip_cog, returning False if it must be downloaded in full.
+
+    Args: see clip_cog
+    Returns:
+        bool: True if the clipped GeoTIFF was written
+    """
+    try:
+        clip_cog(url, outfile, bounds, headers, storage_options)
+    except (ImportError, NotSubsettableError) as ex:
+        logger.debug(f"Downloading all of {url} instead of a subset: {ex}")
+        return False
+    return True
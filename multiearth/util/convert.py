@@ -0,0 +1,110 @@
+"""Post-download conversion of raw assets to analysis-ready formats.
+
+"cog" rewrites GeoTIFFs (and other single raster files readable by GDAL) as
+Cloud-Optimized GeoTIFFs with rasterio, install it with `pip install multiearth[cog]`.
+"zarr" rewrites NetCDF/HDF5 files and GeoTIFFs as Zarr stores with xarray, install it
+with `pip install multiearth[convert]`.
+
+Converted outputs are written next to the raw file, with the format's suffix in place
+of the raw file's extension, e.g. `B04.tif` to `B04.cog.tif`.
+"""
+import os
+import shutil
+from typing import Callable, Dict
+
+__all__ = ["CONVERT_FORMATS", "convert_asset", "converted_outfile"]
+
+
+def _to_cog(infile: str, outfile: str) -> None:
+    """Rewrite a raster file as a Cloud-Optimized GeoTIFF."""
+    try:
+        import rasterio
+        import rasterio.shutil
+    except ImportError:
+        raise ImportError(
+            "rasterio is required to convert assets to COG, "
+            + "install it with `pip install multiearth[cog]`"
+        )
+    tmp_file = f"{outfile}.{os.getpid()}.part"
+    with rasterio.open(infile) as src:
+        if src.count == 0:
+            raise ValueError(
+                f"{infile} has no raster bands, only the subdatasets "
+                + f"{', '.join(src.subdatasets)}; convert it to zarr instead"
+            )
+        rasterio.shutil.copy(
+            src,
+            tmp_file,
+            driver="COG",
+            compress="deflate",
+            blocksize=256,
+            overview_resampling="average",
+        )
+    os.replace(tmp_file, outfile)
+
+
+def _to_zarr(infile: str, outfile: str) -> None:
+    """Rewrite a NetCDF/HDF5 file or a GeoTIFF as a Zarr store."""
+    try:
+        import xarray as xr
+    except ImportError:
+        raise ImportError(
+            "xarray is required to convert assets to zarr, "
+            + "install it with `pip install multiearth[convert]`"
+        )
+    open_kwargs = {}
+    if infile.lower().endswith((".tif", ".tiff")):
+        # engine provided by rioxarray
+        open_kwargs["engine"] = "rasterio"
+    tmp_store = f"{outfile}.{os.getpid()}.part"
+    if os.path.exists(tmp_store):
+        shutil.rmtree(tmp_store)
+    with xr.open_dataset(infile, **open_kwargs) as ds:
+        ds.to_zarr(tmp_store, mode="w", consolidated=True)
+    # a store is a directory, which os.replace can't replace
+    if os.path.exists(outfile):
+        shutil.rmtree(outfile)
+    os.replace(tmp_store, outfile)
+
+
+# conversion format to the suffix of the converted outputs
+CONVERT_FORMATS: Dict[str, str] = {"cog": ".cog.tif", "zarr": ".zarr"}
+
+_CONVERTERS: Dict[str, Callable[[str, str], None]] = {"cog": _to_cog, "zarr": _to_zarr}
+
+
+def converted_outfile(outfile: str, fmt: str) -> str:
+    """Return the path of the converted output of a raw file.
+
+    Args:
+        outfile (str): path of the raw file
+        fmt (str): conversion format, one of CONVERT_FORMATS
+    Returns:
+        str: path of the converted output, next to the raw file
+    """
+    if fmt not in CONVERT_FORMATS:
+        raise ValueError(
+            f"Unknown conversion format {fmt}, use one of {', '.join(CONVERT_FORMATS)}"
+        )
+    root, _ = os.path.splitext(outfile)
+    return root + CONVERT_FORMATS[fmt]
+
+
+def convert_asset(outfile: str, fmt: str, remove_raw: bool = False) -> str:
+    """Convert a downloaded raw file, e.g. in a process pool worker.
+
+    The output is written to a temporary path and moved into place once complete,
+    so an interrupted conversion never leaves a partial output.
+
+    Args:
+        outfile (str): path of the raw file
+        fmt (str): conversion format, one of CONVERT_FORMATS
+        remove_raw (bool): remove the raw file once it's converted
+    Returns:
+        str: path of the converted output
+    """
+    converted = converted_outfile(outfile, fmt)
+    _CONVERTERS[fmt](outfile, converted)
+    if remove_raw:
+        os.remove(outfile)
+    return converted
@@ -0,0 +1,124 @@
+"""Selection of the items that cover an area of interest with the fewest items."""
+import re
+from datetime import timezone
+from typing import Dict, List, Tuple
+
+import pystac
+import shapely.geometry
+from dateutil.parser import isoparse
+from shapely.geometry.base import BaseGeometry
+
+from .datetime import time_bin_key
+
+__all__ = ["select_min_cover"]
+
+# items whose added coverage is within this fraction of the best item's are ties,
+# which are broken by preference (e.g. the footprints of reprocessed scenes)
+_TIE_TOLERANCE = 0.01
+# stop once less than this fraction of the area of interest is uncovered
+_MIN_UNCOVERED = 1e-6
+
+# properties with the processing version of an item, in order of priority
+_VERSION_PROPERTIES = [
+    "processing:version",
+    "s2:processing_baseline",
+    "landsat:collection_number",
+]
+# properties with the processing time of an item, in order of priority
+_TIME_PROPERTIES = ["updated", "created"]
+
+
+def _parse_version(value: str) -> Tuple[float, ...]:
+    """Parse a version such as "05.09", "2.0.1" or "02" into numbers, e.g. (5, 9)."""
+    return tuple(int(part) for part in re.findall(r"\d+", value))
+
+
+def _parse_time(value: str) -> Tuple[float, ...]:
+    """Parse an ISO 8601 time into its UTC timestamp, empty if it's invalid."""
+    try:
+        dt = isoparse(value)
+    except ValueError:
+        return ()
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt.timestamp(),)
+
+
+def _processing(itm: pystac.Item) -> Tuple[Tuple[int, Tuple[float, ...]], ...]:
+    """Return the processing of an item, which is greater for later processing.
+
+    Items are compared by each property in turn, so versions are only compared with
+    versions of the same property, and times with times. Items without a property
+    come before the items with it.
+    """
+    key: List[Tuple[int, Tuple[float, ...]]] = []
+    for prop in _VERSION_PROPERTIES + _TIME_PROPERTIES:
+        value = itm.properties.get(prop)
+        if value is None:
+            key.append((0, ()))
+        elif prop in _TIME_PROPERTIES:
+            key.append((1, _parse_time(str(value))))
+        else:
+            key.append((1, _parse_version(str(value))))
+    return tuple(key)
+
+
+def _cloud_cover(itm: pystac.Item) -> float:
+    """Return the cloud cover of an item, 100 if unknown."""
+    cloud_cover = itm.properties.get("eo:cloud_cover")
+    return float(cloud_cover) if cloud_cover is not None else 100.0
+
+
+def _min_cover(items: List[pystac.Item], aoi: BaseGeometry) -> List[pystac.Item]:
+    """Greedily select the items that add the most coverage until the aoi is covered."""
+    # latest processing first, then lowest cloud cover (sorts are stable)
+    candidates = sorted(items, key=_cloud_cover)
+    candidates.sort(key=_processing, reverse=True)
+    footprints = [shapely.geometry.shape(itm.geometry) for itm in candidates]
+    uncovered = aoi
+    selected: List[pystac.Item] = []
+    while uncovered.area > _MIN_UNCOVERED * aoi.area and len(candidates) > 0:
+        gains = [fp.intersection(uncovered).area for fp in footprints]
+        best_gain = max(gains)
+        if best_gain <= _MIN_UNCOVERED * aoi.area:
+            break
+        # the most preferred item among those (nearly) adding the most coverage
+        i = next(
+            j
+            for j, gain in enumerate(gains)
+            if gain >= best_gain * (1 - _TIE_TOLERANCE)
+        )
+        selected.append(candidates.pop(i))
+        uncovered = uncovered.difference(footprints.pop(i))
+    return selected
+
+
+def select_min_cover(
+    items: List[pystac.Item], aoi: BaseGeometry, time_bin: str
+) -> List[pystac.Item]:
+    """Select a minimal set of items that covers the area of interest per time bin.
+
+    Within each time bin, items are selected greedily by the part of the area of
+    interest they add, preferring the latest processing (version or time) and then
+    the lowest cloud cover among items adding (nearly) the same area. Items without
+    a geometry or datetime are kept.
+
+    Args:
+        items (List[pystac.Item]): the items, e.g. of a search with the aoi
+        aoi (BaseGeometry): the area of interest in EPSG:4326
+        time_bin (str): one of TIME_BINS, e.g. "day" to select a cover per day
+    Returns:
+        List[pystac.Item]: the selected items, in their original order
+    """
+    bins: Dict[str, List[pystac.Item]] = {}
+    keep = set()
+    for itm in items:
+        dt = itm.datetime or itm.common_metadata.start_datetime
+        if itm.geometry is None or dt is None:
+            keep.add(id(itm))
+            continue
+        bins.setdefault(time_bin_key(dt, time_bin), []).append(itm)
+
+    for bin_items in bins.values():
+        keep.update(id(itm) for itm in _min_cover(bin_items, aoi))
+    return [itm for itm in items if id(itm) in keep]
@@ -0,0 +1,208 @@
+"""Time-series datacubes of downloaded assets in chunked Zarr stores.
+
+A cube stacks the files of one collection and asset name along a time dimension,
+chunked in time and space and compressed, so the time series of a pixel is read
+from a few chunks instead of opening every file. Cubes are appended to as new items
+arrive; files whose time is already in the cube are skipped, and so are files on
+another grid (spatial coordinates or CRS) than the cube's.
+
+xarray and zarr are optional dependencies, install them with
+`pip install multiearth[convert]`.
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+__all__ = ["append_to_cube", "read_pixel_series"]
+
+# chunk length along time, a pixel's time series of N steps reads N / TIME_CHUNK chunks
+DEFAULT_TIME_CHUNK = 64
+# chunk length along each spatial dimension
+DEFAULT_SPACE_CHUNK = 256
+
+
+def _import_xarray() -> Any:
+    """Import xarray, which is an optional dependency."""
+    try:
+        import xarray as xr
+    except ImportError:
+        raise ImportError(
+            "xarray and zarr are required to build datacubes, "
+            + "install them with `pip install multiearth[convert]`"
+        )
+    return xr
+
+
+def _to_datetime64(dt: str) -> np.datetime64:
+    """Convert an ISO 8601 datetime to a timezone-naive UTC datetime64."""
+    ts = pd.Timestamp(dt)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return np.datetime64(ts.to_datetime64(), "ns")
+
+
+def _open_source(path: str, dt: str) -> Any:
+    """Open a downloaded file as a dataset with a time dimension."""
+    xr = _import_xarray()
+    lower_path = path.lower().rstrip("/")
+    if lower_path.endswith(".zarr"):
+        ds = xr.open_zarr(path)
+    elif lower_path.endswith((".tif", ".tiff")):
+        # engine provided by rioxarray
+        ds = xr.open_dataset(path, engine="rasterio")
+    else:
+        ds = xr.open_dataset(path)
+    # files with a time series of their own keep their times, others get the
+    # datetime of their item
+    if "time" in ds.dims and ds.sizes["time"] > 1:
+        return ds
+    if "time" in ds.dims:
+        ds = ds.isel(time=0, drop=True)
+    elif "time" in ds.coords:
+        ds = ds.drop_vars("time")
+    return ds.expand_dims(time=[_to_datetime64(dt)])
+
+
+def _grid(ds: Any) -> Tuple[Dict[str, Any], str]:
+    """Return the spatial coordinates and CRS (WKT, empty if unknown) of a dataset."""
+    coords = {
+        dim: np.asarray(ds[dim].values)
+        for dim in ds.dims
+        if dim != "time" and dim in ds.coords
+    }
+    crs = ""
+    for name in ("spatial_ref", "crs"):
+        if name in ds.variables:
+            attrs = ds[name].attrs
+            crs = str(attrs.get("crs_wkt") or attrs.get("spatial_ref") or "")
+            break
+    return coords, crs
+
+
+def _grid_mismatch(
+    ds: Any, sizes: Dict[str, int], grid: Tuple[Dict[str, Any], str]
+) -> str:
+    """Return how the grid of a dataset differs from a cube's, empty if it doesn't."""
+    ds_sizes = {dim: n for dim, n in ds.sizes.items() if dim != "time"}
+    if ds_sizes != sizes:
+        return f"its dimensions {ds_sizes} differ from the cube's {sizes}"
+    coords, crs = _grid(ds)
+    cube_coords, cube_crs = grid
+    if crs and cube_crs and crs != cube_crs:
+        return "its CRS differs from the cube's"
+    for dim, values in coords.items():
+        if dim in cube_coords and not np.array_equal(values, cube_coords[dim]):
+            return f"its {dim} coordinates differ from the cube's"
+    return ""
+
+
+def _encoding(ds: Any, time_chunk: int, space_chunk: int) -> Dict[str, Any]:
+    """Return the chunking and compression of the variables of a new cube."""
+    import zarr
+
+    compressor = zarr.Blosc(cname="zstd", clevel=5, shuffle=zarr.Blosc.BITSHUFFLE)
+    encoding: Dict[str, Any] = {}
+    for name, var in ds.data_vars.items():
+        chunks: List[int] = []
+        for i, dim in enumerate(var.dims):
+            size = var.sizes[dim]
+            if dim == "time":
+                chunks.append(time_chunk)
+            elif i >= var.ndim - 2:
+                # the last two dimensions are the spatial ones, e.g. (y, x)
+                chunks.append(min(space_chunk, size))
+            else:
+                chunks.append(size)
+        encoding[name] = dict(chunks=tuple(chunks), compressor=compressor)
+    return encoding
+
+
+def append_to_cube(
+    store: str,
+    sources: Iterable[Tuple[str, str]],
+    time_chunk: int = DEFAULT_TIME_CHUNK,
+    space_chunk: int = DEFAULT_SPACE_CHUNK,
+) -> int:
+    """Append downloaded files to a datacube, creating it if needed.
+
+    The files are appended in time order. Files whose time is already in the cube
+    are skipped, and so are files whose grid differs from the cube's (e.g. the items
+    of another tile), which are logged.
+
+    Args:
+        store (str): path of the Zarr store
+        sources (Iterable[Tuple[str, str]]): (ISO 8601 datetime, path) of each file,
+            the datetime is used for files without a time dimension
+        time_chunk (int): chunk length along time for a new cube
+        space_chunk (int): chunk length along the spatial dimensions for a new cube
+    Returns:
+        int: the number of files appended
+    """
+    xr = _import_xarray()
+    existing_times = set()
+    sizes: Optional[Dict[str, int]] = None
+    grid: Tuple[Dict[str, Any], str] = ({}, "")
+    if os.path.exists(store):
+        with xr.open_zarr(store) as cube:
+            existing_times = set(cube["time"].values.astype("datetime64[ns]"))
+            sizes = {dim: n for dim, n in cube.sizes.items() if dim != "time"}
+            grid = _grid(cube)
+
+    num_appended = 0
+    for dt, path in sorted(sources, key=lambda src: str(_to_datetime64(src[0]))):
+        if sizes is not None and _to_datetime64(dt) in existing_times:
+            logger.debug(f"Skipping {path}, its time is already in {store}")
+            continue
+        with _open_source(path, dt) as ds:
+            new_times = ds["time"].values.astype("datetime64[ns]")
+            if any(t in existing_times for t in new_times):
+                logger.debug(f"Skipping {path}, its times are already in {store}")
+                continue
+            if sizes is None:
+                ds.to_zarr(
+                    store,
+                    mode="w",
+                    encoding=_encoding(ds, time_chunk, space_chunk),
+                    consolidated=True,
+                )
+                sizes = {dim: n for dim, n in ds.sizes.items() if dim != "time"}
+                grid = _grid(ds)
+            else:
+                mismatch = _grid_mismatch(ds, sizes, grid)
+                if mismatch:
+                    logger.warning(f"Not adding {path} to {store}: {mismatch}")
+                    continue
+                ds.to_zarr(store, append_dim="time", consolidated=True)
+            existing_times.update(new_times)
+            num_appended += 1
+    return num_appended
+
+
+def read_pixel_series(
+    store: str, x: float, y: float, variable: Optional[str] = None
+) -> Any:
+    """Read the time series of the pixel nearest to a location from a datacube.
+
+    Only the chunks that contain the pixel are read. The spatial dimensions are the
+    last two dimensions of the variable, e.g. (y, x), (lat, lon) or (rows, cols).
+
+    Args:
+        store (str): path of the Zarr store
+        x (float): coordinate along the last dimension, in the cube's coordinates
+        y (float): coordinate along the second to last dimension
+        variable (str): variable to read, None for all variables
+    Returns:
+        Any: an xarray DataArray (or Dataset if variable is None) sorted by time
+    """
+    xr = _import_xarray()
+    cube = xr.open_zarr(store)
+    if variable is not None:
+        cube = cube[variable]
+        y_dim, x_dim = cube.dims[-2:]
+    else:
+        y_dim, x_dim = next(iter(cube.data_vars.values())).dims[-2:]
+    series = cube.sel({x_dim: x, y_dim: y}, method="nearest").sortby("time")
+    return series.load()
@@ -1,11 +1,79 @@
 """Datetime utilities."""
 from datetime import datetime
-from typing import Tuple
+from typing import List, Tuple
+
+DATE_RANGE_CHUNKS = ["", "year", "water_year", "month"]
+TIME_BINS = ["day", "week", "month", "year"]
 
 
 def datetime_str_to_value(s: str) -> Tuple[datetime, datetime]:
     """Convert datetime string to a tuple containing a start and end date."""
     components = s.split("/")
     start = datetime.strptime(components[0], "%Y-%m-%d")
-    end = datetime.strptime(components[0], "%Y-%m-%d")
+    end = datetime.strptime(components[-1], "%Y-%m-%d")
     return (start, end)
+
+
+def split_date_range(
+    start: datetime, end: datetime, chunk_by: str
+) -> List[Tuple[datetime, datetime]]:
+    """Split a date range into consecutive chunks aligned to calendar boundaries.
+
+    Consecutive chunks share their boundary date so that no data is lost at the
+    edges, i.e. callers should drop duplicates when stitching the chunks together.
+
+    Args:
+        start (datetime): start of the range
+        end (datetime): end of the range
+        chunk_by (str): one of DATE_RANGE_CHUNKS: "" (no chunking), "year",
+            "water_year" (October 1st to September 30th) or "month"
+    Returns:
+        List[Tuple[datetime, datetime]]: the (start, end) of each chunk, in order
+    """
+    if chunk_by not in DATE_RANGE_CHUNKS:
+        raise ValueError(
+            f"Unknown chunk_by {chunk_by}, use one of {', '.join(DATE_RANGE_CHUNKS)}"
+        )
+    if chunk_by == "" or start >= end:
+        return [(start, end)]
+
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(_next_boundary(chunk_start, chunk_by), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def _next_boundary(dt: datetime, chunk_by: str) -> datetime:
+    """Return the first chunk boundary strictly after dt."""
+    if chunk_by == "month":
+        if dt.month == 12:
+            return datetime(dt.year + 1, 1, 1)
+        return datetime(dt.year, dt.month + 1, 1)
+    if chunk_by == "water_year":
+        boundary = datetime(dt.year, 10, 1)
+        return boundary if boundary > dt else datetime(dt.year + 1, 10, 1)
+    return datetime(dt.year + 1, 1, 1)
+
+
+def time_bin_key(dt: datetime, time_bin: str) -> str:
+    """Return the key of the time bin that contains a datetime.
+
+    Args:
+        dt (datetime): the datetime
+        time_bin (str): one of TIME_BINS: "day", "week" (ISO week), "month" or "year"
+    Returns:
+        str: the key, e.g. "2021-04" for the month bin of 2021-04-23
+    """
+    if time_bin == "day":
+        return f"{dt:%Y-%m-%d}"
+    if time_bin == "week":
+        year, week, _ = dt.isocalendar()
+        return f"{year}-W{week:02d}"
+    if time_bin == "month":
+        return f"{dt:%Y-%m}"
+    if time_bin == "year":
+        return f"{dt:%Y}"
+    raise ValueError(f"Unknown time bin {time_bin}, use one of {', '.join(TIME_BINS)}")
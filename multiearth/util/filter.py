@@ -0,0 +1,389 @@
+"""Client-side evaluation of STAC API search filters.
+
+Used for endpoints that don't support the Filter, Query or Sort extensions, so the
+same predicates apply to the streamed items. Filters are CQL2-JSON expressions
+with the logical, comparison, `like`, `between`, `in`, `isNull`, spatial
+(`s_intersects`, `s_within`, ...), temporal (`t_after`, `t_intersects`, ...) and
+array (`a_contains`, ...) operators and the `casei` and `accenti` functions, e.g.
+{"op": "<=", "args": [{"property": "eo:cloud_cover"}, 10]}.
+"""
+import itertools
+import re
+import unicodedata
+from datetime import datetime, timezone
+from functools import cmp_to_key
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import pystac
+import shapely.geometry
+from dateutil.parser import isoparse
+
+__all__ = [
+    "filter_items",
+    "item_matches_filter",
+    "item_matches_query",
+    "sort_items",
+    "unsupported_operators",
+]
+
+_COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    "=": lambda a, b: bool(a == b),
+    "<>": lambda a, b: bool(a != b),
+    "<": lambda a, b: bool(a < b),
+    "<=": lambda a, b: bool(a <= b),
+    ">": lambda a, b: bool(a > b),
+    ">=": lambda a, b: bool(a >= b),
+}
+
+_SPATIAL: Dict[str, Callable[[Any, Any], bool]] = {
+    "s_intersects": lambda a, b: bool(a.intersects(b)),
+    "s_within": lambda a, b: bool(a.within(b)),
+    "s_contains": lambda a, b: bool(a.contains(b)),
+    "s_disjoint": lambda a, b: bool(a.disjoint(b)),
+    "s_equals": lambda a, b: bool(a.equals(b)),
+    "s_touches": lambda a, b: bool(a.touches(b)),
+    "s_overlaps": lambda a, b: bool(a.overlaps(b)),
+    "s_crosses": lambda a, b: bool(a.crosses(b)),
+}
+
+# temporal operators on (start, end) intervals, instants have start == end
+_TEMPORAL: Dict[str, Callable[[Any, Any], bool]] = {
+    "t_after": lambda a, b: bool(a[0] > b[1]),
+    "t_before": lambda a, b: bool(a[1] < b[0]),
+    "t_contains": lambda a, b: bool(a[0] < b[0] and b[1] < a[1]),
+    "t_disjoint": lambda a, b: bool(a[1] < b[0] or a[0] > b[1]),
+    "t_during": lambda a, b: bool(b[0] < a[0] and a[1] < b[1]),
+    "t_equals": lambda a, b: bool(a[0] == b[0] and a[1] == b[1]),
+    "t_finishedby": lambda a, b: bool(a[0] < b[0] and a[1] == b[1]),
+    "t_finishes": lambda a, b: bool(a[0] > b[0] and a[1] == b[1]),
+    "t_intersects": lambda a, b: bool(a[0] <= b[1] and b[0] <= a[1]),
+    "t_meets": lambda a, b: bool(a[1] == b[0]),
+    "t_metby": lambda a, b: bool(a[0] == b[1]),
+    "t_overlappedby": lambda a, b: bool(b[0] < a[0] < b[1] < a[1]),
+    "t_overlaps": lambda a, b: bool(a[0] < b[0] < a[1] < b[1]),
+    "t_startedby": lambda a, b: bool(a[0] == b[0] and a[1] > b[1]),
+    "t_starts": lambda a, b: bool(a[0] == b[0] and a[1] < b[1]),
+}
+
+_ARRAY: Dict[str, Callable[[List[Any], List[Any]], bool]] = {
+    "a_equals": lambda a, b: _hashable(a) == _hashable(b),
+    "a_contains": lambda a, b: _hashable(a) >= _hashable(b),
+    "a_containedby": lambda a, b: _hashable(a) <= _hashable(b),
+    "a_overlaps": lambda a, b: len(_hashable(a) & _hashable(b)) > 0,
+}
+
+# operators evaluated by _evaluate, lower case
+_LOGICAL = {"and", "or", "not"}
+_OPERATORS = (
+    _LOGICAL
+    | {"isnull", "like", "between", "in"}
+    | set(_COMPARISONS)
+    | set(_SPATIAL)
+    | set(_TEMPORAL)
+    | set(_ARRAY)
+)
+
+# query extension operator to the equivalent comparison
+_QUERY_OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "eq": _COMPARISONS["="],
+    "neq": _COMPARISONS["<>"],
+    "lt": _COMPARISONS["<"],
+    "lte": _COMPARISONS["<="],
+    "gt": _COMPARISONS[">"],
+    "gte": _COMPARISONS[">="],
+    "startsWith": lambda a, b: str(a).startswith(str(b)),
+    "endsWith": lambda a, b: str(a).endswith(str(b)),
+    "contains": lambda a, b: str(b) in str(a),
+    "in": lambda a, b: a in b,
+}
+
+
+def _property(itm: pystac.Item, name: str) -> Any:
+    """Return a property of an item, None if it doesn't have it."""
+    if name.startswith("properties."):
+        name = name[len("properties.") :]
+    if name == "id":
+        return itm.id
+    if name == "collection":
+        return itm.collection_id
+    if name in ("geometry", "footprint"):
+        return None if itm.geometry is None else shapely.geometry.shape(itm.geometry)
+    if name == "datetime" and itm.datetime is not None:
+        return itm.datetime
+    if name == "datetime":
+        # items with a range have a null datetime, the range is their instant
+        start = itm.common_metadata.start_datetime
+        end = itm.common_metadata.end_datetime
+        return None if start is None or end is None else [start, end]
+    value = itm.properties.get(name)
+    if name.endswith("datetime") and isinstance(value, str):
+        return isoparse(value)
+    return value
+
+
+def _value(itm: pystac.Item, arg: Any) -> Any:
+    """Evaluate an argument of a CQL2-JSON expression."""
+    if isinstance(arg, dict):
+        if "property" in arg:
+            return _property(itm, arg["property"])
+        if "timestamp" in arg:
+            return isoparse(arg["timestamp"])
+        if "date" in arg:
+            return isoparse(arg["date"])
+        if "interval" in arg:
+            return [_value(itm, a) for a in arg["interval"]]
+        if "casei" in arg:
+            value = _value(itm, arg["casei"])
+            return None if value is None else str(value).casefold()
+        if "accenti" in arg:
+            value = _value(itm, arg["accenti"])
+            return None if value is None else _strip_accents(str(value))
+        if "type" in arg and "coordinates" in arg:
+            return shapely.geometry.shape(arg)
+        if "op" in arg:
+            return _evaluate(itm, arg)
+    if isinstance(arg, list):
+        return [_value(itm, a) for a in arg]
+    return arg
+
+
+def _comparable(a: Any, b: Any) -> Any:
+    """Parse b as a datetime when comparing it with a datetime."""
+    if isinstance(a, datetime) and isinstance(b, str):
+        return isoparse(b)
+    return b
+
+
+def _strip_accents(value: str) -> str:
+    """Remove the accents of a string, for accent-insensitive comparisons."""
+    decomposed = unicodedata.normalize("NFD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _hashable(values: Any) -> Set[Any]:
+    """Return the set of the (JSON) values of an array."""
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    return {repr(v) if isinstance(v, (list, dict)) else v for v in values}
+
+
+def _instant(value: Any) -> datetime:
+    """Parse a timestamp of an interval, with .. for an open end."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    parsed = isoparse(str(value))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _interval(value: Any) -> Tuple[datetime, datetime]:
+    """Return the (start, end) of an instant or interval."""
+    if isinstance(value, (list, tuple)):
+        start, end = value
+        return (
+            datetime.min.replace(tzinfo=timezone.utc)
+            if start in ("..", None)
+            else _instant(start),
+            datetime.max.replace(tzinfo=timezone.utc)
+            if end in ("..", None)
+            else _instant(end),
+        )
+    instant = _instant(value)
+    return instant, instant
+
+
+def _like(value: Any, pattern: str) -> bool:
+    """Match a value with a CQL2 like pattern (% for any text, _ for a character)."""
+    regex = "".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern
+    )
+    return re.fullmatch(regex, str(value), flags=re.DOTALL) is not None
+
+
+def _evaluate(itm: pystac.Item, expr: Dict[str, Any]) -> bool:
+    """Evaluate a CQL2-JSON expression for an item."""
+    op = str(expr["op"]).lower()
+    args = expr.get("args", [])
+    if op == "and":
+        return all(_evaluate(itm, a) for a in args)
+    if op == "or":
+        return any(_evaluate(itm, a) for a in args)
+    if op == "not":
+        return not _evaluate(itm, args[0])
+    if op == "isnull":
+        return _value(itm, args[0]) is None
+
+    values = [_value(itm, a) for a in args]
+    if values[0] is None:
+        # comparisons with missing properties are false, as on the server
+        return False
+    if op in _COMPARISONS:
+        try:
+            return _COMPARISONS[op](values[0], _comparable(values[0], values[1]))
+        except TypeError:
+            return False
+    if op == "like":
+        return _like(values[0], values[1])
+    if op == "between":
+        low, high = (_comparable(values[0], v) for v in values[1:3])
+        return bool(low <= values[0] <= high)
+    if op == "in":
+        return values[0] in [_comparable(values[0], v) for v in values[1]]
+    if op in _SPATIAL:
+        return values[1] is not None and _SPATIAL[op](values[0], values[1])
+    if op in _TEMPORAL:
+        try:
+            return _TEMPORAL[op](_interval(values[0]), _interval(values[1]))
+        except (TypeError, ValueError):
+            return False
+    if op in _ARRAY:
+        return _ARRAY[op](values[0], values[1])
+    raise ValueError(f"Unsupported CQL2 operator {expr['op']}")
+
+
+def unsupported_operators(name: str, value: Any) -> Set[str]:
+    """Return the operators of a search option that can't be applied to items.
+
+    Args:
+        name (str): "filter", "query" or "sortby"
+        value (Any): the CQL2-JSON filter, query extension object or sort fields
+    Returns:
+        Set[str]: the unsupported operators, empty if all are supported
+    """
+    if name == "query" and isinstance(value, dict):
+        return {
+            str(op)
+            for ops in value.values()
+            if isinstance(ops, dict)
+            for op in ops
+            if op not in _QUERY_OPS
+        }
+    if name != "filter":
+        return set()
+    unsupported: Set[str] = set()
+    if isinstance(value, dict):
+        if "op" in value and str(value["op"]).lower() not in _OPERATORS:
+            unsupported.add(str(value["op"]))
+        for arg in value.values():
+            unsupported |= unsupported_operators(name, arg)
+    elif isinstance(value, list):
+        for arg in value:
+            unsupported |= unsupported_operators(name, arg)
+    return unsupported
+
+
+def item_matches_filter(itm: pystac.Item, cql2_filter: Dict[str, Any]) -> bool:
+    """Return True if an item matches a CQL2-JSON filter."""
+    return _evaluate(itm, cql2_filter)
+
+
+def item_matches_query(itm: pystac.Item, query: Dict[str, Dict[str, Any]]) -> bool:
+    """Return True if an item matches a query extension object.
+
+    Args:
+        itm (pystac.Item): the item
+        query (Dict[str, Dict[str, Any]]): e.g. {"eo:cloud_cover": {"lt": 10}}
+    """
+    for name, ops in query.items():
+        value = _property(itm, name)
+        for op, operand in ops.items():
+            if op not in _QUERY_OPS:
+                raise ValueError(f"Unsupported query operator {op}")
+            if value is None:
+                return False
+            try:
+                if not _QUERY_OPS[op](value, _comparable(value, operand)):
+                    return False
+            except TypeError:
+                return False
+    return True
+
+
+def _sort_fields(sortby: Union[str, List[Any]]) -> List[Any]:
+    """Return the (field, descending) pairs of a sortby parameter."""
+    if isinstance(sortby, str):
+        sortby = sortby.split(",")
+    fields = []
+    for field in sortby:
+        if isinstance(field, dict):
+            fields.append((field["field"], field.get("direction", "asc") == "desc"))
+        else:
+            field = field.strip()
+            fields.append((field.lstrip("+-"), field.startswith("-")))
+    return fields
+
+
+def _sort_value(itm: pystac.Item, name: str) -> Any:
+    """Return the property an item is sorted by, the start of a datetime range."""
+    value = _property(itm, name)
+    return value[0] if name == "datetime" and isinstance(value, list) else value
+
+
+def sort_items(
+    items: Iterable[pystac.Item], sortby: Union[str, List[Any]]
+) -> List[pystac.Item]:
+    """Sort items like the sortby parameter of the Sort extension.
+
+    Args:
+        items (Iterable[pystac.Item]): the items
+        sortby (Union[str, List[Any]]): e.g. ["-datetime", "+eo:cloud_cover"] or
+            [{"field": "properties.eo:cloud_cover", "direction": "asc"}]
+    Returns:
+        List[pystac.Item]: the sorted items, with missing values last
+    """
+    fields = _sort_fields(sortby)
+
+    def compare(a: pystac.Item, b: pystac.Item) -> int:
+        for name, descending in fields:
+            va, vb = _sort_value(a, name), _sort_value(b, name)
+            if va == vb:
+                continue
+            if va is None or vb is None:
+                return 1 if va is None else -1
+            result = -1 if va < vb else 1
+            return -result if descending else result
+        return 0
+
+    return sorted(items, key=cmp_to_key(compare))
+
+
+def filter_items(
+    items: Iterable[pystac.Item],
+    filter: Optional[Dict[str, Any]] = None,
+    query: Optional[Dict[str, Dict[str, Any]]] = None,
+    sortby: Optional[Union[str, List[Any]]] = None,
+    max_items: int = -1,
+) -> Iterator[pystac.Item]:
+    """Filter (and sort) streamed items like a STAC API search would.
+
+    Args:
+        items (Iterable[pystac.Item]): the items
+        filter (Dict[str, Any]): CQL2-JSON filter, None for no filter
+        query (Dict[str, Dict[str, Any]]): query extension object, None for no query
+        sortby (Union[str, List[Any]]): sort fields, None to keep the order; sorting
+            reads all items before returning any
+        max_items (int): maximum number of items to return, -1 for no limit
+    Returns:
+        Iterator[pystac.Item]: the matching items
+    """
+    matching: Iterable[pystac.Item] = (
+        itm
+        for itm in items
+        if (filter is None or item_matches_filter(itm, filter))
+        and (query is None or item_matches_query(itm, query))
+    )
+    if sortby:
+        matching = sort_items(matching, sortby)
+    if max_items >= 0:
+        matching = itertools.islice(matching, max_items)
+    return iter(matching)
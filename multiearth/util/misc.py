@@ -4,11 +4,14 @@ import hashlib
 import json
 import os
 import shutil
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from urllib.parse import urlparse
 
 import requests
 
+from .sink import open_output
+from .validators import VALIDATOR_HEADERS
+
 
 def query_asset_size_from_download_url(download_url: str) -> int:
     """Query the size of the asset from the download url using an http request."""
@@ -22,24 +25,37 @@ def query_asset_size_from_download_url(download_url: str) -> int:
     return filesize_mb
 
 
-def stream_download(url: str, outfile: str) -> None:
-    """Stream file to disk without loading into memory.
+def stream_download(
+    url: str,
+    outfile: str,
+    session: Optional[requests.Session] = None,
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> Dict[str, str]:
+    """Stream file to disk (or object storage) without loading into memory.
 
     originally from
     https://stackoverflow.com/questions/16694907/download-large-file-in-python-with-requests
 
     Args:
         url (str): download from this url
-        outfile (str): output to this url
+        outfile (str): output to this path or fsspec url, e.g. s3://bucket/key
+        session (requests.Session): optional session to reuse connections and auth
+        storage_options (Dict[str, Any]): options for the fsspec filesystem of outfile
+    Returns:
+        Dict[str, str]: the validators (ETag, Last-Modified, Content-Length) of the
+            response that were set
     """
-    dirname = os.path.dirname(outfile)
-    os.makedirs(dirname, exist_ok=True)
-
-    with requests.get(url, stream=True, timeout=180) as r:
+    getter = session.get if session is not None else requests.get
+    with getter(url, stream=True, timeout=180) as r:
         r.raise_for_status()
         r.raw.read = functools.partial(r.raw.read, decode_content=True)
-        with open(outfile, "wb") as f:
+        with open_output(outfile, storage_options) as f:
             shutil.copyfileobj(r.raw, f, length=16 * 1024 * 1024)
+        validators = {h: r.headers[h] for h in VALIDATOR_HEADERS if r.headers.get(h)}
+        if r.headers.get("Content-Encoding"):
+            # the length of the encoded response, not of the decoded file
+            validators.pop("Content-Length", None)
+        return validators
 
 
 def dict_hash(dictionary: Dict[str, Any]) -> str:
@@ -65,6 +81,18 @@ def sha256_hash(s: str) -> str:
     return sha.hexdigest()
 
 
+def shard_of(key: str, num_shards: int) -> int:
+    """Return the shard of a key, the same on every machine and python process.
+
+    Args:
+        key (str): e.g. an asset id
+        num_shards (int): the total number of shards
+    Returns:
+        int: the shard index in [0, num_shards)
+    """
+    return int(sha256_hash(key)[:16], 16) % num_shards
+
+
 def item_href_to_outfile(href: str, outdir: str) -> str:
     """Take an item and returns the output filename for it."""
     outname = os.path.basename(urlparse(href).path)
@@ -0,0 +1,150 @@
+"""Download plans, to search once and download later or on other machines.
+
+A plan has one row per planned asset (with its provider, href, outfile and size),
+along with the config it was planned with. Plans are written as Parquet files if
+the path ends with .parquet (requires `pip install multiearth[parquet]`), and as
+gzip-compressed JSON lines otherwise.
+"""
+import gzip
+import json
+from typing import Any, Dict, List, Tuple
+
+import pystac
+
+from ..assets import ExtractAsset
+
+__all__ = [
+    "asset_to_record",
+    "read_plan",
+    "read_plan_config",
+    "record_to_asset",
+    "write_plan",
+]
+
+# key of the config in the metadata of a Parquet plan
+_CONFIG_KEY = b"multiearth.config"
+
+
+def asset_to_record(
+    ast: ExtractAsset, provider_index: int, provider: str
+) -> Dict[str, Any]:
+    """Return the plan row of an asset.
+
+    Args:
+        ast (ExtractAsset): the planned asset
+        provider_index (int): index of the asset's provider in the config's providers
+        provider (str): id of the asset's provider, e.g. "MPC"
+    """
+    return dict(
+        provider_index=provider_index,
+        provider=provider,
+        id=ast.id,
+        collection_name=ast.collection_name,
+        asset_name=ast.asset_name,
+        href=str(ast.asset.href),
+        outfile=ast.outfile,
+        filesize_mb=ast.filesize_mb,
+        dtype=ast.dtype,
+        provider_name=ast.provider_name,
+        datetime=ast.datetime,
+        clip_bounds=json.dumps(ast.clip_bounds) if ast.clip_bounds else "",
+        convert_to=ast.convert_to,
+        remove_raw=ast.remove_raw,
+        cube_store=ast.cube_store,
+        duplicate_outfiles=json.dumps(ast.duplicate_outfiles),
+        # the full STAC asset, e.g. for the alternate (S3) hrefs of EarthData assets
+        asset=json.dumps(ast.asset.to_dict()),
+    )
+
+
+def record_to_asset(record: Dict[str, Any]) -> ExtractAsset:
+    """Return the planned asset of a plan row."""
+    clip_bounds = None
+    if record["clip_bounds"]:
+        minx, miny, maxx, maxy = json.loads(record["clip_bounds"])
+        clip_bounds = (float(minx), float(miny), float(maxx), float(maxy))
+    return ExtractAsset(
+        id=str(record["id"]),
+        asset_name=str(record["asset_name"]),
+        dtype=str(record["dtype"]),
+        asset=pystac.Asset.from_dict(json.loads(record["asset"])),
+        outfile=str(record["outfile"]),
+        filesize_mb=int(record["filesize_mb"]),
+        provider_name=str(record["provider_name"]),
+        collection_name=str(record["collection_name"]),
+        clip_bounds=clip_bounds,
+        convert_to=str(record["convert_to"]),
+        remove_raw=bool(record["remove_raw"]),
+        datetime=str(record["datetime"]),
+        cube_store=str(record["cube_store"]),
+        duplicate_outfiles=list(json.loads(record["duplicate_outfiles"])),
+    )
+
+
+def _import_pyarrow() -> Any:
+    """Import pyarrow, which is an optional dependency."""
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "pyarrow is required for parquet plans, "
+            + "install it with `pip install multiearth[parquet]`"
+        )
+    return pyarrow
+
+
+def write_plan(path: str, records: List[Dict[str, Any]], config_yaml: str) -> None:
+    """Write a plan.
+
+    Args:
+        path (str): the plan file, Parquet if it ends with .parquet
+        records (List[Dict[str, Any]]): the rows of the planned assets
+        config_yaml (str): the config the assets were planned with
+    """
+    if path.endswith(".parquet"):
+        pa = _import_pyarrow()
+        columns = list(records[0]) if records else []
+        table = pa.table({name: [r[name] for r in records] for name in columns})
+        table = table.replace_schema_metadata({_CONFIG_KEY: config_yaml.encode()})
+        pa.parquet.write_table(table, path, compression="zstd")
+        return
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"config": config_yaml}) + "\n")
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_plan_config(path: str) -> str:
+    """Return the config a plan was planned with, without reading its rows."""
+    if path.endswith(".parquet"):
+        pa = _import_pyarrow()
+        metadata = pa.parquet.read_schema(path).metadata or {}
+        return str(metadata.get(_CONFIG_KEY, b"").decode())
+    with gzip.open(path, "rt") as f:
+        return str(json.loads(f.readline())["config"])
+
+
+def read_plan(path: str) -> Tuple[List[Dict[str, Any]], str]:
+    """Read a plan.
+
+    Args:
+        path (str): the plan file, Parquet if it ends with .parquet
+    Returns:
+        Tuple[List[Dict[str, Any]], str]: the rows of the planned assets and the
+            config they were planned with
+    """
+    if path.endswith(".parquet"):
+        pa = _import_pyarrow()
+        table = pa.parquet.read_table(path)
+        metadata = table.schema.metadata or {}
+        columns = table.to_pydict()
+        records: List[Dict[str, Any]] = [
+            {name: values[i] for name, values in columns.items()}
+            for i in range(table.num_rows)
+        ]
+        return records, metadata.get(_CONFIG_KEY, b"").decode()
+    with gzip.open(path, "rt") as f:
+        config_yaml = str(json.loads(f.readline())["config"])
+        records = [json.loads(line) for line in f if line.strip()]
+    return records, config_yaml
@@ -0,0 +1,185 @@
+"""Amazon S3 download utilities.
+
+boto3 is an optional dependency, install it with `pip install multiearth[s3]`.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .sink import is_remote, open_output
+
+__all__ = ["create_s3_client", "parse_s3_url", "s3_ranged_download"]
+
+# size of the ranged GetObject requests
+DEFAULT_PART_SIZE_MB = 8
+# number of concurrent ranged requests per object
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+def parse_s3_url(url: str) -> Tuple[str, str]:
+    """Split an s3://bucket/key url into the bucket and key."""
+    parsed = urlparse(url)
+    if parsed.scheme != "s3" or not parsed.netloc:
+        raise ValueError(f"Not an S3 url: {url}")
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def create_s3_client(
+    credentials: Optional[Dict[str, str]] = None,
+    endpoint_url: str = "",
+    region_name: str = "us-west-2",
+    max_pool_connections: int = DEFAULT_MAX_CONCURRENCY,
+) -> Any:
+    """Create a boto3 S3 client.
+
+    Args:
+        credentials (Dict[str, str]): temporary credentials with the keys accessKeyId,
+            secretAccessKey and sessionToken, None to use the default boto3 credentials
+        endpoint_url (str): S3-compatible endpoint, e.g. a local MinIO server, empty
+            for AWS
+        region_name (str): AWS region of the buckets
+        max_pool_connections (int): size of the connection pool
+    Returns:
+        Any: the boto3 S3 client
+    """
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:
+        raise ImportError(
+            "boto3 is required for S3 transfers, "
+            + "install it with `pip install multiearth[s3]`"
+        )
+    kwargs: Dict[str, Any] = {}
+    if credentials is not None:
+        kwargs = dict(
+            aws_access_key_id=credentials["accessKeyId"],
+            aws_secret_access_key=credentials["secretAccessKey"],
+            aws_session_token=credentials["sessionToken"],
+        )
+    if endpoint_url:
+        kwargs["endpoint_url"] = endpoint_url
+    return boto3.client(
+        "s3",
+        region_name=region_name,
+        config=Config(max_pool_connections=max_pool_connections),
+        **kwargs,
+    )
+
+
+def s3_ranged_download(
+    client: Any,
+    url: str,
+    outfile: str,
+    storage_options: Optional[Dict[str, Any]] = None,
+    part_size_mb: int = DEFAULT_PART_SIZE_MB,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> Dict[str, str]:
+    """Download an S3 object with concurrent ranged GetObject requests.
+
+    The parts are written into a temporary file that replaces outfile once all parts
+    are downloaded, so an interrupted download never leaves a partial outfile. A part
+    shorter than its range (e.g. of an object replaced during the download) fails
+    the download. Remote
+    outfiles (fsspec urls) are streamed in order instead, holding at most
+    max_concurrency parts in memory.
+
+    Args:
+        client (Any): boto3 S3 client
+        url (str): s3://bucket/key url of the object
+        outfile (str): output path or fsspec url
+        storage_options (Dict[str, Any]): options for the fsspec filesystem of outfile
+        part_size_mb (int): size of each ranged request in MB
+        max_concurrency (int): maximum number of concurrent ranged requests
+    Returns:
+        Dict[str, str]: the validators (ETag, Last-Modified, Content-Length) of the
+            object, like the response headers of an HTTP download
+    """
+    bucket, key = parse_s3_url(url)
+    head = client.head_object(Bucket=bucket, Key=key)
+    size = int(head["ContentLength"])
+    validators = {"ETag": str(head.get("ETag", "")), "Content-Length": str(size)}
+    if head.get("LastModified") is not None:
+        # botocore returns dateutil time zones, usegmt requires timezone.utc
+        last_modified = head["LastModified"].astimezone(timezone.utc)
+        validators["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    part_size = part_size_mb * 1024 * 1024
+    ranges: List[Tuple[int, int]] = [
+        (start, min(start + part_size, size) - 1) for start in range(0, size, part_size)
+    ]
+
+    if is_remote(outfile):
+        _s3_ranged_stream(
+            client, bucket, key, ranges, outfile, storage_options, max_concurrency
+        )
+        return validators
+
+    dirname = os.path.dirname(outfile)
+    os.makedirs(dirname, exist_ok=True)
+    tmp_file = f"{outfile}.{os.getpid()}.part"
+    with open(tmp_file, "wb") as f:
+        f.truncate(size)
+
+    def download_part(byte_range: Tuple[int, int]) -> None:
+        start, end = byte_range
+        body = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")[
+            "Body"
+        ]
+        num_bytes = 0
+        with open(tmp_file, "r+b") as f:
+            f.seek(start)
+            chunk = body.read(1024 * 1024)
+            while chunk:
+                f.write(chunk)
+                num_bytes += len(chunk)
+                chunk = body.read(1024 * 1024)
+        _check_part_size(url, byte_range, num_bytes)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            # list() re-raises the first failed part
+            list(executor.map(download_part, ranges))
+        os.replace(tmp_file, outfile)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return validators
+
+
+def _s3_ranged_stream(
+    client: Any,
+    bucket: str,
+    key: str,
+    ranges: List[Tuple[int, int]],
+    outfile: str,
+    storage_options: Optional[Dict[str, Any]],
+    max_concurrency: int,
+) -> None:
+    """Stream ranges of an S3 object in order to an output, fetching them concurrently."""
+
+    def get_part(byte_range: Tuple[int, int]) -> bytes:
+        start, end = byte_range
+        body = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+        part = bytes(body["Body"].read())
+        _check_part_size(f"s3://{bucket}/{key}", byte_range, len(part))
+        return part
+
+    window = max(1, max_concurrency)
+    with open_output(outfile, storage_options) as f:
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            for i in range(0, len(ranges), window):
+                for part in executor.map(get_part, ranges[i : i + window]):
+                    f.write(part)
+
+
+def _check_part_size(url: str, byte_range: Tuple[int, int], num_bytes: int) -> None:
+    """Raise an OSError if a ranged request didn't return exactly its range."""
+    start, end = byte_range
+    if num_bytes != end + 1 - start:
+        raise OSError(
+            f"Received {num_bytes:,} bytes of {url} for bytes {start}-{end}, "
+            + "the object may have changed during the download"
+        )
@@ -0,0 +1,147 @@
+"""Output sinks: local paths or fsspec urls such as s3://bucket/prefix.
+
+Remote outputs are written with fsspec, which streams them to object storage as
+multipart uploads, so downloads never need local disk space. fsspec (and the
+filesystem implementation, e.g. s3fs) is an optional dependency, install it with
+`pip install multiearth[fsspec]`.
+"""
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .cache import link_or_copy
+
+__all__ = [
+    "is_remote",
+    "open_output",
+    "existing_output_sizes",
+    "remove_output",
+    "copy_output",
+]
+
+
+def is_remote(path: str) -> bool:
+    """Return True if the path is an fsspec url of a remote filesystem."""
+    scheme = urlparse(path).scheme
+    # single letter schemes are windows drives
+    return len(scheme) > 1 and scheme != "file"
+
+
+def _url_to_fs(path: str, storage_options: Optional[Dict[str, Any]]) -> Tuple[Any, str]:
+    """Return the fsspec filesystem and the path within it."""
+    try:
+        from fsspec.core import url_to_fs
+    except ImportError:
+        raise ImportError(
+            f"fsspec is required for writing to {path}, "
+            + "install it with `pip install multiearth[fsspec]`"
+        )
+    fs, fs_path = url_to_fs(path, **(storage_options or {}))
+    return fs, str(fs_path)
+
+
+@contextmanager
+def open_output(
+    path: str, storage_options: Optional[Dict[str, Any]] = None
+) -> Iterator[BinaryIO]:
+    """Open an output file for writing.
+
+    Remote outputs are uploaded in parts while they are written (bounded by the
+    filesystem's block size) and are only committed if writing succeeds.
+
+    Args:
+        path (str): local path or fsspec url
+        storage_options (Dict[str, Any]): options for the fsspec filesystem, e.g.
+            {"endpoint_url": "http://localhost:9000"} for s3fs
+    """
+    if not is_remote(path):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(path, "wb") as f:
+            yield f
+        return
+
+    fs, fs_path = _url_to_fs(path, storage_options)
+    remote_file: Any = fs.open(fs_path, "wb")
+    try:
+        yield remote_file
+    except BaseException:
+        # abort the upload, so a partial object is never committed
+        if hasattr(remote_file, "discard"):
+            remote_file.discard()
+            remote_file.closed = True
+        else:
+            remote_file.close()
+            if fs.exists(fs_path):
+                fs.rm(fs_path)
+        raise
+    remote_file.close()
+
+
+def existing_output_sizes(
+    paths: Iterable[str], storage_options: Optional[Dict[str, Any]] = None
+) -> Dict[str, int]:
+    """Return the sizes in bytes of the outputs that exist.
+
+    Remote outputs are found by listing their common prefix (per bucket) once,
+    instead of checking each output separately.
+
+    Args:
+        paths (Iterable[str]): local paths or fsspec urls
+        storage_options (Dict[str, Any]): options for the fsspec filesystem
+    Returns:
+        Dict[str, int]: size of each existing output, by path
+    """
+    sizes: Dict[str, int] = {}
+    remote: List[str] = []
+    for path in paths:
+        if is_remote(path):
+            remote.append(path)
+        elif os.path.exists(path):
+            sizes[path] = os.path.getsize(path)
+    if len(remote) == 0:
+        return sizes
+
+    # group the outputs by filesystem and bucket
+    groups: Dict[Tuple[str, str], Tuple[Any, Dict[str, str]]] = {}
+    for path in remote:
+        fs, fs_path = _url_to_fs(path, storage_options)
+        key = (urlparse(path).scheme, fs_path.split("/")[0])
+        groups.setdefault(key, (fs, {}))[1][fs_path] = path
+    for fs, by_fs_path in groups.values():
+        prefix = os.path.commonpath([os.path.dirname(p) for p in by_fs_path])
+        for fs_path, info in fs.find(prefix, detail=True).items():
+            if fs_path in by_fs_path:
+                sizes[by_fs_path[fs_path]] = int(info.get("size") or 0)
+    return sizes
+
+
+def remove_output(path: str, storage_options: Optional[Dict[str, Any]] = None) -> None:
+    """Remove an output file."""
+    if not is_remote(path):
+        os.remove(path)
+        return
+    fs, fs_path = _url_to_fs(path, storage_options)
+    fs.rm(fs_path)
+
+
+def copy_output(
+    src: str, dst: str, storage_options: Optional[Dict[str, Any]] = None
+) -> None:
+    """Copy an output file to another output, e.g. to fan out one download.
+
+    Local copies are hardlinks where possible.
+    """
+    if not is_remote(src) and not is_remote(dst):
+        link_or_copy(src, dst)
+        return
+    if is_remote(src):
+        fs, fs_path = _url_to_fs(src, storage_options)
+        fsrc: Any = fs.open(fs_path, "rb")
+    else:
+        fsrc = open(src, "rb")
+    with fsrc, open_output(dst, storage_options) as fdst:
+        shutil.copyfileobj(fsrc, fdst, length=16 * 1024 * 1024)
@@ -0,0 +1,47 @@
+"""SQLite transactions for the stores shared between processes (caches, queues, indexes).
+
+Every operation opens its own connection and short transaction, so a database file
+can be shared by the processes and threads of any host that can lock it.
+"""
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+__all__ = ["add_column", "transaction"]
+
+
+@contextmanager
+def transaction(
+    path: str, timeout: float = 60.0, write: bool = True
+) -> Iterator[sqlite3.Connection]:
+    """Run statements in a transaction that is committed on success.
+
+    Write transactions take the database's write lock when they start (BEGIN
+    IMMEDIATE), so their reads and writes are atomic. Read transactions only take a
+    shared lock, so concurrent reads don't block each other.
+
+    Args:
+        path (str): path to the SQLite file
+        timeout (float): seconds to wait for the database lock
+        write (bool): False for a transaction that only reads
+    """
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def add_column(
+    conn: sqlite3.Connection, table: str, column: str, definition: str
+) -> None:
+    """Add a column to a table created before the column existed, if it's missing."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
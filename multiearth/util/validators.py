@@ -0,0 +1,88 @@
+"""Store of the HTTP validators (ETag, Last-Modified, size) of downloaded assets.
+
+The validators of each outfile are recorded when it's downloaded, so a later run
+can check whether the remote asset changed with a conditional request, which
+returns 304 Not Modified without a body if it didn't.
+"""
+import os
+from typing import Dict, Iterable, List
+
+from .sqlite import transaction
+
+__all__ = ["VALIDATOR_HEADERS", "ValidatorStore", "conditional_headers"]
+
+# response headers that are stored as the validators of a download
+VALIDATOR_HEADERS = ["ETag", "Last-Modified", "Content-Length"]
+
+
+def conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+    """Return the request headers that make a GET conditional on the validators."""
+    headers = {}
+    if validators.get("ETag"):
+        headers["If-None-Match"] = validators["ETag"]
+    if validators.get("Last-Modified"):
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+    return headers
+
+
+class ValidatorStore:
+    """Validators of downloaded outfiles, stored in a SQLite file."""
+
+    def __init__(self, path: str) -> None:
+        """Open (and create if needed) the store.
+
+        Args:
+            path (str): path to the SQLite file
+        """
+        self.path = os.path.expanduser(path)
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with transaction(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS validators ("
+                "outfile TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, size INTEGER)"
+            )
+
+    @staticmethod
+    def _key(outfile: str) -> str:
+        """Return the key of an outfile, its absolute path if it's local."""
+        return outfile if "://" in outfile else os.path.abspath(outfile)
+
+    def put(self, outfile: str, validators: Dict[str, str]) -> None:
+        """Store the validators (response headers in VALIDATOR_HEADERS) of an outfile."""
+        size = validators.get("Content-Length")
+        with transaction(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO validators "
+                "(outfile, etag, last_modified, size) VALUES (?, ?, ?, ?)",
+                (
+                    self._key(outfile),
+                    validators.get("ETag"),
+                    validators.get("Last-Modified"),
+                    int(size) if size else None,
+                ),
+            )
+
+    def get_many(self, outfiles: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """Return the stored validators of the outfiles that have any, by outfile."""
+        by_key = {self._key(outfile): outfile for outfile in outfiles}
+        keys: List[str] = list(by_key)
+        validators: Dict[str, Dict[str, str]] = {}
+        with transaction(self.path, write=False) as conn:
+            # stay below SQLite's limit on the number of parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = conn.execute(
+                    "SELECT outfile, etag, last_modified, size FROM validators "
+                    + f"WHERE outfile IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, etag, last_modified, size in rows:
+                    values = {
+                        "ETag": etag,
+                        "Last-Modified": last_modified,
+                        "Content-Length": str(size) if size is not None else None,
+                    }
+                    validators[by_key[key]] = {k: v for k, v in values.items() if v}
+        return validators
@@ -0,0 +1,104 @@
+"""High-water marks of watched collections, for incremental ingestion of new items.
+
+Each watched collection records the latest item datetime (or `updated` time) that
+has been extracted, and the ids of the assets at exactly that time, so the next
+poll only searches for newer items and skips the assets it already extracted.
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Set, Tuple
+
+from dateutil.parser import isoparse
+
+from .sqlite import transaction
+
+__all__ = ["WatchState", "advance_mark", "parse_mark"]
+
+
+def parse_mark(value: str) -> Optional[datetime]:
+    """Parse an ISO 8601 datetime as a timezone-aware UTC datetime, None if empty."""
+    if not value:
+        return None
+    dt = isoparse(value)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def advance_mark(
+    mark: str,
+    seen: Set[str],
+    extracted: Iterable[Tuple[str, str]],
+    failed: Iterable[Tuple[str, str]],
+) -> Tuple[str, Set[str]]:
+    """Return the high-water mark and its seen asset ids after a poll.
+
+    The mark advances to the latest extracted time, but not past the earliest
+    failed asset, so the failed assets are found again by the next poll.
+
+    Args:
+        mark (str): ISO 8601 high-water mark before the poll, empty if none
+        seen (Set[str]): ids of the assets at the mark that were extracted
+        extracted (Iterable[Tuple[str, str]]): (id, ISO 8601 time) of the assets
+            extracted by the poll
+        failed (Iterable[Tuple[str, str]]): (id, ISO 8601 time) of the assets that
+            failed
+    Returns:
+        Tuple[str, Set[str]]: the new mark and the ids of the extracted assets at it
+    """
+    done = [(id, parse_mark(t)) for id, t in extracted if t]
+    failed_times = [dt for dt in (parse_mark(t) for _, t in failed if t) if dt]
+    times = [dt for _, dt in done if dt is not None]
+    if len(failed_times) > 0:
+        new_mark = min(failed_times)
+    elif len(times) > 0:
+        new_mark = max(times)
+    else:
+        return mark, seen
+    old_mark = parse_mark(mark)
+    if old_mark is not None and new_mark < old_mark:
+        return mark, seen
+    new_seen = {id for id, dt in done if dt == new_mark}
+    if new_mark == old_mark:
+        new_seen |= seen
+    return new_mark.isoformat().replace("+00:00", "Z"), new_seen
+
+
+class WatchState:
+    """High-water marks of watched collections, stored in a SQLite file."""
+
+    def __init__(self, path: str) -> None:
+        """Open (and create if needed) the state.
+
+        Args:
+            path (str): path to the SQLite file
+        """
+        self.path = os.path.expanduser(path)
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with transaction(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS marks ("
+                "key TEXT PRIMARY KEY, mark TEXT NOT NULL, seen TEXT NOT NULL)"
+            )
+
+    def get(self, key: str) -> Tuple[str, Set[str]]:
+        """Return the mark of a collection and its seen asset ids, empty if none."""
+        with transaction(self.path, write=False) as conn:
+            row = conn.execute(
+                "SELECT mark, seen FROM marks WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return "", set()
+        seen: List[str] = json.loads(row[1])
+        return str(row[0]), set(seen)
+
+    def put(self, key: str, mark: str, seen: Set[str]) -> None:
+        """Store the mark of a collection and the ids of the assets extracted at it."""
+        with transaction(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO marks (key, mark, seen) VALUES (?, ?, ?)",
+                (key, mark, json.dumps(sorted(seen))),
+            )
@@ -0,0 +1,332 @@
+"""Shared work queue for distributing downloads across processes and machines.
+
+A planner puts download jobs into the queue, and any number of worker processes on
+any host claim them with time-limited leases. Workers extend their leases with
+heartbeats while downloading, and jobs of crashed workers become claimable again
+once their lease expires. Failed jobs are retried until they reach their maximum
+number of attempts, and are queued again when they are put again.
+
+Job payloads are data (e.g. JSON records), which the workers pass to the job function
+they were started with. Anyone who can write the queue can only add jobs of that
+function, never run their own code on the workers.
+
+SQLiteWorkQueue stores the queue in a single SQLite file, e.g. on a shared volume.
+Other backends implement WorkQueue and are registered in WORK_QUEUE_BACKENDS.
+"""
+import abc
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing import Process
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from .sqlite import transaction
+
+__all__ = [
+    "Job",
+    "WorkQueue",
+    "SQLiteWorkQueue",
+    "WORK_QUEUE_BACKENDS",
+    "open_work_queue",
+    "run_queue_workers",
+]
+
+JOB_STATUSES = ["pending", "leased", "done", "failed"]
+
+
+@dataclass
+class Job:
+    """A job claimed from the work queue."""
+
+    id: str
+    payload: bytes
+    attempts: int
+    max_attempts: int
+
+
+class WorkQueue(abc.ABC):
+    """A queue of jobs that workers claim with time-limited leases."""
+
+    @abc.abstractmethod
+    def put(self, jobs: Iterable[Tuple[str, bytes]], max_attempts: int) -> int:
+        """Add (id, payload) jobs, ignoring ids already in the queue unless they failed.
+
+        Failed jobs are reset to pending with their attempts cleared.
+
+        Returns:
+            int: the number of jobs added or requeued
+        """
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        """Lease a pending job (or one whose lease expired), None if there is none."""
+
+    @abc.abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extend the lease of a job, False if the worker no longer holds it."""
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, worker_id: str) -> None:
+        """Mark a leased job as done."""
+
+    @abc.abstractmethod
+    def release(self, job_id: str, worker_id: str, error: str) -> None:
+        """Release a failed job for a retry, or fail it after its last attempt."""
+
+    @abc.abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Return the number of jobs for each status in JOB_STATUSES."""
+
+    @abc.abstractmethod
+    def failed_jobs(self) -> List[Tuple[str, str]]:
+        """Return the (id, error) of the failed jobs."""
+
+    def is_finished(self) -> bool:
+        """Return True if no jobs are pending or leased."""
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue stored in a SQLite database file.
+
+    Every operation opens its own short transaction, so the queue can be shared by
+    processes and threads on any host that can lock the file. Claims take a write
+    lock (BEGIN IMMEDIATE), so two workers never lease the same job.
+    """
+
+    def __init__(self, path: str, timeout: float = 60.0) -> None:
+        """Open (and create if needed) the queue database.
+
+        Args:
+            path (str): path to the SQLite file
+            timeout (float): seconds to wait for the database lock
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.timeout = timeout
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, exist_ok=True)
+        with transaction(self.path, self.timeout) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, payload BLOB NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                "worker TEXT, lease_expires REAL, error TEXT)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)"
+            )
+
+    def put(self, jobs: Iterable[Tuple[str, bytes]], max_attempts: int) -> int:
+        """Add (id, payload) jobs, ignoring ids already in the queue unless they failed."""
+        jobs = list(jobs)
+        with transaction(self.path, self.timeout) as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE jobs SET status = 'pending', payload = ?, attempts = 0, "
+                "max_attempts = ?, worker = NULL, lease_expires = NULL, error = NULL "
+                "WHERE id = ? AND status = 'failed'",
+                ((payload, max_attempts, id) for id, payload in jobs),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (id, payload, max_attempts) VALUES (?, ?, ?)",
+                ((id, payload, max_attempts) for id, payload in jobs),
+            )
+            return conn.total_changes - before
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        """Lease a pending job (or one whose lease expired), None if there is none."""
+        now = time.time()
+        with transaction(self.path, self.timeout) as conn:
+            # jobs of crashed workers count as failed attempts
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', worker = NULL, "
+                "error = 'lease expired on the last attempt' "
+                "WHERE status = 'leased' AND lease_expires < ? "
+                "AND attempts >= max_attempts",
+                (now,),
+            )
+            row = conn.execute(
+                "SELECT id, payload, attempts, max_attempts FROM jobs "
+                "WHERE status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?) LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now + lease_seconds, row[0]),
+            )
+        return Job(id=row[0], payload=row[1], attempts=row[2] + 1, max_attempts=row[3])
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extend the lease of a job, False if the worker no longer holds it."""
+        with transaction(self.path, self.timeout) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_seconds, job_id, worker_id),
+            )
+            return cursor.rowcount > 0
+
+    def complete(self, job_id: str, worker_id: str) -> None:
+        """Mark a leased job as done."""
+        with transaction(self.path, self.timeout) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', worker = NULL, error = NULL "
+                "WHERE id = ? AND worker = ?",
+                (job_id, worker_id),
+            )
+
+    def release(self, job_id: str, worker_id: str, error: str) -> None:
+        """Release a failed job for a retry, or fail it after its last attempt."""
+        with transaction(self.path, self.timeout) as conn:
+            conn.execute(
+                "UPDATE jobs SET worker = NULL, lease_expires = NULL, error = ?, "
+                "status = CASE WHEN attempts >= max_attempts "
+                "THEN 'failed' ELSE 'pending' END "
+                "WHERE id = ? AND worker = ?",
+                (error, job_id, worker_id),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Return the number of jobs for each status in JOB_STATUSES."""
+        counts = {status: 0 for status in JOB_STATUSES}
+        now = time.time()
+        with transaction(self.path, self.timeout, write=False) as conn:
+            rows = conn.execute(
+                "SELECT CASE WHEN status = 'leased' AND lease_expires < ? "
+                "THEN 'pending' ELSE status END, COUNT(*) FROM jobs GROUP BY 1",
+                (now,),
+            ).fetchall()
+        counts.update({status: num for status, num in rows})
+        return counts
+
+    def failed_jobs(self) -> List[Tuple[str, str]]:
+        """Return the (id, error) of the failed jobs."""
+        with transaction(self.path, self.timeout, write=False) as conn:
+            rows = conn.execute(
+                "SELECT id, error FROM jobs WHERE status = 'failed'"
+            ).fetchall()
+        return [(id, error or "") for id, error in rows]
+
+
+# backend name to a factory that opens the queue at a location
+WORK_QUEUE_BACKENDS: Dict[str, Callable[[str], WorkQueue]] = {"sqlite": SQLiteWorkQueue}
+
+
+def open_work_queue(url: str) -> WorkQueue:
+    """Open a work queue from a url such as sqlite:///shared/queue.db.
+
+    A plain path opens a SQLite queue, e.g. /shared/queue.db.
+    """
+    backend, sep, location = url.partition("://")
+    if not sep:
+        backend, location = "sqlite", url
+    if backend not in WORK_QUEUE_BACKENDS:
+        raise ValueError(
+            f"Unknown work queue backend {backend}, "
+            + f"use one of {', '.join(WORK_QUEUE_BACKENDS)}"
+        )
+    return WORK_QUEUE_BACKENDS[backend](location)
+
+
+def run_queue_workers(
+    url: str,
+    run_job: Callable[[bytes], None],
+    num_workers: int,
+    lease_seconds: float,
+    poll_seconds: float = 10.0,
+) -> None:
+    """Run worker processes that run the jobs of a queue until it is finished.
+
+    Args:
+        url (str): the work queue url, see open_work_queue
+        run_job (Callable[[bytes], None]): runs a job with its payload, must be
+            picklable (e.g. a module level function or a partial)
+        num_workers (int): number of worker processes
+        lease_seconds (float): duration of a lease, extended by heartbeats every
+            lease_seconds / 3 while a job runs
+        poll_seconds (float): how often to check for claimable jobs while other
+            workers hold the remaining leases
+    """
+    workers = [
+        Process(
+            target=_queue_worker_task,
+            args=(url, run_job, lease_seconds, poll_seconds),
+            daemon=True,
+        )
+        for _ in range(max(1, num_workers))
+    ]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+
+
+def _queue_worker_task(
+    url: str,
+    run_job: Callable[[bytes], None],
+    lease_seconds: float,
+    poll_seconds: float,
+) -> None:
+    """Worker task that claims and runs jobs until the queue is finished."""
+    queue = open_work_queue(url)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        job = queue.claim(worker_id, lease_seconds)
+        if job is None:
+            if queue.is_finished():
+                return
+            # the remaining jobs are leased, and may be released or expire
+            time.sleep(poll_seconds)
+            continue
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat_task,
+            args=(queue, job.id, worker_id, lease_seconds, stop),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            run_job(job.payload)
+            queue.complete(job.id, worker_id)
+        except BaseException as ex:
+            if job.attempts < job.max_attempts:
+                logger.debug(
+                    f"Will retry ({job.attempts}/{job.max_attempts} attempts so far): "
+                    + f"\nEncountered error while running {job.id}: {ex}"
+                )
+            else:
+                logger.error(f"===\nFailed to run {job.id}:\n>>>\n {ex}\n")
+            queue.release(job.id, worker_id, str(ex))
+            if not isinstance(ex, Exception):
+                raise
+        finally:
+            stop.set()
+            heartbeat.join()
+
+
+def _heartbeat_task(
+    queue: WorkQueue,
+    job_id: str,
+    worker_id: str,
+    lease_seconds: float,
+    stop: threading.Event,
+) -> None:
+    """Extend the lease of a job until stopped."""
+    while not stop.wait(lease_seconds / 3):
+        try:
+            if not queue.heartbeat(job_id, worker_id, lease_seconds):
+                logger.warning(f"Lost the lease of {job_id}, another worker may run it")
+                return
+        except Exception as ex:
+            logger.debug(f"Heartbeat for {job_id} failed: {ex}")
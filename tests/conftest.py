@@ -0,0 +1,69 @@
+"""Fixtures shared by the tests: local stand-ins for HTTP servers and S3."""
+import functools
+import threading
+import uuid
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Tuple
+
+import pytest
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """File server that supports If-Modified-Since, without request logs."""
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Don't log the requests."""
+
+
+@pytest.fixture
+def server_dir(tmp_path: Any) -> Iterator[Tuple[Any, str]]:
+    """Serve a directory over HTTP, yield it with its url."""
+    root = tmp_path / "srv"
+    root.mkdir()
+    handler = functools.partial(_QuietHandler, directory=str(root))
+    server = ThreadingHTTPServer(("localhost", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://localhost:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def s3_endpoint() -> Iterator[str]:
+    """Run a local S3-compatible server (moto) and yield its endpoint url."""
+    moto_server = pytest.importorskip("moto.server")
+    server = moto_server.ThreadedMotoServer(
+        ip_address="127.0.0.1", port=0, verbose=False
+    )
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_bucket(s3_endpoint: str, monkeypatch: Any) -> Iterator[Tuple[str, Any]]:
+    """Create an empty bucket, yield its name with the boto3 client of the server."""
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    client = boto3.client("s3", endpoint_url=s3_endpoint)
+    bucket = f"bucket-{uuid.uuid4().hex[:12]}"
+    client.create_bucket(Bucket=bucket)
+    yield bucket, client
+    for obj in client.list_objects_v2(Bucket=bucket).get("Contents", []):
+        client.delete_object(Bucket=bucket, Key=obj["Key"])
+    client.delete_bucket(Bucket=bucket)
+
+
+@pytest.fixture
+def s3_storage_options(s3_endpoint: str, s3_bucket: Any) -> Dict[str, Any]:
+    """Return the fsspec storage options of the local S3 server."""
+    pytest.importorskip("s3fs")
+    return {
+        "endpoint_url": s3_endpoint,
+        "key": "testing",
+        "secret": "testing",
+        "skip_instance_cache": True,
+    }
@@ -0,0 +1,62 @@
+"""Tests of deduplicating the planned assets."""
+from typing import Any, Dict, List
+
+import pystac
+
+from multiearth.assets import ExtractAsset, ExtractAssetCollection, deduplicate_assets
+
+
+def _asset(id: str, href: str, outfile: str, **kwargs: Any) -> ExtractAsset:
+    """Return an extract asset of an href."""
+    return ExtractAsset(id, "data", "", pystac.Asset(href), outfile, **kwargs)
+
+
+def test_deduplicate_same_href_is_copied() -> None:
+    """Assets with hrefs that only differ by signatures are downloaded once."""
+    first = ExtractAssetCollection()
+    first.add_asset(_asset("a_data", "https://host/a.tif?sig=1&se=2", "/first/a.tif"))
+    second = ExtractAssetCollection()
+    second.add_asset(_asset("a_data", "https://host/a.tif?sig=3", "/second/a.tif"))
+    assert deduplicate_assets([first, second]) == 1
+    assert [ast.outfile for ast in first] == ["/first/a.tif"]
+    assert next(iter(first)).duplicate_outfiles == ["/second/a.tif"]
+    assert len(second) == 0
+
+
+def test_deduplicate_keeps_distinct_query_parameters() -> None:
+    """Hrefs that differ by other query parameters are distinct assets."""
+    coll = ExtractAssetCollection()
+    coll.add_asset(_asset("a_data", "https://host/get?id=1", "/out/a.tif"))
+    coll.add_asset(_asset("b_data", "https://host/get?id=2", "/out/b.tif"))
+    assert deduplicate_assets([coll]) == 0
+    assert len(list(coll)) == 2
+
+
+def test_deduplicate_keeps_differently_processed_assets() -> None:
+    """Assets that are converted or added to datacubes differently are all kept."""
+    href = "https://host/a.tif"
+    variants: List[Dict[str, Any]] = [
+        dict(),
+        dict(convert_to="zarr"),
+        dict(convert_to="zarr", remove_raw=True),
+        dict(cube_store="/cubes/a.zarr"),
+        dict(clip_bounds=(0.0, 0.0, 1.0, 1.0)),
+    ]
+    colls = []
+    for i, kwargs in enumerate(variants):
+        coll = ExtractAssetCollection()
+        coll.add_asset(_asset("a_data", href, f"/out{i}/a.tif", **kwargs))
+        colls.append(coll)
+    assert deduplicate_assets(colls) == 0
+    assert all(
+        len(coll) == 1 and next(iter(coll)).duplicate_outfiles == [] for coll in colls
+    )
+
+
+def test_deduplicate_same_outfile_keeps_first() -> None:
+    """Of different assets with the same outfile, only the first is kept."""
+    coll = ExtractAssetCollection()
+    coll.add_asset(_asset("a_data", "https://host/a.tif", "/out/a.tif"))
+    coll.add_asset(_asset("b_data", "https://host/b.tif", "/out/a.tif"))
+    assert deduplicate_assets([coll]) == 1
+    assert [ast.id for ast in coll] == ["a_data"]
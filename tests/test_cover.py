@@ -0,0 +1,134 @@
+"""Tests of selecting the items that cover an area of interest."""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import pystac
+import shapely.geometry
+
+from multiearth.util.cover import _processing, select_min_cover
+
+# a 2 x 1 degree area of interest
+AOI = shapely.geometry.box(0, 0, 2, 1)
+
+
+def _item(
+    id: str,
+    bounds: Optional[List[float]],
+    properties: Optional[Dict[str, Any]] = None,
+    day: Optional[int] = 1,
+) -> pystac.Item:
+    """Return an item with a box footprint on a day of January 2023."""
+    geometry = (
+        None
+        if bounds is None
+        else shapely.geometry.mapping(shapely.geometry.box(*bounds))
+    )
+    return pystac.Item(
+        id,
+        geometry,
+        bounds,
+        None if day is None else datetime(2023, 1, day, tzinfo=timezone.utc),
+        properties or {},
+    )
+
+
+def _ids(items: List[pystac.Item]) -> List[str]:
+    return [itm.id for itm in items]
+
+
+def test_overlapping_tiles_minimal_cover() -> None:
+    """Tiles that only add covered area are dropped."""
+    items = [
+        _item("left", [0, 0, 1, 1]),
+        _item("middle", [0.5, 0, 1.5, 1]),
+        _item("right", [1, 0, 2, 1]),
+        _item("all", [-1, -1, 3, 2]),
+    ]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["all"]
+    assert _ids(select_min_cover(items[:3], AOI, "day")) == ["left", "right"]
+
+
+def test_cover_per_time_bin() -> None:
+    """Each time bin is covered separately."""
+    items = [
+        _item("day1", [0, 0, 2, 1], day=1),
+        _item("day1-tile", [0, 0, 1, 1], day=1),
+        _item("day2", [0, 0, 2, 1], day=2),
+    ]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["day1", "day2"]
+    assert _ids(select_min_cover(items, AOI, "month")) == ["day1"]
+
+
+def test_reprocessed_duplicates_prefer_latest() -> None:
+    """Of the same footprint, the latest processing version or time is kept."""
+    items = [
+        _item("old", [0, 0, 2, 1], {"s2:processing_baseline": "04.00"}),
+        _item("new", [0, 0, 2, 1], {"s2:processing_baseline": "05.09"}),
+        _item("unversioned", [0, 0, 2, 1]),
+    ]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["new"]
+    items = [
+        _item("updated", [0, 0, 2, 1], {"updated": "2023-03-01T00:00:00Z"}),
+        _item("original", [0, 0, 2, 1], {"updated": "2023-01-02T00:00:00"}),
+    ]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["updated"]
+
+
+def test_processing_compares_versions_numerically() -> None:
+    """Versions compare by their numbers, and versions take priority over times."""
+    assert _processing(_item("a", None, {"processing:version": "2.10"})) > _processing(
+        _item("b", None, {"processing:version": "2.9"})
+    )
+    versioned = _item("v", None, {"processing:version": "1"})
+    updated = _item("u", None, {"updated": "2024-01-01T00:00:00Z"})
+    assert _processing(versioned) > _processing(updated)
+    invalid = _item("i", None, {"updated": "not a time"})
+    assert _processing(updated) > _processing(invalid) > _processing(_item("n", None))
+
+
+def test_cloud_cover_breaks_ties() -> None:
+    """Items adding (nearly) the same area are chosen by the lowest cloud cover."""
+    items = [
+        _item("unknown", [0, 0, 2, 1]),
+        _item("cloudy", [0, 0, 2, 1], {"eo:cloud_cover": 80}),
+        _item("clear", [0, 0, 2, 1], {"eo:cloud_cover": 5}),
+    ]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["clear"]
+    # within the tie tolerance of the most added area, the sliver is covered after
+    items = [
+        _item("cloudy", [0, 0, 2, 1], {"eo:cloud_cover": 80}),
+        _item("clear", [0.01, 0, 2, 1], {"eo:cloud_cover": 5}),
+        _item("sliver", [0, 0, 0.01, 1], {"eo:cloud_cover": 5}),
+    ]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["clear", "sliver"]
+
+
+def test_items_without_geometry_or_datetime_are_kept() -> None:
+    """Items that can't be placed in space or time are always selected."""
+    items = [
+        _item("no-geometry", None),
+        _item("full", [0, 0, 2, 1]),
+        _item("no-datetime", [0, 0, 1, 1]),
+        _item("duplicate", [0, 0, 2, 1]),
+    ]
+    items[2].datetime = None
+    assert _ids(select_min_cover(items, AOI, "day")) == [
+        "no-geometry",
+        "full",
+        "no-datetime",
+    ]
+
+
+def test_items_with_a_datetime_range_use_its_start() -> None:
+    """Items with a null datetime are binned by their start datetime."""
+    ranged = _item(
+        "ranged",
+        [0, 0, 2, 1],
+        {
+            "start_datetime": "2023-01-01T00:00:00Z",
+            "end_datetime": "2023-01-31T00:00:00Z",
+        },
+        day=None,
+    )
+    items = [ranged, _item("day1", [0, 0, 1, 1])]
+    assert _ids(select_min_cover(items, AOI, "day")) == ["ranged"]
@@ -0,0 +1,57 @@
+"""Tests of keeping the EarthData token on redirects between EarthData hosts."""
+import pytest
+import requests
+
+from multiearth.provider.earthdata_auth import EarthDataSession
+
+
+def _redirect_authorization(original: str, redirect: str) -> str:
+    """Return the Authorization header of a redirected request, empty if dropped."""
+    session = EarthDataSession("token")
+    session.trust_env = False
+    response = requests.Response()
+    response.request = session.prepare_request(requests.Request("GET", original))
+    prepared = response.request.copy()
+    prepared.prepare_url(redirect, None)
+    session.rebuild_auth(prepared, response)
+    return str(prepared.headers.get("Authorization", ""))
+
+
+@pytest.mark.parametrize(
+    "original,redirect",
+    [
+        (
+            "https://data.lpdaac.earthdatacloud.nasa.gov/a.tif",
+            "https://urs.earthdata.nasa.gov/oauth/authorize",
+        ),
+        ("https://n5eil01u.ecs.nsidc.org/a.h5", "https://urs.earthdata.nasa.gov/"),
+        ("https://daac.ornl.gov/a.nc", "https://daac.ornl.gov/data/a.nc"),
+        (
+            "https://acdisc.gesdisc.eosdis.nasa.gov/a.nc",
+            "https://urs.earthdata.nasa.gov/",
+        ),
+    ],
+)
+def test_token_kept_between_earthdata_hosts(original: str, redirect: str) -> None:
+    """The token is sent to the DAAC hosts and URS."""
+    assert _redirect_authorization(original, redirect) == "Bearer token"
+
+
+@pytest.mark.parametrize(
+    "redirect",
+    [
+        # other services of the same organizations
+        "https://www.usgs.gov/",
+        "https://webmap.ornl.gov/",
+        "https://podaac-tools.jpl.nasa.gov/",
+        # S3 presigned urls the DAACs redirect to
+        "https://lp-prod-protected.s3.us-west-2.amazonaws.com/a.tif?X-Amz-Signature=1",
+        # not subdomains
+        "https://evildaac.ornl.gov.example.com/",
+        "https://notdaac.ornl.gov/",
+    ],
+)
+def test_token_dropped_on_other_hosts(redirect: str) -> None:
+    """The token is not sent to hosts that aren't EarthData download hosts."""
+    original = "https://data.lpdaac.earthdatacloud.nasa.gov/a.tif"
+    assert _redirect_authorization(original, redirect) == ""
@@ -0,0 +1,190 @@
+"""Tests of applying search filters to items client-side."""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import pystac
+import pytest
+from omegaconf import OmegaConf
+
+from multiearth.api import _check_search_options
+from multiearth.config import CollectionSchema
+from multiearth.util.filter import filter_items, sort_items, unsupported_operators
+
+
+def _item(
+    id: str,
+    day: Optional[int],
+    geometry: Optional[Dict[str, Any]] = None,
+    **properties: Any,
+) -> pystac.Item:
+    """Return an item of a day of January 2023, with a range if day is None."""
+    if day is None:
+        properties.update(
+            start_datetime="2023-01-10T00:00:00Z", end_datetime="2023-01-20T00:00:00Z"
+        )
+    return pystac.Item(
+        id,
+        geometry,
+        None if geometry is None else [0.0, 0.0, 1.0, 1.0],
+        None if day is None else datetime(2023, 1, day, tzinfo=timezone.utc),
+        properties,
+        collection="c",
+    )
+
+
+def _square(x: float) -> Dict[str, Any]:
+    """Return a unit square GeoJSON polygon at x."""
+    return {
+        "type": "Polygon",
+        "coordinates": [[[x, 0], [x + 1, 0], [x + 1, 1], [x, 1], [x, 0]]],
+    }
+
+
+def _ids(items: Any) -> List[str]:
+    return [itm.id for itm in items]
+
+
+@pytest.fixture
+def items() -> List[pystac.Item]:
+    return [
+        _item("a", 5, _square(0), **{"eo:cloud_cover": 30, "platform": "Sentinel-2A"}),
+        _item("b", 15, _square(5), **{"eo:cloud_cover": 5, "platform": "sentinel-2b"}),
+        _item("c", None, None, **{"eo:cloud_cover": 5, "instruments": ["msi", "sar"]}),
+        _item("d", 25, _square(0.5), platform="Landsat-9", instruments=["oli"]),
+    ]
+
+
+@pytest.mark.parametrize(
+    "cql2, expected",
+    [
+        ({"op": "<", "args": [{"property": "eo:cloud_cover"}, 10]}, ["b", "c"]),
+        (
+            {
+                "op": "and",
+                "args": [
+                    {"op": "=", "args": [{"property": "eo:cloud_cover"}, 5]},
+                    {
+                        "op": "not",
+                        "args": [{"op": "isNull", "args": [{"property": "platform"}]}],
+                    },
+                ],
+            },
+            ["b"],
+        ),
+        ({"op": "isNull", "args": [{"property": "eo:cloud_cover"}]}, ["d"]),
+        ({"op": "like", "args": [{"property": "platform"}, "Sentinel-2_"]}, ["a"]),
+        (
+            {
+                "op": "like",
+                "args": [{"casei": {"property": "platform"}}, {"casei": "SENTINEL%"}],
+            },
+            ["a", "b"],
+        ),
+        (
+            {"op": "between", "args": [{"property": "eo:cloud_cover"}, 1, 10]},
+            ["b", "c"],
+        ),
+        ({"op": "in", "args": [{"property": "id"}, ["a", "d", "z"]]}, ["a", "d"]),
+        (
+            {"op": "s_intersects", "args": [{"property": "geometry"}, _square(0.9)]},
+            ["a", "d"],
+        ),
+        ({"op": "s_within", "args": [{"property": "geometry"}, _square(5)]}, ["b"]),
+        (
+            {
+                "op": "t_after",
+                "args": [
+                    {"property": "datetime"},
+                    {"timestamp": "2023-01-12T00:00:00Z"},
+                ],
+            },
+            ["b", "d"],
+        ),
+        (
+            {
+                "op": "t_intersects",
+                "args": [
+                    {"property": "datetime"},
+                    {"interval": ["2023-01-18T00:00:00Z", ".."]},
+                ],
+            },
+            ["c", "d"],
+        ),
+        (
+            {
+                "op": "t_during",
+                "args": [
+                    {"property": "datetime"},
+                    {"interval": ["2023-01-01T00:00:00Z", "2023-01-16T00:00:00Z"]},
+                ],
+            },
+            ["a", "b"],
+        ),
+        ({"op": "a_contains", "args": [{"property": "instruments"}, ["sar"]]}, ["c"]),
+        (
+            {"op": "a_overlaps", "args": [{"property": "instruments"}, ["oli", "tm"]]},
+            ["d"],
+        ),
+    ],
+)
+def test_filter_items(
+    items: List[pystac.Item], cql2: Dict[str, Any], expected: List[str]
+) -> None:
+    """CQL2 filters match the items a STAC API would return."""
+    assert _ids(filter_items(items, filter=cql2)) == expected
+
+
+def test_filter_items_query_sort_and_limit(items: List[pystac.Item]) -> None:
+    """Queries, sorting and the item limit are applied together."""
+    query: Dict[str, Dict[str, Any]] = {
+        "eo:cloud_cover": {"lte": 30},
+        "id": {"neq": "c"},
+    }
+    assert _ids(filter_items(items, query=query)) == ["a", "b"]
+    matching = filter_items(items, query=query, sortby=["+eo:cloud_cover"], max_items=1)
+    assert _ids(matching) == ["b"]
+
+
+def test_filter_items_unsupported_operator(items: List[pystac.Item]) -> None:
+    """Operators that can't be evaluated raise ValueError."""
+    with pytest.raises(ValueError, match="Unsupported CQL2 operator"):
+        list(filter_items(items, filter={"op": "unknown", "args": [1, 2]}))
+    with pytest.raises(ValueError, match="Unsupported query operator"):
+        list(filter_items(items, query={"eo:cloud_cover": {"near": 1}}))
+
+
+def test_sort_items(items: List[pystac.Item]) -> None:
+    """Items sort by several fields, with missing values last."""
+    assert _ids(sort_items(items, ["eo:cloud_cover", "-id"])) == ["c", "b", "a", "d"]
+    assert _ids(sort_items(items, "-datetime")) == ["d", "b", "c", "a"]
+    sortby = [{"field": "properties.platform", "direction": "desc"}]
+    assert _ids(sort_items(items, sortby)) == ["b", "a", "d", "c"]
+
+
+def test_unsupported_operators() -> None:
+    """Nested unsupported operators of filters and queries are found."""
+    cql2 = {
+        "op": "and",
+        "args": [
+            {
+                "op": "T_AFTER",
+                "args": [{"property": "datetime"}, {"timestamp": "2023-01-01"}],
+            },
+            {"op": "not", "args": [{"op": "fuzzy", "args": [{"property": "id"}, "a"]}]},
+        ],
+    }
+    assert unsupported_operators("filter", cql2) == {"fuzzy"}
+    query = {"eo:cloud_cover": {"lt": 10, "near": 5}}
+    assert unsupported_operators("query", query) == {"near"}
+    assert unsupported_operators("sortby", ["-datetime"]) == set()
+
+
+def test_check_search_options() -> None:
+    """Configs with filters that can't be applied client-side are rejected."""
+    collection: Any = OmegaConf.structured(CollectionSchema)
+    collection.id = "c"
+    collection.filter = {"op": "<", "args": [{"property": "eo:cloud_cover"}, 10]}
+    _check_search_options(collection)
+    collection.filter = {"op": "fuzzy", "args": [{"property": "id"}, "a"]}
+    with pytest.raises(ValueError, match="Unsupported filter operators for c: fuzzy"):
+        _check_search_options(collection)
@@ -0,0 +1,59 @@
+"""Tests of requesting Metloom station data."""
+import time
+from datetime import datetime
+from typing import Any, List
+
+import pytest
+from omegaconf import OmegaConf
+
+from multiearth.config import ConfigSchema, ProviderKey
+from multiearth.provider.metloom import MetloomProvider
+
+
+class _FlakyClient:
+    """Station client whose first requests fail."""
+
+    id = "station"
+
+    def __init__(self, num_failures: int) -> None:
+        self.num_failures = num_failures
+
+    def get_daily_data(self, start: datetime, end: datetime, variables: Any) -> str:
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise ConnectionError("rate limited")
+        return "data"
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    """Record the retry delays instead of sleeping."""
+    delays: List[float] = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    return delays
+
+
+def _provider() -> MetloomProvider:
+    cfg: Any = OmegaConf.structured(ConfigSchema)
+    cfg.system.max_download_attempts = 3
+    return MetloomProvider(ProviderKey.METLOOM, cfg, [])
+
+
+def test_fetch_retries_with_exponential_backoff(sleeps: List[float]) -> None:
+    """Failed requests are retried after exponentially longer delays."""
+    client: Any = _FlakyClient(2)
+    data = _provider()._fetch_with_retries(
+        client, datetime(2023, 1, 1), datetime(2023, 2, 1), []
+    )
+    assert data == "data"
+    assert sleeps == [2, 4]
+
+
+def test_fetch_raises_after_last_attempt(sleeps: List[float]) -> None:
+    """The error of the last attempt is raised without another delay."""
+    client: Any = _FlakyClient(3)
+    with pytest.raises(ConnectionError):
+        _provider()._fetch_with_retries(
+            client, datetime(2023, 1, 1), datetime(2023, 2, 1), []
+        )
+    assert sleeps == [2, 4]
@@ -0,0 +1,97 @@
+"""Tests of writing and reading download plans."""
+from typing import Any
+
+import pystac
+import pytest
+
+from multiearth.assets import ExtractAsset
+from multiearth.util.plan import (
+    asset_to_record,
+    read_plan,
+    read_plan_config,
+    record_to_asset,
+    write_plan,
+)
+
+CONFIG_YAML = "system:\n  dry_run: false\n"
+
+
+def _assets() -> Any:
+    """Return planned assets, one with everything set and one with the defaults."""
+    asset = pystac.Asset(
+        "https://host/a.tif",
+        media_type=pystac.MediaType.COG,
+        extra_fields={"alternate": {"s3": {"href": "s3://bucket/a.tif"}}},
+    )
+    full = ExtractAsset(
+        id="item_data",
+        asset_name="data",
+        dtype="uint16",
+        asset=asset,
+        outfile="/out/item/a.tif",
+        filesize_mb=12,
+        provider_name="EarthData",
+        collection_name="HLSL30.v2.0",
+        clip_bounds=(-120.5, 35.0, -119.0, 36.25),
+        convert_to="cog",
+        remove_raw=True,
+        datetime="2023-01-01T00:00:00Z",
+        cube_store="/cubes/hls.zarr",
+        duplicate_outfiles=["/other/item/a.tif", "s3://bucket/out/a.tif"],
+    )
+    plain = ExtractAsset(
+        "item_labels", "labels", "", pystac.Asset("https://host/b.json"), "/out/b.json"
+    )
+    return [full, plain]
+
+
+@pytest.mark.parametrize("suffix", ["plan.jsonl.gz", "plan.parquet"])
+def test_plan_round_trip(tmp_path: Any, suffix: str) -> None:
+    """Planned assets are read back with all of their fields."""
+    if suffix.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / suffix)
+    assets = _assets()
+    write_plan(
+        path,
+        [asset_to_record(ast, i, "EARTHDATA") for i, ast in enumerate(assets)],
+        CONFIG_YAML,
+    )
+    assert read_plan_config(path) == CONFIG_YAML
+    records, config_yaml = read_plan(path)
+    assert config_yaml == CONFIG_YAML
+    assert [(r["provider_index"], r["provider"]) for r in records] == [
+        (0, "EARTHDATA"),
+        (1, "EARTHDATA"),
+    ]
+    for ast, record in zip(assets, records):
+        read = record_to_asset(record)
+        for name in [
+            "id",
+            "asset_name",
+            "dtype",
+            "outfile",
+            "filesize_mb",
+            "provider_name",
+            "collection_name",
+            "clip_bounds",
+            "convert_to",
+            "remove_raw",
+            "datetime",
+            "cube_store",
+            "duplicate_outfiles",
+        ]:
+            assert getattr(read, name) == getattr(ast, name), name
+        assert read.asset.to_dict() == ast.asset.to_dict()
+
+    full = record_to_asset(records[0])
+    assert full.clip_bounds == (-120.5, 35.0, -119.0, 36.25)
+    assert full.duplicate_outfiles == ["/other/item/a.tif", "s3://bucket/out/a.tif"]
+    assert full.asset.extra_fields["alternate"]["s3"]["href"] == "s3://bucket/a.tif"
+
+
+def test_empty_plan_round_trip(tmp_path: Any) -> None:
+    """A plan without assets still has its config."""
+    path = str(tmp_path / "plan.jsonl.gz")
+    write_plan(path, [], CONFIG_YAML)
+    assert read_plan(path) == ([], CONFIG_YAML)
@@ -0,0 +1,107 @@
+"""Tests of extracting Radiant MLHub datasets from their catalog archives."""
+import io
+import json
+import os
+import tarfile
+from typing import Any, Dict, Tuple
+
+import pytest
+from omegaconf import OmegaConf
+
+from multiearth.config import CollectionSchema, ConfigSchema, ProviderKey
+from multiearth.provider.radiant_ml import RadiantMLHub
+from multiearth.util import convert
+
+
+def _add(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    """Add a file to a tar archive."""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _item(url: str) -> Dict[str, Any]:
+    """Return an item with a label next to it and an image on the server."""
+    return {
+        "type": "Feature",
+        "stac_version": "1.0.0",
+        "id": "item",
+        "geometry": {"type": "Point", "coordinates": [0, 0]},
+        "bbox": [0, 0, 0, 0],
+        "properties": {"datetime": "2021-01-01T00:00:00Z"},
+        "links": [],
+        "assets": {
+            "labels": {"href": "./labels.geojson"},
+            "image": {"href": f"{url}/image.tif"},
+        },
+    }
+
+
+def _provider(
+    server_dir: Tuple[Any, str], tmp_path: Any, **kwargs: Any
+) -> RadiantMLHub:
+    """Return a provider of a dataset served with an item and its catalog."""
+    root, url = server_dir
+    (root / "image.tif").write_bytes(b"image")
+    # checked by check_authorization
+    (root / "search").write_text("{}")
+    (root / "catalog").mkdir()
+    with tarfile.open(root / "catalog" / "ds", "w:gz") as tar:
+        _add(tar, "ds/catalog.json", json.dumps({"type": "Catalog"}).encode())
+        _add(tar, "ds/item/item.json", json.dumps(_item(url)).encode())
+        _add(tar, "ds/item/labels.geojson", b'{"type": "FeatureCollection"}')
+
+    cfg: Any = OmegaConf.structured(ConfigSchema)
+    cfg.run_id = "test"
+    cfg.system.cache_dir = str(tmp_path / "cache")
+    cfg.system.log_outdir = str(tmp_path / "logs")
+    cfg.system.max_concurrent_extractions = 1
+    cfg.system.max_download_attempts = 1
+    os.makedirs(cfg.system.log_outdir)
+    collection: Any = OmegaConf.merge(
+        OmegaConf.structured(CollectionSchema),
+        {
+            "id": "ds",
+            "assets": ["labels", "image"],
+            "outdir": str(tmp_path / "out"),
+            "datetime": "2020-01-01/2022-01-01",
+        },
+        kwargs,
+    )
+    return RadiantMLHub(ProviderKey.RADIANT, cfg, [collection], url, api_key="key")
+
+
+def test_extract_catalog_assets(server_dir: Tuple[Any, str], tmp_path: Any) -> None:
+    """The catalog is fetched from client_url and relative hrefs are copied."""
+    pvdr = _provider(server_dir, tmp_path)
+    assert pvdr.extract_assets()
+    item_dir = tmp_path / "out" / "ds" / "item"
+    assert (
+        item_dir / "labels.geojson"
+    ).read_bytes() == b'{"type": "FeatureCollection"}'
+    assert (item_dir / "image.tif").read_bytes() == b"image"
+    # items are only read from the cached catalog
+    assert not (tmp_path / "cache" / "radiant" / "ds" / "ds.tar.gz").exists()
+
+
+def _to_upper(outfile: str, converted: str) -> None:
+    """Convert a file to upper case, with the pid of the converting process."""
+    with open(outfile, "rb") as src, open(converted, "wb") as dst:
+        dst.write(src.read().upper() + f" {os.getpid()}".encode())
+
+
+def test_iter_assets_converts_in_pool(
+    server_dir: Tuple[Any, str], tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Iterated assets are yielded once converted in the conversion processes."""
+    # the forked conversion processes inherit the converter
+    monkeypatch.setitem(convert._CONVERTERS, "cog", _to_upper)
+    pvdr = _provider(server_dir, tmp_path, convert_to="cog")
+    assets = list(pvdr.iter_assets(prefetch=1))
+    assert sorted(ast.id for ast in assets) == ["item_image", "item_labels"]
+    for ast in assets:
+        with open(ast.converted_outfile, "rb") as f:
+            data, pid = f.read().rsplit(b" ", 1)
+        with open(ast.outfile, "rb") as f:
+            assert data == f.read().upper()
+        assert int(pid) != os.getpid()
@@ -0,0 +1,80 @@
+"""Tests of refreshing existing assets that changed remotely (system.refresh)."""
+import datetime
+import os
+from typing import Any, Iterator
+
+import pystac
+from omegaconf import OmegaConf
+
+from multiearth.config import CollectionSchema, ConfigSchema, ProviderKey
+from multiearth.provider.stac import STACProvider
+
+
+class _FileProvider(STACProvider):
+    """Provider with one item whose data asset is a file on the test server."""
+
+    description = "Test"
+    _default_client_url = "http://localhost"
+
+    def __init__(self, url: str, *args: Any, **kwargs: Any) -> None:
+        self.url = url
+        super().__init__(*args, **kwargs)
+
+    def _region_to_items(self, *args: Any, **kwargs: Any) -> Iterator[pystac.Item]:
+        itm = pystac.Item(
+            "item",
+            {"type": "Point", "coordinates": [0, 0]},
+            [0, 0, 0, 0],
+            datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+            {},
+            collection="coll",
+        )
+        itm.add_asset("data", pystac.Asset(f"{self.url}/data.bin?sig=signature"))
+        return iter([itm])
+
+
+def _extract(
+    url: str, tmp_path: Any, outdir: str, refresh: bool, dry_run: bool = False
+) -> str:
+    """Extract the asset of a new provider and return the content of its outfile."""
+    cfg: Any = OmegaConf.structured(ConfigSchema)
+    cfg.run_id = "test"
+    cfg.system.cache_dir = str(tmp_path / "cache")
+    cfg.system.log_outdir = str(tmp_path / "logs")
+    cfg.system.asset_cache_size_gb = 1.0
+    cfg.system.max_concurrent_extractions = 1
+    cfg.system.max_download_attempts = 1
+    cfg.system.refresh = refresh
+    os.makedirs(cfg.system.log_outdir, exist_ok=True)
+    collection = OmegaConf.merge(
+        OmegaConf.structured(CollectionSchema),
+        {"id": "coll", "assets": ["data"], "outdir": str(tmp_path / outdir)},
+    )
+    pvdr = _FileProvider(url, ProviderKey.MPC, cfg, [collection])
+    assert pvdr.extract_assets(dry_run=dry_run)
+    with open(tmp_path / outdir / "coll" / "item" / "data.bin") as f:
+        return f.read()
+
+
+def test_refresh_downloads_changed_asset_of_same_size(
+    server_dir: Any, tmp_path: Any
+) -> None:
+    """A changed asset of the same size is downloaded again, not linked from cache."""
+    root, url = server_dir
+    data = root / "data.bin"
+    data.write_text("a" * 1000)
+    modified = datetime.datetime(2023, 1, 1).timestamp()
+    os.utime(data, (modified, modified))
+    assert _extract(url, tmp_path, "out", refresh=False) == "a" * 1000
+
+    # reprocessed with the same size
+    data.write_text("b" * 1000)
+    os.utime(data, (modified + 3600, modified + 3600))
+    # a dry run only finds the change, it keeps the outfile and the cached object
+    assert _extract(url, tmp_path, "out", refresh=True, dry_run=True) == "a" * 1000
+    objects = tmp_path / "cache" / "assets" / "objects"
+    assert any(p.is_file() for p in objects.rglob("*"))
+    assert _extract(url, tmp_path, "out", refresh=True) == "b" * 1000
+
+    # the cached object was replaced by the new download
+    assert _extract(url, tmp_path, "other_out", refresh=False) == "b" * 1000
@@ -0,0 +1,226 @@
+"""Tests of ranged S3 downloads and the EarthData S3 fallback, against a local S3 server."""
+import datetime
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Tuple, cast
+
+import pystac
+import pytest
+
+from multiearth.assets import ExtractAsset
+from multiearth.provider import earthdata
+from multiearth.provider.earthdata_auth import EarthDataAuth
+from multiearth.provider.stac import _asset_to_download_url
+from multiearth.util.s3 import s3_ranged_download
+
+MB = 1024 * 1024
+# not a multiple of the part size, so the last part is short
+DATA = bytes(range(256)) * (MB * 5 // 2 // 256) + b"end"
+
+
+class _TruncatingClient:
+    """S3 client that returns one byte less for the ranged request of one part."""
+
+    def __init__(self, client: Any, short_start: int) -> None:
+        self.client = client
+        self.short_start = short_start
+        self.ranges: List[str] = []
+
+    def head_object(self, **kwargs: Any) -> Any:
+        """Return the metadata of the object."""
+        return self.client.head_object(**kwargs)
+
+    def get_object(self, **kwargs: Any) -> Any:
+        """Return the object, short for the range starting at short_start."""
+        self.ranges.append(kwargs["Range"])
+        response = self.client.get_object(**kwargs)
+        if kwargs["Range"].startswith(f"bytes={self.short_start}-"):
+            body = response["Body"].read()
+            response["Body"] = _Body(body[:-1])
+        return response
+
+
+class _Body:
+    """Readable body of a GetObject response."""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes."""
+        size = len(self.data) if size < 0 else size
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+@pytest.fixture
+def s3_object(s3_bucket: Tuple[str, Any]) -> Tuple[str, Any]:
+    """Put DATA into the bucket, return its url with the boto3 client."""
+    bucket, client = s3_bucket
+    client.put_object(Bucket=bucket, Key="granule/data.h5", Body=DATA)
+    return f"s3://{bucket}/granule/data.h5", client
+
+
+def test_ranged_download_parts(s3_object: Tuple[str, Any], tmp_path: Any) -> None:
+    """Parts cover the object exactly and the validators describe it."""
+    url, client = s3_object
+    outfile = tmp_path / "out" / "data.h5"
+    spy = _TruncatingClient(client, short_start=-1)
+    validators = s3_ranged_download(
+        spy, url, str(outfile), part_size_mb=1, max_concurrency=2
+    )
+    assert outfile.read_bytes() == DATA
+    assert sorted(spy.ranges) == [
+        f"bytes=0-{MB - 1}",
+        f"bytes={MB}-{2 * MB - 1}",
+        f"bytes={2 * MB}-{len(DATA) - 1}",
+    ]
+    assert validators["Content-Length"] == str(len(DATA))
+    assert validators["ETag"] and validators["Last-Modified"]
+    assert os.listdir(outfile.parent) == ["data.h5"]
+
+
+def test_ranged_download_to_s3(
+    s3_object: Tuple[str, Any], s3_storage_options: Dict[str, Any]
+) -> None:
+    """Parts are streamed in order to a remote outfile."""
+    url, client = s3_object
+    bucket = url.split("/")[2]
+    s3_ranged_download(
+        client,
+        url,
+        f"s3://{bucket}/copy/data.h5",
+        s3_storage_options,
+        part_size_mb=1,
+        max_concurrency=2,
+    )
+    assert client.get_object(Bucket=bucket, Key="copy/data.h5")["Body"].read() == DATA
+
+
+@pytest.mark.parametrize("remote", [False, True])
+def test_ranged_download_fails_on_short_part(
+    s3_object: Tuple[str, Any],
+    s3_storage_options: Dict[str, Any],
+    tmp_path: Any,
+    remote: bool,
+) -> None:
+    """A short part fails the download without leaving an outfile or a tmp file."""
+    url, client = s3_object
+    bucket = url.split("/")[2]
+    outfile = f"s3://{bucket}/copy/data.h5" if remote else str(tmp_path / "data.h5")
+    with pytest.raises(OSError, match="bytes 1048576-2097151"):
+        s3_ranged_download(
+            _TruncatingClient(client, short_start=MB),
+            url,
+            outfile,
+            s3_storage_options,
+            part_size_mb=1,
+        )
+    assert os.listdir(tmp_path) == []
+    keys = [o["Key"] for o in client.list_objects_v2(Bucket=bucket)["Contents"]]
+    assert keys == ["granule/data.h5"]
+
+
+class _DeniedHandler(BaseHTTPRequestHandler):
+    """s3credentials endpoint that denies the credentials."""
+
+    def do_GET(self) -> None:
+        """Respond with 403 Forbidden."""
+        self.send_error(403)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Don't log the requests."""
+
+
+@pytest.fixture
+def denied_url() -> Iterator[str]:
+    """Serve an s3credentials endpoint that denies access, yield its url."""
+    server = ThreadingHTTPServer(("localhost", 0), _DeniedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://localhost:{server.server_address[1]}/s3credentials"
+    server.shutdown()
+
+
+@pytest.fixture
+def auth(tmp_path: Any, monkeypatch: Any) -> EarthDataAuth:
+    """Return EarthData auth with a cached token, and fresh per-process S3 state."""
+    monkeypatch.setattr(earthdata, "_s3_clients", {})
+    monkeypatch.setattr(earthdata, "_s3_disabled", set())
+    auth = EarthDataAuth(str(tmp_path / "cache"))
+    os.makedirs(os.path.dirname(auth.token_file))
+    expiration = datetime.datetime.now() + datetime.timedelta(days=30)
+    with open(auth.token_file, "w") as f:
+        json.dump({"token": "token", "expiration": expiration.isoformat()}, f)
+    return auth
+
+
+def _download(
+    auth: EarthDataAuth, https_url: str, s3_url: str, outfile: str, **kwargs: Any
+) -> bytes:
+    """Download an asset with an S3 alternate href and return its content."""
+    asset = pystac.Asset(
+        https_url, extra_fields={"alternate": {"s3": {"href": s3_url}}}
+    )
+    ast = ExtractAsset("item_data", "data", "", asset, outfile)
+    earthdata._earthdata_download_fn(
+        asset_to_download_url=_asset_to_download_url, ast=ast, auth=auth, **kwargs
+    )
+    with open(outfile, "rb") as f:
+        return f.read()
+
+
+def test_earthdata_download_falls_back_to_https(
+    auth: EarthDataAuth,
+    s3_object: Tuple[str, Any],
+    s3_endpoint: str,
+    server_dir: Tuple[Any, str],
+    tmp_path: Any,
+) -> None:
+    """A transient S3 failure falls back to HTTPS only for the failed asset."""
+    url, _ = s3_object
+    root, https_url = server_dir
+    (root / "data.h5").write_bytes(b"https")
+    kwargs = dict(s3_endpoint_url=s3_endpoint)
+    missing = url.replace("data.h5", "missing.h5")
+    outfile = str(tmp_path / "out" / "data.h5")
+    assert _download(auth, f"{https_url}/data.h5", missing, outfile, **kwargs) == (
+        b"https"
+    )
+    assert len(earthdata._s3_disabled) == 0
+    assert _download(auth, f"{https_url}/data.h5", url, outfile, **kwargs) == DATA
+
+
+def test_earthdata_download_disables_denied_s3(
+    auth: EarthDataAuth,
+    s3_object: Tuple[str, Any],
+    s3_endpoint: str,
+    server_dir: Tuple[Any, str],
+    denied_url: str,
+    tmp_path: Any,
+) -> None:
+    """Denied S3 credentials fall back to HTTPS and disable S3 for the worker."""
+    url, _ = s3_object
+    root, https_url = server_dir
+    (root / "data.h5").write_bytes(b"https")
+    kwargs = dict(s3_credentials_url=denied_url, s3_endpoint_url=s3_endpoint)
+    outfile = str(tmp_path / "out" / "data.h5")
+    assert _download(auth, f"{https_url}/data.h5", url, outfile, **kwargs) == (b"https")
+    assert earthdata._s3_disabled == {(denied_url, s3_endpoint)}
+
+
+def test_is_permanent_s3_error() -> None:
+    """Only missing boto3 and denied access are permanent S3 errors."""
+    exceptions = pytest.importorskip("botocore.exceptions")
+
+    def client_error(code: str) -> Exception:
+        error = {"Error": {"Code": code, "Message": ""}}
+        return cast(Exception, exceptions.ClientError(error, "GetObject"))
+
+    assert earthdata._is_permanent_s3_error(ImportError("boto3"))
+    assert earthdata._is_permanent_s3_error(client_error("AccessDenied"))
+    assert earthdata._is_permanent_s3_error(client_error("InvalidAccessKeyId"))
+    assert not earthdata._is_permanent_s3_error(client_error("NoSuchKey"))
+    assert not earthdata._is_permanent_s3_error(client_error("SlowDown"))
+    assert not earthdata._is_permanent_s3_error(TimeoutError())
@@ -0,0 +1,111 @@
+"""Tests of writing outputs to object storage, against a local S3 server."""
+from typing import Any, Dict, Tuple
+
+import pystac
+import pytest
+
+from multiearth.assets import DownloadWrapper, ExtractAsset
+from multiearth.provider.stac import _asset_to_download_url, _download_wrapper_fn
+from multiearth.util.sink import copy_output, existing_output_sizes, open_output
+
+MB = 1024 * 1024
+
+
+def _read(client: Any, bucket: str, key: str) -> bytes:
+    """Return the content of an object."""
+    return bytes(client.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+
+def test_open_output_streams_upload(
+    s3_bucket: Tuple[str, Any], s3_storage_options: Dict[str, Any]
+) -> None:
+    """An output larger than the block size is uploaded in parts and committed."""
+    bucket, client = s3_bucket
+    options = dict(s3_storage_options, default_block_size=5 * MB)
+    data = b"a" * (12 * MB)
+    with open_output(f"s3://{bucket}/out/data.bin", options) as f:
+        for i in range(0, len(data), MB):
+            f.write(data[i : i + MB])
+    assert _read(client, bucket, "out/data.bin") == data
+
+
+def test_open_output_aborts_failed_upload(
+    s3_bucket: Tuple[str, Any], s3_storage_options: Dict[str, Any]
+) -> None:
+    """A failed write leaves neither an object nor an unfinished multipart upload."""
+    bucket, client = s3_bucket
+    options = dict(s3_storage_options, default_block_size=5 * MB)
+    with pytest.raises(RuntimeError):
+        with open_output(f"s3://{bucket}/out/data.bin", options) as f:
+            # more than a block, so parts are already uploaded
+            f.write(b"a" * (11 * MB))
+            raise RuntimeError("download failed")
+    assert "Contents" not in client.list_objects_v2(Bucket=bucket)
+    assert "Uploads" not in client.list_multipart_uploads(Bucket=bucket)
+
+
+def test_existing_output_sizes_across_prefixes(
+    s3_bucket: Tuple[str, Any], s3_storage_options: Dict[str, Any], tmp_path: Any
+) -> None:
+    """Outputs under different prefixes are found by one listing of their bucket."""
+    bucket, client = s3_bucket
+    client.put_object(Bucket=bucket, Key="first/coll/item/a.tif", Body=b"a" * 10)
+    client.put_object(Bucket=bucket, Key="second/coll/item/b.tif", Body=b"b" * 20)
+    # not an output of the run
+    client.put_object(Bucket=bucket, Key="second/coll/item/c.tif", Body=b"c")
+    local = tmp_path / "d.tif"
+    local.write_bytes(b"d" * 5)
+    paths = [
+        f"s3://{bucket}/first/coll/item/a.tif",
+        f"s3://{bucket}/second/coll/item/b.tif",
+        f"s3://{bucket}/second/coll/item/missing.tif",
+        str(local),
+        str(tmp_path / "missing.tif"),
+    ]
+    assert existing_output_sizes(paths, s3_storage_options) == {
+        f"s3://{bucket}/first/coll/item/a.tif": 10,
+        f"s3://{bucket}/second/coll/item/b.tif": 20,
+        str(local): 5,
+    }
+
+
+def test_download_fans_out_to_s3_duplicates(
+    server_dir: Tuple[Any, str],
+    s3_bucket: Tuple[str, Any],
+    s3_storage_options: Dict[str, Any],
+    tmp_path: Any,
+) -> None:
+    """A download is streamed to S3 and copied to its duplicates, local and S3."""
+    root, url = server_dir
+    data = b"x" * (2 * MB + 1)
+    (root / "data.bin").write_bytes(data)
+    bucket, client = s3_bucket
+    ast = ExtractAsset(
+        id="item_data",
+        asset_name="data",
+        dtype="",
+        asset=pystac.Asset(f"{url}/data.bin"),
+        outfile=f"s3://{bucket}/first/coll/item/data.bin",
+        duplicate_outfiles=[
+            f"s3://{bucket}/second/coll/item/data.bin",
+            str(tmp_path / "third" / "data.bin"),
+        ],
+    )
+    dwrap = DownloadWrapper(
+        asset=ast,
+        download_func=_download_wrapper_fn,
+        download_kwargs=dict(
+            ast=ast,
+            asset_to_download_url=_asset_to_download_url,
+            storage_options=s3_storage_options,
+        ),
+    )
+    dwrap()
+    assert _read(client, bucket, "first/coll/item/data.bin") == data
+    assert _read(client, bucket, "second/coll/item/data.bin") == data
+    assert (tmp_path / "third" / "data.bin").read_bytes() == data
+    assert ast.validators["Content-Length"] == str(len(data))
+
+    # copies from S3 outputs, e.g. to the duplicates of earlier downloads
+    copy_output(ast.outfile, f"s3://{bucket}/fourth/data.bin", s3_storage_options)
+    assert _read(client, bucket, "fourth/data.bin") == data
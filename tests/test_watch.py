@@ -0,0 +1,105 @@
+"""Tests of the high-water marks of watched collections."""
+import re
+from typing import Any, List
+
+import pytest
+from omegaconf import OmegaConf
+
+from multiearth import api
+from multiearth.config import ConfigSchema
+from multiearth.provider.base import BaseProvider
+from multiearth.util.watch import WatchState, advance_mark
+
+
+def test_advance_mark_to_latest_extracted() -> None:
+    """The mark advances to the latest extracted time and its assets are seen."""
+    extracted = [
+        ("a", "2023-01-01T00:00:00Z"),
+        ("b", "2023-01-03T00:00:00+00:00"),
+        ("c", "2023-01-03T00:00:00Z"),
+    ]
+    mark, seen = advance_mark("2022-12-31T00:00:00Z", {"z"}, extracted, [])
+    assert mark == "2023-01-03T00:00:00Z"
+    assert seen == {"b", "c"}
+
+
+def test_advance_mark_stops_at_earliest_failure() -> None:
+    """The mark doesn't pass a failed asset, so the next poll finds it again."""
+    extracted = [("a", "2023-01-01T00:00:00Z"), ("c", "2023-01-05T00:00:00Z")]
+    failed = [("b", "2023-01-04T00:00:00Z"), ("d", "2023-01-02T00:00:00Z")]
+    mark, seen = advance_mark("", set(), extracted, failed)
+    assert mark == "2023-01-02T00:00:00Z"
+    assert seen == set()
+
+
+def test_advance_mark_failed_before_mark_keeps_it() -> None:
+    """A failure before the current mark doesn't move the mark backwards."""
+    extracted = [("c", "2023-01-05T00:00:00Z")]
+    failed = [("b", "2023-01-01T00:00:00Z")]
+    mark, seen = advance_mark("2023-01-03T00:00:00Z", {"a"}, extracted, failed)
+    assert (mark, seen) == ("2023-01-03T00:00:00Z", {"a"})
+
+
+def test_advance_mark_equal_mark_merges_seen() -> None:
+    """Assets extracted at the current mark are added to the seen ones."""
+    extracted = [("b", "2023-01-03T00:00:00Z"), ("x", "")]
+    mark, seen = advance_mark("2023-01-03T00:00:00Z", {"a"}, extracted, [])
+    assert mark == "2023-01-03T00:00:00Z"
+    assert seen == {"a", "b"}
+
+
+def test_advance_mark_without_times_keeps_it() -> None:
+    """Polls without any timed assets keep the mark and its seen assets."""
+    assert advance_mark("2023-01-03T00:00:00Z", {"a"}, [("x", "")], []) == (
+        "2023-01-03T00:00:00Z",
+        {"a"},
+    )
+
+
+def test_watch_state_round_trip(tmp_path: Any) -> None:
+    """Marks are stored per collection."""
+    state = WatchState(str(tmp_path / "watch.db"))
+    assert state.get("c") == ("", set())
+    state.put("c", "2023-01-03T00:00:00Z", {"a", "b"})
+    assert WatchState(str(tmp_path / "watch.db")).get("c") == (
+        "2023-01-03T00:00:00Z",
+        {"a", "b"},
+    )
+
+
+class _Provider(BaseProvider):
+    """Provider that records its calls."""
+
+    description = "Test Provider"
+
+    def __init__(self, supports_watch: bool) -> None:
+        self.supports_watch = supports_watch
+        self.calls: List[str] = []
+
+    def check_authorization(self) -> bool:
+        return True
+
+    def extract_assets(self, dry_run: bool = False) -> bool:
+        self.calls.append("extract")
+        return True
+
+    def poll_assets(self, state: WatchState, dry_run: bool = False) -> bool:
+        self.calls.append("poll")
+        return True
+
+
+def test_watch_skips_providers_without_watch(
+    tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Only the providers that support watch are polled."""
+    watched, unwatched = _Provider(True), _Provider(False)
+    monkeypatch.setattr(api, "_initialize_providers", lambda cfg: [watched, unwatched])
+    cfg: Any = OmegaConf.structured(ConfigSchema)
+    cfg.system.log_outdir = str(tmp_path / "logs")
+    cfg.system.cache_dir = str(tmp_path / "cache")
+    cfg.system.watch_interval_seconds = 0.0
+    assert api.watch(cfg, max_polls=2)
+    assert watched.calls == ["poll", "poll"]
+    assert unwatched.calls == []
+    # the run id has the hour, minutes and seconds the run started at
+    assert re.fullmatch(r"_\d{4}-\d{2}-\d{2}-\d{6}_watch", cfg.run_id)
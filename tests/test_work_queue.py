@@ -0,0 +1,78 @@
+"""Tests of distributing downloads through the shared work queue."""
+import json
+import os
+from typing import Any, Tuple
+
+import pystac
+from omegaconf import OmegaConf
+
+from multiearth.api import work
+from multiearth.assets import ExtractAsset
+from multiearth.config import ConfigSchema, ProviderKey
+from multiearth.provider.radiant_ml import RadiantMLHub
+from multiearth.util.work_queue import SQLiteWorkQueue
+
+
+def _config(tmp_path: Any) -> Any:
+    """Return the config of a planner and its workers."""
+    cfg: Any = OmegaConf.structured(ConfigSchema)
+    cfg.run_id = "test"
+    cfg.system.cache_dir = str(tmp_path / "cache")
+    cfg.system.log_outdir = str(tmp_path / "logs")
+    # one worker, which never waits for the leases of others
+    cfg.system.max_concurrent_extractions = 1
+    cfg.system.max_download_attempts = 2
+    cfg.system.work_queue = str(tmp_path / "queue.db")
+    os.makedirs(cfg.system.log_outdir)
+    return cfg
+
+
+def test_workers_rebuild_downloads_from_json_jobs(
+    server_dir: Tuple[Any, str], tmp_path: Any
+) -> None:
+    """Jobs are JSON records, which workers download with a rebuilt provider."""
+    root, url = server_dir
+    # checked by check_authorization
+    (root / "search").write_text("{}")
+    (root / "a.bin").write_bytes(b"a")
+    (root / "b.bin").write_bytes(b"b")
+    cfg = _config(tmp_path)
+    pvdr = RadiantMLHub(ProviderKey.RADIANT, cfg, [], url)
+    queue = SQLiteWorkQueue(cfg.system.work_queue)
+    jobs = []
+    for name in ["a", "b", "missing"]:
+        ast = ExtractAsset(
+            f"item_{name}",
+            name,
+            "",
+            pystac.Asset(f"{url}/{name}.bin"),
+            str(tmp_path / "out" / f"{name}.bin"),
+        )
+        jobs.append((ast.outfile, json.dumps(pvdr._queue_job(ast)).encode()))
+    assert queue.put(jobs, cfg.system.max_download_attempts) == 3
+
+    assert not work(cfg)
+    assert (tmp_path / "out" / "a.bin").read_bytes() == b"a"
+    assert (tmp_path / "out" / "b.bin").read_bytes() == b"b"
+    assert queue.counts() == dict(pending=0, leased=0, done=2, failed=1)
+    assert [id for id, _ in queue.failed_jobs()] == [str(tmp_path / "out/missing.bin")]
+    # the payloads are plain data, with the provider options but no code
+    job = json.loads(jobs[0][1])
+    assert job["provider"] == "RADIANT"
+    assert job["provider_kwargs"] == {"client_url": url}
+
+    # putting the failed job again requeues it
+    (root / "missing.bin").write_bytes(b"found")
+    assert queue.put(jobs, cfg.system.max_download_attempts) == 1
+    assert work(cfg)
+    assert (tmp_path / "out" / "missing.bin").read_bytes() == b"found"
+
+
+def test_invalid_payload_fails_without_running(tmp_path: Any) -> None:
+    """A payload that isn't a JSON job fails, e.g. one written by an older version."""
+    cfg = _config(tmp_path)
+
+    queue = SQLiteWorkQueue(cfg.system.work_queue)
+    queue.put([("job", b"\x80\x04\x95not json")], 1)
+    assert not work(cfg)
+    assert queue.counts()["failed"] == 1